@@ -18,8 +18,13 @@
 # 02110-1301, USA
 """Invoke rdiff utility to make signatures, deltas, or patch"""
 
+import io
+import os
+import tempfile
+
 from rdiff_backup import rpath, hash, librsync
 from rdiffbackup.singletons import log, specifics
+from rdiffbackup.utils import compressors
 
 
 def get_signature(rp, blocksize=None):
@@ -35,8 +40,12 @@ def get_signature(rp, blocksize=None):
     return librsync.SigFile(rp.open("rb"), blocksize)
 
 
-def get_delta_sigrp_hash(rp_signature, rp_new):
-    """Like above but also calculate hash of new as close() value"""
+def get_delta_sigrp_hash(rp_signature, rp_new, on_close=None):
+    """
+    Like above but also calculate hash of new as close() value
+
+    The optional on_close function is passed to the hash.FileWrapper.
+    """
     log.Log(
         "Getting delta (with hash) of file {fi} with signature {si}".format(
             fi=rp_new, si=rp_signature
@@ -45,32 +54,130 @@ def get_delta_sigrp_hash(rp_signature, rp_new):
     )
     try:
         return librsync.DeltaFile(
-            rp_signature.open("rb"), hash.FileWrapper(rp_new.open("rb"))
+            rp_signature.open("rb"), hash.FileWrapper(rp_new.open("rb"), on_close)
         )
     except OSError:
         rp_signature.close_if_necessary()
         raise
 
 
-def write_delta(basis, new, delta, compress=None):
-    """Write rdiff delta which brings basis to new"""
+def get_signature_data(path, blocksize=None):
+    """
+    Return the complete signature of the local file at path as bytes
+
+    Only simple types are used as parameters and return value, so that the
+    function can be called in a worker process.
+    """
+    with open(path, "rb") as basis_fp:
+        if not blocksize:
+            blocksize = _find_blocksize(os.fstat(basis_fp.fileno()).st_size)
+        sig_file = librsync.SigFile(basis_fp, blocksize)
+        sig_data = sig_file.read()
+        sig_file.close()
+    return sig_data
+
+
+def get_delta_path_hash(signature_data, path, temp_dir):
+    """
+    Return tuple of delta path and SHA1 hex digest of the local file at path
+
+    The delta is computed against the signature given as bytes and written
+    to a temporary file created in temp_dir, so that the memory used doesn't
+    depend on the size of the file, the caller being responsible for
+    removing it, see DeltaTempFile.
+    The function is meant to be called in a worker process like the one above.
+    """
+    delta_file = librsync.DeltaFile(signature_data, hash.FileWrapper(open(path, "rb")))
+    try:
+        temp_fd, temp_path = tempfile.mkstemp(prefix="rdiff-backup-", dir=temp_dir)
+        try:
+            with os.fdopen(temp_fd, "wb") as temp_fp:
+                rpath.copyfileobj(delta_file, temp_fp)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    finally:
+        report = delta_file.close()
+    return (temp_path, report.sha1_digest)
+
+
+def patch_data_to_temp(paths, temp_dir):
+    """
+    Apply a chain of deltas to a basis file, write the result to a temp file
+
+    paths is a list of tuples (path, compression suffix or None), the basis
+    followed by the deltas to apply on top of each other, like the relevant
+    increments of a restored file.  The temporary file is created in temp_dir
+    and its path returned, the caller being responsible for removing it.
+    The function is meant to be called in a worker process like the ones above.
+    """
+    if len(paths) == 1:
+        current_fp = _open_data(*paths[0])
+    else:
+        current_fp = _open_seekable_data(*paths[0], temp_dir)
+    try:
+        for delta_path, delta_suffix in paths[1:]:
+            current_fp = librsync.LazyPatchedFile(
+                current_fp, _open_seekable_data(delta_path, delta_suffix, temp_dir)
+            )
+        temp_fd, temp_path = tempfile.mkstemp(prefix="rdiff-backup-", dir=temp_dir)
+        try:
+            with os.fdopen(temp_fd, "wb") as temp_fp:
+                rpath.copyfileobj(current_fp, temp_fp)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    finally:
+        current_fp.close()
+    return temp_path
+
+
+class DeltaTempFile(io.FileIO):
+    """
+    Delta written to a temporary file by get_delta_path_hash
+
+    Like the file returned by get_delta_sigrp_hash, its close value is a hash
+    Report with the SHA1 digest of the new file.  The temporary file is
+    removed once closed.
+    """
+
+    def __init__(self, temp_path, sha1_digest):
+        super().__init__(
+            temp_path,
+            "rb",
+            opener=lambda path, flags: os.open(
+                path, flags | getattr(os, "O_TEMPORARY", 0)
+            ),
+        )
+        if not hasattr(os, "O_TEMPORARY"):
+            os.unlink(temp_path)  # data stays available until closed
+        self.sha1_digest = sha1_digest
+
+    def close(self):
+        super().close()
+        return hash.Report(None, self.sha1_digest)
+
+
+def write_delta(basis, new, delta, compress=None, basis_signature=None):
+    """
+    Write rdiff delta which brings basis to new
+
+    If the signature of basis is already known, e.g. because it has been
+    computed while basis was written, it can be given as bytes to avoid
+    reading basis again.
+    """
     log.Log(
         "Writing delta {de} from basis {ba} to new {ne}".format(
             ba=basis, ne=new, de=delta
         ),
         log.DEBUG,
     )
-    deltafile = librsync.DeltaFile(get_signature(basis), new.open("rb"))
+    if basis_signature is None:
+        basis_signature = get_signature(basis)
+    deltafile = librsync.DeltaFile(basis_signature, new.open("rb"))
     delta.write_from_fileobj(deltafile, compress)
 
 
-def write_patched_fp(basis_fp, delta_fp, out_fp):
-    """Write patched file to out_fp given input fps.  Closes input files"""
-    rpath.copyfileobj(librsync.PatchedFile(basis_fp, delta_fp), out_fp)
-    basis_fp.close()
-    delta_fp.close()
-
-
 def patch_local(rp_basis, rp_delta, outrp=None, delta_compressed=None):
     """
     Patch routine that must be run locally, writes to outrp
@@ -88,8 +195,8 @@ def patch_local(rp_basis, rp_delta, outrp=None, delta_compressed=None):
         conn=rp_basis.conn
     )
     if delta_compressed:
-        deltafile = rp_delta.open("rb", 1)
-    else:
+        deltafile = rp_delta.open("rb", delta_compressed)
+    else:  # the delta might be a RORPath with attached file
         deltafile = rp_delta.open("rb")
     patchfile = librsync.PatchedFile(rp_basis.open("rb"), deltafile)
     if outrp:
@@ -98,6 +205,77 @@ def patch_local(rp_basis, rp_delta, outrp=None, delta_compressed=None):
         return _write_via_tempfile(patchfile, rp_basis)
 
 
+def patch_local_with_signature(rp_basis, rp_delta, outrp, size=None):
+    """
+    Like patch_local but also return the signature of outrp
+
+    The signature is calculated while the patched file is being written,
+    using a blocksize fitting the expected size of outrp.
+    The return value is a tuple made of the close value of the delta and of
+    the signature as bytes.
+    """
+    assert (
+        rp_basis.conn is specifics.local_connection
+    ), "This function must run locally and not over '{conn}'.".format(
+        conn=rp_basis.conn
+    )
+    if size is None:
+        size = rp_basis.getsize()
+    patchfile = _SignatureWrapper(
+        librsync.PatchedFile(rp_basis.open("rb"), rp_delta.open("rb")),
+        _find_blocksize(size),
+    )
+    close_value = outrp.write_from_fileobj(patchfile)
+    return (close_value, patchfile.signature)
+
+
+class _SignatureWrapper:
+    """
+    Wrapper around a file-like object calculating its signature
+
+    Like hash.FileWrapper, it is only meant for files read in a single pass,
+    the signature is available once the file has been closed.
+    """
+
+    def __init__(self, fileobj, blocksize):
+        self.fileobj = fileobj
+        self.sig_gen = librsync.SigGenerator(blocksize)
+        self.signature = None
+
+    def read(self, length=-1):
+        buf = self.fileobj.read(length)
+        self.sig_gen.update(buf)
+        return buf
+
+    def close(self):
+        self.signature = self.sig_gen.get_sig()
+        return self.fileobj.close()
+
+
+def _open_data(path, suffix):
+    """Open the local file at path for reading, decompressed if suffix"""
+    if suffix:
+        return compressors.open_file(path, "rb", compressors.get_name(suffix))
+    return open(path, "rb")
+
+
+def _open_seekable_data(path, suffix, temp_dir):
+    """
+    Open the local file at path for seeking around in it
+
+    Each backward seek in a compressed file decompresses it again from its
+    start, hence a compressed file is decompressed to a temporary file.
+    """
+    data_fp = _open_data(path, suffix)
+    if not suffix:
+        return data_fp
+    temp_fp = tempfile.TemporaryFile(dir=temp_dir)
+    with data_fp:
+        rpath.copyfileobj(data_fp, temp_fp)
+    temp_fp.seek(0)
+    return temp_fp
+
+
 def _find_blocksize(file_len):
     """
     Return a reasonable block size to use on files of length file_len
@@ -106,6 +106,11 @@ def reset_restrict_path(rp):
     _restrict_path_list = _restrict_path.split(b"/")
 
 
+def is_read_only():
+    """Return True if this process must not write to disk"""
+    return _security_level == "read-only"
+
+
 def vet_request(request, arglist):
     """Examine request for security violations"""
     if _security_level == "override":
@@ -205,6 +210,7 @@ def _set_allowed_requests(sec_class, sec_level):
         # "gzip.GzipFile",  # ??? perhaps covered by VirtualFile
         # "open",  # ??? perhaps covered by VirtualFile
         # API >=300
+        "BatchedRun",  # connection.BatchedRun, each call is vetted separately
         "_repo_shadow.RepoShadow.init",
         "_repo_shadow.RepoShadow.check",
         "_repo_shadow.RepoShadow.setup",
@@ -303,6 +309,7 @@ def _set_allowed_requests(sec_class, sec_level):
                 # API >= 300
                 "log.Log.set_verbosity",  # FIXME can we pipe this through?
                 "log.Log.set_parsable",
+                "SetConnections.set_wire_compression_remote",
             ]
         )
     return requests
@@ -322,32 +329,61 @@ def _vet_filename(request, arglist):
     _vet_rpath(rpath.RPath(specifics.local_connection, filename), request, arglist)
 
 
+def vet_path(path, writable=False):
+    """
+    Raise a Violation if a server may not use the local path given
+
+    Paths handed over by the client in values, instead of as arguments of
+    a request, aren't vetted with the request, hence the server must vet
+    them before use.  They must be within the restrict path and can't be
+    written in read-only mode.
+    """
+    if not specifics.server or _security_level == "override":
+        return
+    rp = rpath.RPath(specifics.local_connection, path)
+    if writable and is_read_only():
+        reason = "path '{pa}' can't be written".format(pa=rp.normalize().path)
+    else:
+        reason = _get_restrict_violation(rp)
+    if reason:
+        raise Violation(
+            "\nWARNING: Security Violation due to {sv}"
+            "\nCompared to {path} restricted {level}.\n".format(
+                sv=reason, path=_restrict_path, level=_security_level
+            )
+        )
+
+
 def _vet_rpath(rp, request, arglist):
     """Internal function to validate that a specific path isn't restricted"""
-    if _restrict_path and rp.conn is specifics.local_connection:
-        norm_path = rp.normalize().path
-        components = norm_path.split(b"/")
-        # we can't properly assess paths with parent directory, so we reject
-        if b".." in components:
-            _raise_violation(
-                "normalized path '{np}' can't contain "
-                "parent directory '..'".format(np=norm_path),
-                request,
-                arglist,
-            )
-        # the restrict path being root is a special case, we could check it
-        # earlier but we would miss the previous checks
-        if _restrict_path == b"/":
-            return
-        # the normalized path must begin with the restricted path
-        # using lists, we avoid /bla/foobar being deemed within /bla/foo
-        if components[: len(_restrict_path_list)] != _restrict_path_list:
-            _raise_violation(
-                "normalized path '{np}' not within restricted "
-                "path '{rp}'".format(np=norm_path, rp=_restrict_path),
-                request,
-                arglist,
-            )
+    if rp.conn is specifics.local_connection:
+        reason = _get_restrict_violation(rp)
+        if reason:
+            _raise_violation(reason, request, arglist)
+
+
+def _get_restrict_violation(rp):
+    """Return the reason why the local rp isn't allowed, None if it is"""
+    if not _restrict_path:
+        return None
+    norm_path = rp.normalize().path
+    components = norm_path.split(b"/")
+    # we can't properly assess paths with parent directory, so we reject
+    if b".." in components:
+        return "normalized path '{np}' can't contain parent directory '..'".format(
+            np=norm_path
+        )
+    # the restrict path being root is a special case, we could check it
+    # earlier but we would miss the previous checks
+    if _restrict_path == b"/":
+        return None
+    # the normalized path must begin with the restricted path
+    # using lists, we avoid /bla/foobar being deemed within /bla/foo
+    if components[: len(_restrict_path_list)] != _restrict_path_list:
+        return "normalized path '{np}' not within restricted path '{rp}'".format(
+            np=norm_path, rp=_restrict_path
+        )
+    return None
 
 
 def _raise_violation(reason, request, arglist):
@@ -28,7 +28,7 @@ import os
 import re
 import subprocess
 import sys
-from rdiff_backup import connection, rpath
+from rdiff_backup import connection, rpath, Security
 from rdiffbackup.singletons import consts, generics, log, specifics
 from rdiffbackup.utils import convert
 
@@ -103,13 +103,16 @@ def get_cmd_pairs(
     return cmd_pairs
 
 
-def get_connected_rpath(cmd_pair):
+def get_connected_rpath(cmd_pair, wire_compression=False):
     """
     Return normalized RPath from command pair (remote_cmd, filename)
+
+    If wire_compression is true, the data exchanged with a remote location
+    is compressed on the connection.
     """
     cmd, filename = cmd_pair
     if cmd:
-        conn = _init_connection(cmd)
+        conn = _init_connection(cmd, wire_compression)
     else:
         conn = specifics.local_connection
     if conn:
@@ -126,6 +129,12 @@ def init_connection_remote(conn_number):
     specifics.connection_dict[conn_number] = specifics.local_connection
 
 
+# @API(set_wire_compression_remote, 300)
+def set_wire_compression_remote(level):
+    """Run on server side to compress the data sent back to the client"""
+    specifics.connections[1].set_compression(level)
+
+
 # @API(add_redirected_conn, 200)
 def add_redirected_conn(conn_number):
     """Run on server side - tell about redirected connection"""
@@ -311,12 +320,13 @@ def _fill_schema(host_info, cmd_schema):
         )
 
 
-def _init_connection(remote_cmd):
+def _init_connection(remote_cmd, wire_compression=False):
     """Run remote_cmd, register connection, and then return it
 
     If remote_cmd is None, then the local connection will be
     returned.  This also updates some settings on the remote side,
-    like global settings, its connection number, and verbosity.
+    like global settings, its connection number, and verbosity, and
+    activates compression of the connection if wire_compression is true.
 
     """
     if not remote_cmd:
@@ -352,6 +362,8 @@ def _init_connection(remote_cmd):
     log.Log("Registering connection {co}".format(co=conn_number), log.DEBUG)
     _init_connection_routing(conn, conn_number, remote_cmd)
     _init_connection_settings(conn)
+    if wire_compression:
+        _init_connection_compression(conn)
     return conn
 
 
@@ -514,6 +526,27 @@ def _init_connection_settings(conn):
     generics.dispatch_settings(conn)
 
 
+def _init_connection_compression(conn):
+    """Compress the data sent in both directions over the new conn"""
+    try:
+        conn.SetConnections.set_wire_compression_remote(consts.WIRE_COMPRESSION_LEVEL)
+    except (NameError, Security.Violation) as exc:
+        # the remote side doesn't know or doesn't accept wire compression
+        log.Log(
+            "Remote side doesn't support wire compression, continuing "
+            "without it due to exception '{ex}'".format(ex=exc),
+            log.WARNING,
+        )
+        return
+    conn.set_compression(consts.WIRE_COMPRESSION_LEVEL)
+    log.Log(
+        "Wire compression activated with level {lv} on connection {cn}".format(
+            lv=consts.WIRE_COMPRESSION_LEVEL, cn=conn.conn_number
+        ),
+        log.INFO,
+    )
+
+
 def _test_connection(conn_number, rp):
     """Test connection if it is not None, else skip. Returns True/False
     depending on test results."""
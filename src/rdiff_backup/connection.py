@@ -18,14 +18,19 @@
 # 02110-1301, USA
 """Support code for remote execution and data transfer"""
 
+import collections
+import concurrent.futures
 import errno
 import importlib
+import io
+import os
 import pickle
 import subprocess
 import sys
 import time
 import traceback
 import typing
+import zlib
 
 from rdiff_backup import (
     iterfile,
@@ -81,6 +86,10 @@ class Connection:
     def __getattr__(self, name: str) -> typing.Any:
         pass  # abstract method
 
+    def batch(self, max_calls=None):
+        """Return a new CallBatch gathering calls to this connection"""
+        return CallBatch(self, max_calls)
+
     @classmethod
     def import_modules(cls):
         """
@@ -110,6 +119,7 @@ class Connection:
             cls.globals[name] = importlib.import_module(module)
         local_elements = {
             "LocalConnection": LocalConnection,  # for test purposes
+            "BatchedRun": BatchedRun,
             "RedirectedRun": RedirectedRun,
             "VirtualFile": VirtualFile,
         }
@@ -215,7 +225,10 @@ class LowLevelPipeConnection(Connection):
     R - RPath
     S - StoredRPath
     c - PipeConnection object
+    z - compressed, the type of the compressed thing is the first byte
 
+    Compressed things are only sent once compression has been activated with
+    set_compression, but they are always understood when received.
     """
 
     def __init__(self, inpipe, outpipe):
@@ -223,6 +236,11 @@ class LowLevelPipeConnection(Connection):
         super().__init__()
         self.inpipe = inpipe
         self.outpipe = outpipe
+        self.compression_level = 0
+
+    def set_compression(self, level):
+        """Set the zlib level used to compress data sent, 0 to deactivate"""
+        self.compression_level = level
 
     def __str__(self):
         """Return string version
@@ -314,15 +332,47 @@ class LowLevelPipeConnection(Connection):
         ), "Header type {hdr} can only have one letter/byte".format(hdr=headerchar)
         if isinstance(headerchar, str):  # it can only be an ASCII character
             headerchar = headerchar.encode("ascii")
+        buffers = (data,)
+        if self.compression_level and len(data) >= consts.WIRE_COMPRESSION_MIN_SIZE:
+            compressed = zlib.compress(data, self.compression_level)
+            # data which doesn't compress well is sent as it is
+            if len(compressed) < len(data) * consts.WIRE_COMPRESSION_MAX_RATIO:
+                buffers = (headerchar, compressed)
+                headerchar = b"z"
+        header = (
+            headerchar + self._i2b(req_num, 1) + self._i2b(sum(map(len, buffers)), 7)
+        )
         try:
-            self.outpipe.write(
-                headerchar + self._i2b(req_num, 1) + self._i2b(len(data), 7)
-            )
-            self.outpipe.write(data)
-            self.outpipe.flush()
-        except (OSError, AttributeError):
+            self._write_buffers((header,) + buffers)
+        except (OSError, AttributeError, ValueError):
             raise ConnectionWriteError()
 
+    def _write_buffers(self, buffers):
+        """
+        Write the buffers one after the other to the pipe and flush it
+
+        If the pipe has a file descriptor, the buffers are gathered by the
+        kernel with writev, instead of being copied to the buffer of the pipe
+        or joined beforehand.
+        """
+        try:
+            out_fd = self.outpipe.fileno()
+        except (io.UnsupportedOperation, AttributeError):
+            out_fd = None
+        if out_fd is None or not hasattr(os, "writev"):
+            for buf in buffers:
+                self.outpipe.write(buf)
+            self.outpipe.flush()
+            return
+        self.outpipe.flush()  # what the pipe buffered must be written first
+        views = collections.deque(memoryview(buf).cast("B") for buf in buffers if buf)
+        while views:
+            written = os.writev(out_fd, views)
+            while views and written >= len(views[0]):
+                written -= len(views.popleft())
+            if written:
+                views[0] = views[0][written:]
+
     def _read(self, length):
         """Read length bytes from inpipe, returning result"""
         try:
@@ -365,6 +415,17 @@ class LowLevelPipeConnection(Connection):
                 "(problem probably originated remotely)".format(hdr=header_string)
             )
 
+        if format_string == b"z":
+            try:
+                format_string, data = data[0:1], zlib.decompress(data[1:])
+            except zlib.error as exc:
+                raise ConnectionReadError(
+                    "Compressed data in <{hdr}> couldn't be decompressed due "
+                    "to '{ex}' (problem probably originated remotely)".format(
+                        hdr=header_string, ex=exc
+                    )
+                )
+
         if format_string == b"o":
             result = pickle.loads(data)
         elif format_string == b"b":
@@ -472,13 +533,8 @@ class PipeConnection(LowLevelPipeConnection):
             self._put(arg, req_num)
         result = self._get_response(req_num)
         self.unused_request_numbers.add(req_num)
-        if isinstance(result, OSError) and hasattr(result, "errno_str"):
-            # OSError code are specific to each platform.
-            # Let convert the errno to current platform.
-            result.errno = getattr(errno, result.errno_str, result.errno)
-            raise result
-        elif isinstance(result, Exception):
-            raise result
+        if isinstance(result, Exception):
+            raise _import_exception(result)
         elif isinstance(result, SystemExit):
             raise result
         elif isinstance(result, KeyboardInterrupt):
@@ -569,13 +625,7 @@ class PipeConnection(LowLevelPipeConnection):
 
     def _extract_exception(self):
         """Return active exception"""
-        result = sys.exc_info()[1]
-        # OSError code are specific to the platform. Send back errno as string.
-        if isinstance(result, OSError) and result.errno:
-            result.errno_str = errno.errorcode.get(result.errno, "EUNKWN")
-            result.strerror = "[original: Errno {re} {rs}] {st}".format(
-                re=result.errno, rs=result.errno_str, st=result.strerror
-            )
+        result = _export_exception(sys.exc_info()[1])
         if robust.is_routine_fatal(result):
             raise  # Fatal error--No logging necessary, but connection down
         if log.Log.file_verbosity >= log.INFO or log.Log.term_verbosity >= log.INFO:
@@ -666,6 +716,71 @@ class EmulateCallableRedirected:
         )
 
 
+class CallBatch:
+    """
+    Gather calls to a connection and send them in a single round trip
+
+    Each call immediately returns a future, whose result is only available
+    once the batch has been flushed, either explicitly, automatically when
+    max_calls calls have been gathered, or when leaving the with-block:
+
+        with conn.batch() as batch:
+            futures = [batch.call("os.lstat", path) for path in paths]
+        stats = [future.result() for future in futures]
+
+    The calls are executed in order on the other side, each one being vetted
+    like a single request, and the failure of one call doesn't prevent the
+    next ones from being executed. The arguments and results must be
+    transferable in a pickled form, i.e. no iterators or file objects.
+    """
+
+    def __init__(self, connection, max_calls=None):
+        self.connection = connection
+        self.max_calls = max_calls or consts.BATCH_MAX_CALLS
+        self._calls = []
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def call(self, function_string, *args):
+        """Add a call to the batch and return the future of its result"""
+        future = concurrent.futures.Future()
+        self._calls.append((function_string, args))
+        self._futures.append(future)
+        if len(self._calls) >= self.max_calls:
+            self.flush()
+        return future
+
+    def flush(self):
+        """Execute all gathered calls and set the results of their futures"""
+        if not self._calls:
+            return
+        calls, futures = self._calls, self._futures
+        self._calls, self._futures = [], []
+        if isinstance(self.connection, LocalConnection):
+            for future, (function_string, args) in zip(futures, calls):
+                try:
+                    future.set_result(self.connection.reval(function_string, *args))
+                except Exception as exc:
+                    future.set_exception(exc)
+            return
+        try:
+            results = self.connection.reval("BatchedRun", calls)
+        except Exception as exc:
+            for future in futures:
+                future.set_exception(exc)
+            raise
+        for future, (success, result) in zip(futures, results):
+            if success:
+                future.set_result(result)
+            else:
+                future.set_exception(_import_exception(result))
+
+
 class VirtualFile:
     """When the client asks for a file over the connection, it gets this
 
@@ -673,6 +788,8 @@ class VirtualFile:
     The class's dictionary is used by the server to associate each
     with a unique file number.
 
+    Files read sequentially with the same length are read ahead in batches
+    of consts.VIRTUAL_FILE_READAHEAD blocks, to spare round trips.
     """
 
     # The following are used by the server
@@ -710,16 +827,71 @@ class VirtualFile:
     def __init__(self, connection, id):
         self.connection = connection
         self.id = id
+        self._buffer = b""
+        self._pending = collections.deque()
+        self._last_length = None
+        self._eof = False
 
     def read(self, length=None):
-        return self.connection.VirtualFile.readfromid(self.id, length)
+        if length is None or length < 0:
+            data = self._read_pending()
+            if not self._eof:
+                data += self.connection.VirtualFile.readfromid(self.id, None)
+            return data
+        if (
+            length
+            and length == self._last_length
+            and not self._buffer
+            and not self._pending
+            and not self._eof
+        ):
+            self._read_ahead(length)
+        self._last_length = length
+        if not self._buffer and not self._pending:
+            if self._eof:
+                return b""
+            return self.connection.VirtualFile.readfromid(self.id, length)
+        while len(self._buffer) < length and self._pending:
+            self._add_pending()
+        if len(self._buffer) < length and not self._eof:
+            self._buffer += self.connection.VirtualFile.readfromid(
+                self.id, length - len(self._buffer)
+            )
+        data, self._buffer = self._buffer[:length], self._buffer[length:]
+        return data
 
     def write(self, buf):
         return self.connection.VirtualFile.writetoid(self.id, buf)
 
     def close(self):
+        self._buffer = b""
+        self._pending.clear()
         return self.connection.VirtualFile.closebyid(self.id)
 
+    def _read_ahead(self, length):
+        """Read the next blocks of the given length in a single batch"""
+        with self.connection.batch() as batch:
+            for i in range(consts.VIRTUAL_FILE_READAHEAD):
+                self._pending.append(
+                    batch.call("VirtualFile.readfromid", self.id, length)
+                )
+
+    def _add_pending(self):
+        """Add the next block read ahead to the buffer, note end of file"""
+        data = self._pending.popleft().result()
+        if data:
+            self._buffer += data
+        else:
+            self._eof = True
+            self._pending.clear()
+
+    def _read_pending(self):
+        """Return all data read ahead and not yet consumed"""
+        while self._pending:
+            self._add_pending()
+        data, self._buffer = self._buffer, b""
+        return data
+
 
 # @API(RedirectedRun, 200)
 def RedirectedRun(conn_number, func, *args):
@@ -740,6 +912,52 @@ def RedirectedRun(conn_number, func, *args):
     return conn.reval(func, *args)
 
 
+# @API(BatchedRun, 300)
+def BatchedRun(calls):
+    """
+    Run a list of calls and return the list of their outcomes
+
+    Each call is a tuple made of a function string and a tuple of arguments,
+    and each outcome is a tuple made of a success flag and either the result
+    of the call or the exception it raised.
+    Each call is vetted on its own, exactly like a single request would be.
+    """
+    outcomes = []
+    for function_string, args in calls:
+        try:
+            Security.vet_request(
+                ConnectionRequest(function_string, len(args)), list(args)
+            )
+            result = Connection._eval(function_string)(*args)
+        except Exception as exc:
+            if robust.is_routine_fatal(exc):
+                raise
+            outcomes.append((False, _export_exception(exc)))
+        else:
+            outcomes.append((True, result))
+    return outcomes
+
+
+def _export_exception(exc):
+    """Prepare an exception to be sent back over the connection"""
+    # OSError code are specific to the platform. Send back errno as string.
+    if isinstance(exc, OSError) and exc.errno:
+        exc.errno_str = errno.errorcode.get(exc.errno, "EUNKWN")
+        exc.strerror = "[original: Errno {re} {rs}] {st}".format(
+            re=exc.errno, rs=exc.errno_str, st=exc.strerror
+        )
+    return exc
+
+
+def _import_exception(exc):
+    """Adapt an exception received from the other side of the connection"""
+    if isinstance(exc, OSError) and hasattr(exc, "errno_str"):
+        # OSError code are specific to each platform.
+        # Let convert the errno to current platform.
+        exc.errno = getattr(errno, exc.errno_str, exc.errno)
+    return exc
+
+
 specifics.local_connection = LocalConnection()
 specifics.connections.append(specifics.local_connection)
 # Following changed by server in SetConnections
@@ -19,8 +19,12 @@
 """Contains a file wrapper that returns a hash on close"""
 
 import hashlib
+import os
 from rdiffbackup.singletons import consts, specifics
 
+# block of zeros used to hash the holes of sparse files
+_ZERO_BLOCK = memoryview(bytes(consts.BLOCKSIZE))
+
 
 class FileWrapper:
     """Wrapper around a file-like object
@@ -31,22 +35,45 @@ class FileWrapper:
 
     Currently this just calculates a sha1sum of the datastream.
 
+    If given, the on_close function is called with the hex digest when
+    the file is closed, but only if it has been read through to its end.
     """
 
-    def __init__(self, fileobj):
+    def __init__(self, fileobj, on_close=None):
         self.fileobj = fileobj
         self.sha1 = hashlib.sha1()  # nosec B324 hashlib_insecure_functions
         self.closed = False
+        self.on_close = on_close
+        self._at_end = False
 
     def read(self, length=-1):
         assert not self.closed, "You can't read from an already closed file."
         buf = self.fileobj.read(length)
         self.sha1.update(buf)
+        if not buf or length is None or length < 0:
+            self._at_end = True
         return buf
 
+    def skip_zeros(self, length):
+        """
+        Skip length bytes known to be zeros, like a hole of a sparse file
+
+        The hash is updated without reading them, which is only possible if
+        the wrapped file object is seekable.
+        """
+        assert not self.closed, "You can't skip in an already closed file."
+        self.fileobj.seek(length, os.SEEK_CUR)
+        while length > 0:
+            chunk = min(length, len(_ZERO_BLOCK))
+            self.sha1.update(_ZERO_BLOCK[:chunk])
+            length -= chunk
+
     def close(self):
         self.closed = True
-        return Report(self.fileobj.close(), self.sha1.hexdigest())
+        report = Report(self.fileobj.close(), self.sha1.hexdigest())
+        if self.on_close and self._at_end:
+            self.on_close(report.sha1_digest)
+        return report
 
 
 class Report:
@@ -20,7 +20,6 @@
 
 import errno
 import pickle
-import array
 from rdiff_backup import robust, rpath
 from rdiffbackup.singletons import consts
 
@@ -29,6 +28,54 @@ class IterFileException(Exception):
     pass
 
 
+class _ChunkBuffer:
+    """
+    Buffer keeping the chunks added to it as they are
+
+    The chunks are only joined when they are read, so that each byte is
+    copied only once on its way from the iterator to the connection.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, *chunks):
+        """Add one or more bytes-like chunks at the end of the buffer"""
+        for chunk in chunks:
+            if chunk:
+                self._chunks.append(chunk)
+                self._size += len(chunk)
+
+    def read(self, length=None):
+        """Remove and return the first length bytes, all if length is None"""
+        if length is None or length >= self._size:
+            if len(self._chunks) == 1 and type(self._chunks[0]) is bytes:
+                result = self._chunks[0]
+            else:
+                result = b"".join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            return result
+        result = []
+        missing = length
+        while missing:
+            chunk = self._chunks[0]
+            if len(chunk) <= missing:
+                result.append(chunk)
+                del self._chunks[0]
+                missing -= len(chunk)
+            else:
+                result.append(chunk[:missing])
+                self._chunks[0] = chunk[missing:]
+                missing = 0
+        self._size -= length
+        return b"".join(result)
+
+
 class UnwrapFile:
     """Contains some basic methods for parsing a file containing an iter"""
 
@@ -146,15 +193,18 @@ class IterVirtualFile(UnwrapFile):
         else:
             real_len = min(length, len(self.buffer))
 
-        return_val = self.buffer[:real_len]
-        self.buffer = self.buffer[real_len:]
+        if real_len == len(self.buffer):  # spare a copy of the whole buffer
+            return_val, self.buffer = self.buffer, b""
+        else:
+            return_val = self.buffer[:real_len]
+            self.buffer = self.buffer[real_len:]
         return return_val
 
     def close(self):
         """Currently just reads whats left and discards it"""
         while self.iwf.currently_in_file:
             self._add_to_buffer()
-            self.buffer = ""
+            self.buffer = b""
         self.closed = 1
         return self.close_value
 
@@ -169,7 +219,10 @@ class IterVirtualFile(UnwrapFile):
             raise iwf_data
         elif iwf_type == b"c":
             if iwf_data:
-                self.buffer += iwf_data
+                if self.buffer:
+                    self.buffer += iwf_data
+                else:
+                    self.buffer = iwf_data
                 return 1
             else:
                 self._set_close_val()
@@ -212,20 +265,17 @@ class FileWrappingIter:
     def __init__(self, iter):
         """Initialize with iter"""
         self.iter = iter
-        self.array_buf = array.array("b")
+        self.buffer = _ChunkBuffer()
         self.currently_in_file = None
         self.closed = None
 
     def read(self, length):
         """Return next length bytes in file"""
         assert not self.closed, "Can't read from a closed file."
-        while len(self.array_buf) < length:
+        while len(self.buffer) < length:
             if not self._add_to_buffer():
                 break
-
-        result = self.array_buf[:length].tobytes()
-        del self.array_buf[:length]
-        return result
+        return self.buffer.read(length)
 
     def close(self):
         self.closed = 1
@@ -249,17 +299,15 @@ class FileWrappingIter:
                 self._add_from_file(b"f")
             else:
                 pickled_data = pickle.dumps(currentobj, consts.PICKLE_PROTOCOL)
-                self.array_buf.frombytes(b"o")
-                self.array_buf.frombytes(self._i2b(len(pickled_data), 7))
-                self.array_buf.frombytes(pickled_data)
+                self.buffer.add(b"o" + self._i2b(len(pickled_data), 7), pickled_data)
         return 1
 
     def _add_from_file(self, prefix_letter):
-        """Read a chunk from the current file and add to array_buf
+        """Read a chunk from the current file and add to the buffer
 
         prefix_letter and the length will be prepended to the file
         data.  If there is an exception while reading the file, the
-        exception will be added to array_buf instead.
+        exception will be added to the buffer instead.
 
         """
         buf = robust.check_common_error(
@@ -268,16 +316,16 @@ class FileWrappingIter:
         if buf is None:  # error occurred above, encode exception
             self.currently_in_file = None
             excstr = pickle.dumps(self.last_exception, consts.PICKLE_PROTOCOL)
-            total = b"".join((b"e", self._i2b(len(excstr), 7), excstr))
+            self.buffer.add(b"e" + self._i2b(len(excstr), 7), excstr)
         else:
-            total = b"".join((prefix_letter, self._i2b(len(buf), 7), buf))
-            if buf == b"":  # end of file
+            # the data chunk is kept as is and only copied once, when read
+            self.buffer.add(prefix_letter + self._i2b(len(buf), 7), buf)
+            if not buf:  # end of file
                 cstr = pickle.dumps(
                     self.currently_in_file.close(), consts.PICKLE_PROTOCOL
                 )
                 self.currently_in_file = None
-                total += b"".join((b"h", self._i2b(len(cstr), 7), cstr))
-        self.array_buf.frombytes(total)
+                self.buffer.add(b"h" + self._i2b(len(cstr), 7), cstr)
 
     def _read_error_handler(self, exc, blocksize):
         """Log error when reading from file"""
@@ -353,22 +401,18 @@ class MiscIterToFile(FileWrappingIter):
         )
         if length is None:
             while (
-                len(self.array_buf) < self.max_buffer_bytes
+                len(self.buffer) < self.max_buffer_bytes
                 and self.rorps_in_buffer < self.max_buffer_rps
             ):
                 if not self._add_to_buffer():
                     break
-
-            result = self.array_buf.tobytes()
-            del self.array_buf[:]
             self.rorps_in_buffer = 0
-            return result
+            return self.buffer.read()
         else:
-            read_buffer = self.read()
-            while len(read_buffer) < length:
-                read_buffer += self.read()
-            self.array_buf.frombytes(read_buffer[length:])
-            return read_buffer[length:]
+            while len(self.buffer) < length:
+                if not self._add_to_buffer():
+                    break
+            return self.buffer.read(length)
 
     def close(self):
         self.closed = 1
@@ -407,9 +451,7 @@ class MiscIterToFile(FileWrappingIter):
     def _add_misc_object(self, obj):
         """Add an arbitrary pickleable object to the buffer"""
         pickled_data = pickle.dumps(obj, consts.PICKLE_PROTOCOL)
-        self.array_buf.frombytes(b"o")
-        self.array_buf.frombytes(self._i2b(len(pickled_data), 7))
-        self.array_buf.frombytes(pickled_data)
+        self.buffer.add(b"o" + self._i2b(len(pickled_data), 7), pickled_data)
 
     def _add_rorp(self, rorp):
         """Add a rorp to the buffer"""
@@ -423,14 +465,11 @@ class MiscIterToFile(FileWrappingIter):
                 (rorp.index, rorp.data, 0), consts.PICKLE_PROTOCOL
             )
             self.rorps_in_buffer += 1
-        self.array_buf.frombytes(b"r")
-        self.array_buf.frombytes(self._i2b(len(pickled_data), 7))
-        self.array_buf.frombytes(pickled_data)
+        self.buffer.add(b"r" + self._i2b(len(pickled_data), 7), pickled_data)
 
     def _add_final(self):
         """Signal the end of the iterator to the other end"""
-        self.array_buf.frombytes(b"z")
-        self.array_buf.frombytes(self._i2b(0, 7))
+        self.buffer.add(b"z" + self._i2b(0, 7))
 
 
 class FileToMiscIter(IterWrappingFile):
@@ -439,6 +478,7 @@ class FileToMiscIter(IterWrappingFile):
     def __init__(self, file):
         IterWrappingFile.__init__(self, file)
         self.buf = b""
+        self.buf_offset = 0
 
     def __iter__(self):
         return self
@@ -491,21 +531,25 @@ class FileToMiscIter(IterWrappingFile):
         iterator.  An empty read() is not considered to mark the end
         of remote iter.
 
+        The buffer is parsed in place, using an offset, so that only the
+        data returned is copied out of it.
         """
-        if not self.buf:
-            self.buf += self.file.read()
+        if self.buf_offset >= len(self.buf):
+            self.buf = self.file.read()
+            self.buf_offset = 0
         if not self.buf:
             return None, None
 
-        assert len(self.buf) >= 8, "Unexpected end of MiscIter file"
+        start = self.buf_offset + 8
+        assert len(self.buf) >= start, "Unexpected end of MiscIter file"
         # [0:1] makes sure that the type remains a byte and not an int
-        type, length = self.buf[0:1], self._b2i(self.buf[1:8])
-        data = self.buf[8 : 8 + length]
-        self.buf = self.buf[8 + length :]
+        type = self.buf[start - 8 : start - 7]
+        length = self._b2i(self.buf[start - 7 : start])
+        self.buf_offset = start + length
         if type in b"oerh":
-            return type, pickle.loads(data)
+            return type, pickle.loads(memoryview(self.buf)[start : start + length])
         else:
-            return type, data
+            return type, self.buf[start : start + length]
 
 
 class ErrorFile:
@@ -24,10 +24,21 @@ which is written in C.  The goal was to use C as little as possible...
 """
 
 import array
+import bisect
+import io
 from rdiff_backup import _librsync
 
 blocksize = _librsync.RSM_JOB_BLOCKSIZE
 
+# magic number at the beginning of librsync delta files
+_DELTA_MAGIC = b"rs\x026"
+# opcodes of the librsync delta commands, see librsync's prototab.h
+_OP_END = 0x00
+_OP_LITERAL_MAX_IMMEDIATE = 0x40
+_OP_LITERAL_N8 = 0x44
+_OP_COPY_N1_N1 = 0x45
+_OP_COPY_N8_N8 = 0x54
+
 
 class librsyncError(Exception):
     """Signifies error in internal librsync processing (bad signature, etc.)
@@ -186,12 +197,149 @@ class PatchedFile(LikeFile):
         return delta_close
 
 
+class LazyPatchedFile(io.RawIOBase):
+    """
+    Seekable file-like object of a basis file patched with a delta
+
+    Unlike PatchedFile, the delta isn't applied while streaming, but its
+    commands are indexed so that the data at any position is read lazily
+    from the basis file or from the literal data within the delta file.
+    Hence LazyPatchedFile objects can be stacked to apply a chain of deltas
+    without writing any intermediate file.  Basis and delta files must
+    be seekable but don't need to be true files.
+    """
+
+    def __init__(self, basis_file, delta_file):
+        self.basis_file = basis_file
+        self.delta_file = delta_file
+        # start of each command in the patched file, start of its data in
+        # basis or delta file, and 1 for copy resp. 0 for literal commands
+        self._starts = array.array("q")
+        self._sources = array.array("q")
+        self._copies = bytearray()
+        self._size = 0
+        self._pos = 0
+        try:
+            self._index_delta()
+        except BaseException:
+            self.close()
+            raise
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        else:
+            raise ValueError("Invalid whence value {wh}".format(wh=whence))
+        if self._pos < 0:
+            raise ValueError("Negative seek position {po}".format(po=self._pos))
+        return self._pos
+
+    def readinto(self, buffer):
+        """Fill the buffer with patched data, returns number of bytes read"""
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view) and self._pos < self._size:
+            command = bisect.bisect_right(self._starts, self._pos) - 1
+            if command + 1 < len(self._starts):
+                end = self._starts[command + 1]
+            else:
+                end = self._size
+            length = min(len(view) - filled, end - self._pos)
+            if self._copies[command]:
+                source_file = self.basis_file
+            else:
+                source_file = self.delta_file
+            offset = self._sources[command] + self._pos - self._starts[command]
+            source_file.seek(offset)
+            data = source_file.read(length)
+            if len(data) != length:
+                raise librsyncError(
+                    "Read only {rl} instead of {el} bytes from {sf}".format(
+                        rl=len(data), el=length, sf=source_file
+                    )
+                )
+            view[filled : filled + length] = data
+            filled += length
+            self._pos += length
+        return filled
+
+    def close(self):
+        if not self.closed:
+            self.delta_file.close()
+            self.basis_file.close()
+        super().close()
+
+    def _index_delta(self):
+        """Read all commands of the delta, skipping over literal data"""
+        if self.delta_file.read(len(_DELTA_MAGIC)) != _DELTA_MAGIC:
+            raise librsyncError("Delta file doesn't start with the delta magic")
+        while True:
+            opcode = self._read_int(1)
+            if opcode == _OP_END:
+                return
+            elif opcode <= _OP_LITERAL_MAX_IMMEDIATE:
+                self._add_literal(opcode)
+            elif opcode <= _OP_LITERAL_N8:
+                self._add_literal(self._read_int(1 << (opcode - 0x41)))
+            elif opcode <= _OP_COPY_N8_N8:
+                sizes = opcode - _OP_COPY_N1_N1
+                offset = self._read_int(1 << (sizes // 4))
+                length = self._read_int(1 << (sizes % 4))
+                self._add_command(1, offset, length)
+            else:
+                raise librsyncError(
+                    "Unknown command {op:#x} in delta file".format(op=opcode)
+                )
+
+    def _add_literal(self, length):
+        """Index literal data of given length at current delta position"""
+        self._add_command(0, self.delta_file.tell(), length)
+        self.delta_file.seek(length, io.SEEK_CUR)
+
+    def _add_command(self, copy, source, length):
+        """Index one command, merging it with the previous one if possible"""
+        if not length:
+            return
+        if (
+            self._copies
+            and self._copies[-1] == copy
+            and self._sources[-1] + self._size - self._starts[-1] == source
+        ):
+            self._size += length  # contiguous with previous command
+            return
+        self._starts.append(self._size)
+        self._sources.append(source)
+        self._copies.append(copy)
+        self._size += length
+
+    def _read_int(self, size):
+        """Read a big-endian unsigned integer of given size from the delta"""
+        data = self.delta_file.read(size)
+        if len(data) != size:
+            raise librsyncError("Delta file is truncated")
+        return int.from_bytes(data, "big")
+
+
 class SigGenerator:
     """Calculate signature.
 
     Input and output is same as SigFile, but the interface is like md5
-    module, not filelike object
-    FIXME: is only used within test suite librsynctest.py
+    module, not filelike object.
+    The data given is only joined once enough is pending to fill a block,
+    so that many small updates don't copy the same data again and again.
     """
 
     def __init__(self, blocksize=_librsync.RS_DEFAULT_BLOCK_LEN):
@@ -202,29 +350,45 @@ class SigGenerator:
             raise librsyncError(str(e))
         self.gotsig = None
         self.buffer = b""
-        self.sig_string = b""
+        self._pending = []  # data given after self.buffer
+        self._pending_len = 0
+        self._sig_parts = []
 
     def update(self, buf):
         """Add buf to data that signature will be calculated over"""
         if self.gotsig:
             raise librsyncError("SigGenerator already provided signature")
-        self.buffer += buf
+        if not buf:
+            return
+        self._pending.append(buf)
+        self._pending_len += len(buf)
+        if len(self.buffer) + self._pending_len < blocksize:
+            return
+        self._join_pending()
         while len(self.buffer) >= blocksize:
             if self._process_buffer():
                 raise librsyncError("Premature EOF received from sig_maker")
 
     def get_sig(self):
         """Return signature over given data"""
+        self._join_pending()
         while not self._process_buffer():
             pass  # keep running until eof
-        return self.sig_string
+        return b"".join(self._sig_parts)
+
+    def _join_pending(self):
+        """Add the pending data to self.buffer"""
+        if self._pending:
+            self.buffer = b"".join([self.buffer] + self._pending)
+            self._pending = []
+            self._pending_len = 0
 
     def _process_buffer(self):
-        """Run self.buffer through sig_maker, add to self.sig_string"""
+        """Run self.buffer through sig_maker, add to the signature parts"""
         try:
             eof, len_buf_read, cycle_out = self.sig_maker.cycle(self.buffer)
         except _librsync.librsyncError as e:
             raise librsyncError(str(e))
         self.buffer = self.buffer[len_buf_read:]
-        self.sig_string += cycle_out
+        self._sig_parts.append(cycle_out)
         return eof
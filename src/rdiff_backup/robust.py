@@ -19,6 +19,7 @@
 """Catch various exceptions given system call"""
 
 import errno
+import lzma
 import signal
 import zlib
 from rdiff_backup import C, connection, librsync, rpath
@@ -135,6 +136,7 @@ def catch_error(exc):
             librsync.librsyncError,
             C.UnknownFileTypeError,
             zlib.error,
+            lzma.LZMAError,
         ),
     ):
         return True
@@ -144,6 +146,7 @@ def catch_error(exc):
         and (
             "invalid mode: rb" in str(exc)
             or "Not a gzipped file" in str(exc)
+            or "Invalid data stream" in str(exc)
             or exc.errno in _robust_errno_list
         )
     ):
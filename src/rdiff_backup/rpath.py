@@ -35,7 +35,8 @@ are dealing with are local or remote.
 """
 
 import errno
-import gzip
+import functools
+import io
 import os
 import re
 import shutil
@@ -47,7 +48,7 @@ from rdiff_backup import C
 from rdiffbackup.locations.map import owners as map_owners
 from rdiffbackup.meta import acl_posix, acl_win, ea
 from rdiffbackup.singletons import consts, generics, log, specifics
-from rdiffbackup.utils import convert, usrgrp
+from rdiffbackup.utils import compressors, convert, usrgrp
 
 try:
     import win32api
@@ -56,6 +57,19 @@ try:
 except ImportError:
     pass
 
+# errors of copy_file_range and sendfile meaning that the kernel can't copy
+# between the given files, so that the next copy method must be tried
+_KERNEL_COPY_ERRNOS = frozenset(
+    (
+        errno.EBADF,
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTSOCK,
+        errno.EOPNOTSUPP,
+        errno.EXDEV,
+    )
+)
+
 
 class SkipFileException(Exception):
     """Signal that the current file should be skipped but then continue
@@ -73,6 +87,78 @@ class RPathException(Exception):
     pass
 
 
+# keys always ignored when comparing rorpaths strictly resp. loosely
+_EQ_IGNORED_KEYS = frozenset(("atime", "ctime", "nlink"))
+_LOOSE_IGNORED_KEYS = frozenset(
+    (
+        "atime",
+        "uid",
+        "gid",
+        "uname",
+        "gname",
+        "ctime",
+        "inode",
+        "mirrorname",
+        "incname",
+        "devloc",
+        "nlink",
+        # we ignore the hash because one or the other might not have it FIXME?
+        "sha1",
+    )
+)
+
+
+def _get_global_flags():
+    """Return the global settings deciding which metadata is compared"""
+    return (
+        generics.eas_write,
+        generics.acls_write,
+        generics.win_acls_write,
+        generics.resource_forks_write,
+        generics.carbonfile_write,
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _get_ignored_keys(
+    base_keys,
+    global_flags,
+    no_inode=False,
+    no_size=False,
+    no_owner=False,
+    no_type=False,
+):
+    """
+    Return the frozenset of keys ignored when comparing rorpaths
+
+    All arguments are hashable, so that each set is only built once for each
+    combination of global settings and file specifics.
+    """
+    eas_write, acls_write, win_acls_write, resource_forks_write, carbonfile_write = (
+        global_flags
+    )
+    ignored_keys = set(base_keys)
+    if not eas_write:
+        ignored_keys.add("ea")
+    if not acls_write:
+        ignored_keys.add("acl")
+    if not win_acls_write:
+        ignored_keys.add("win_acl")
+    if not resource_forks_write:
+        ignored_keys.add("resource_forks")
+    if not carbonfile_write:
+        ignored_keys.add("carbonfile")
+    if no_inode:
+        ignored_keys.update(("inode", "devloc"))
+    if no_size:
+        ignored_keys.add("size")
+    if no_owner:
+        ignored_keys.update(("uid", "gid", "uname", "gname"))
+    if no_type:
+        ignored_keys.add("type")
+    return frozenset(ignored_keys)
+
+
 class RORPath:
     """Read Only RPath - carry information about a path
 
@@ -83,22 +169,9 @@ class RORPath:
 
     """
 
-    @staticmethod
-    def _global_ignored_keys():
-        """Returns a set of keys to be ignored during comparaison,
-        based on global settings."""
-        global_ignored_keys = {"atime"}
-        if not generics.eas_write:
-            global_ignored_keys.add("ea")
-        if not generics.acls_write:
-            global_ignored_keys.add("acl")
-        if not generics.win_acls_write:
-            global_ignored_keys.add("win_acl")
-        if not generics.resource_forks_write:
-            global_ignored_keys.add("resource_forks")
-        if not generics.carbonfile_write:
-            global_ignored_keys.add("carbonfile")
-        return global_ignored_keys
+    # the attributes are kept in slots instead of a dictionary per instance,
+    # the data dictionary itself is kept for compatibility
+    __slots__ = ("index", "data", "file", "_file_already_open")
 
     @classmethod
     def path_join(self, *filenames):
@@ -133,40 +206,37 @@ class RORPath:
         """True iff the two rorpaths are equivalent"""
         if self.index != other.index:
             return False
-
-        # we build a set of keys to be ignored during loose comparaison
-        ignored_keys = set(("ctime", "nlink"))
-        # add the keys to be globally ignored
-        ignored_keys.update(self._global_ignored_keys())
-        # global and self specific additions
-        if (
-            not self.isreg()
-            or self.getnumlinks() == 1
-            or not generics.compare_inode
-            or not generics.preserve_hardlinks
-        ):
-            ignored_keys.add("inode")
-            ignored_keys.add("devloc")
-        # self specific additions
-        if not self.isreg():
-            ignored_keys.add("size")
-            if self.issym():
-                # Don't compare gid/uid for symlinks
-                ignored_keys.update(frozenset(("uid", "gid", "uname", "gname")))
-        # self and other specific additions
-        if self.isspecial() and other.isreg() and other.getsize() == 0:
+        if self.data == other.data:
+            return True  # nothing to ignore
+
+        is_reg = self.isreg()
+        # the set of keys to be ignored is cached for each combination
+        ignored_keys = _get_ignored_keys(
+            _EQ_IGNORED_KEYS,
+            _get_global_flags(),
+            no_inode=(
+                not is_reg
+                or self.getnumlinks() == 1
+                or not generics.compare_inode
+                or not generics.preserve_hardlinks
+            ),
+            no_size=not is_reg,
+            # Don't compare gid/uid for symlinks
+            no_owner=self.issym(),
             # Special files may be replaced with empty regular files
-            ignored_keys.add("type")
+            no_type=self.isspecial() and other.isreg() and other.getsize() == 0,
+        )
 
-        # we remove the ignored keys from the set of dictionary keys
-        # before we compare them
-        for key in frozenset(self.data.keys()) - ignored_keys:
+        other_data = other.data
+        for key, value in self.data.items():
+            if key in ignored_keys:
+                continue
             if key == "uname" or key == "gname":
                 # here for legacy reasons - 0.12.x didn't store u/gnames
-                other_name = other.data.get(key, None)
-                if other_name and other_name != "None" and other_name != self.data[key]:
+                other_name = other_data.get(key, None)
+                if other_name and other_name != "None" and other_name != value:
                     return False
-            elif key not in other.data or self.data[key] != other.data[key]:
+            elif key not in other_data or value != other_data[key]:
                 return False
         return True
 
@@ -224,37 +294,20 @@ class RORPath:
         you whether the two files are close enough.  self must be the
         original rpath.
         """
-        # we build a set of keys to be ignored during loose comparaison
-        ignored_keys = set(
-            (
-                "uid",
-                "gid",
-                "uname",
-                "gname",
-                "ctime",
-                "inode",
-                "mirrorname",
-                "incname",
-                "devloc",
-                "nlink",
-            )
-        )
-        # we ignore the hash because one or the other might not have it FIXME?
-        ignored_keys.add("sha1")
-        # add the keys to be globally ignored
-        ignored_keys.update(self._global_ignored_keys())
-        # self specific additions
-        if not self.isreg():
-            ignored_keys.add("size")
-        # self and other specific additions
-        if self.isspecial() and other.isreg() and other.getsize() == 0:
+        # the set of keys to be ignored is cached for each combination
+        ignored_keys = _get_ignored_keys(
+            _LOOSE_IGNORED_KEYS,
+            _get_global_flags(),
+            no_size=not self.isreg(),
             # Special files may be replaced with empty regular files
-            ignored_keys.add("type")
+            no_type=self.isspecial() and other.isreg() and other.getsize() == 0,
+        )
 
-        # we remove the ignored keys from the set of dictionary keys
-        # before we compare them
-        for key in frozenset(self.data.keys()) - ignored_keys:
-            if key not in other.data or self.data[key] != other.data[key]:
+        other_data = other.data
+        for key, value in self.data.items():
+            if key not in ignored_keys and (
+                key not in other_data or value != other_data[key]
+            ):
                 return False
 
         if self.lstat() and not self.issym() and generics.change_ownership:
@@ -1091,21 +1144,29 @@ class RPath(RORPath):
         """
         Return open file.  Supports modes "w" and "r".
 
-        If compress is true, data written/read will be gzip
-        compressed/decompressed on the fly.
+        If compress is true, data written/read will be compressed/decompressed
+        on the fly, in parallel threads when writing if the compression_threads
+        setting asks for it.  If compress is a file suffix like b"gz", the
+        codec writing this suffix is used, else the compression_codec setting.
         """
         assert (
             self.conn is specifics.local_connection
         ), "Function open must be called locally not over {co}.".format(co=self.conn)
         if compress:
-            return gzip.GzipFile(self, mode)
+            if isinstance(compress, bytes):
+                codec = compressors.get_name(compress)
+            else:
+                codec = generics.compression_codec
+            return compressors.open_file(
+                self, mode, codec, generics.compression_threads or 0
+            )
         else:
             return open(self, mode)
 
     def write_from_fileobj(self, fp, compress=None):
         """Reads fp and writes to self.path.  Closes both when done
 
-        If compress is true, fp will be gzip compressed before being
+        If compress is true, fp will be compressed before being
         written to self.  Returns closing value of fp.
 
         """
@@ -1392,10 +1453,11 @@ class MaybeGzip:
         if not buf:
             return
 
-        new_rp = self._get_gzipped_rp()
+        suffix = compressors.get_suffix(generics.compression_codec)
+        new_rp = self._get_compressed_rp(suffix)
         if self.callback:
             self.callback(new_rp)
-        self.fileobj = new_rp.open("wb", compress=1)
+        self.fileobj = new_rp.open("wb", compress=suffix)
         return self.fileobj.write(buf)
 
     def close(self):
@@ -1409,13 +1471,13 @@ class MaybeGzip:
             self.callback(self.base_rp)
         self.base_rp.touch()
 
-    def _get_gzipped_rp(self):
-        """Return gzipped rp by adding .gz to base_rp"""
+    def _get_compressed_rp(self, suffix):
+        """Return compressed rp by adding the codec's suffix to base_rp"""
         if self.base_rp.index:
-            newind = self.base_rp.index[:-1] + (self.base_rp.index[-1] + b".gz",)
+            newind = self.base_rp.index[:-1] + (self.base_rp.index[-1] + b"." + suffix,)
             return self.base_rp.new_index(newind)
         else:
-            return self.base_rp.append_path(b".gz")
+            return self.base_rp.append_path(b"." + suffix)
 
 
 class _RPathFileHook:
@@ -1439,21 +1501,50 @@ class _RPathFileHook:
 
 
 def copyfileobj(inputfp, outputfp):
-    """Copies file inputfp to outputfp in blocksize intervals"""
+    """
+    Copies file inputfp to outputfp
+
+    Local regular files are copied by the kernel where possible, and only the
+    data segments of sparse input files are read, else the file is copied in
+    blocksize intervals. Holes are kept sparse in the output file.
+    """
+    if isinstance(outputfp, io.BufferedWriter) and outputfp.tell() == 0:
+        if isinstance(inputfp, io.BufferedReader) and inputfp.tell() == 0:
+            _copy_local_file(inputfp, outputfp)
+            return
+        raw_inputfp = getattr(inputfp, "fileobj", None)
+        if (
+            hasattr(inputfp, "skip_zeros")
+            and isinstance(raw_inputfp, io.BufferedReader)
+            and raw_inputfp.tell() == 0
+        ):
+            _copy_sparse_file(inputfp, raw_inputfp.fileno(), outputfp)
+            return
+    _copy_blocks(inputfp, outputfp)
+
+
+def _copy_blocks(inputfp, outputfp, length=None):
+    """
+    Copies file inputfp to outputfp in blocksize intervals
+
+    If length is given, only up to length bytes are copied.
+    """
 
     sparse = False
     """Negative seeks are not supported by GzipFile"""
-    compressed = False
-    if isinstance(outputfp, gzip.GzipFile):
-        compressed = True
+    compressed = compressors.is_compressed_file(outputfp)
 
-    while 1:
-        inbuf = inputfp.read(consts.BLOCKSIZE)
+    while length is None or length > 0:
+        if length is None:
+            inbuf = inputfp.read(consts.BLOCKSIZE)
+        else:
+            inbuf = inputfp.read(min(consts.BLOCKSIZE, length))
+            length -= len(inbuf)
         if not inbuf:
             break
 
         buflen = len(inbuf)
-        if not compressed and inbuf == b"\x00" * buflen:
+        if not compressed and inbuf.count(0) == buflen:
             outputfp.seek(buflen, os.SEEK_CUR)
             # flag sparse=True, that we seek()ed, but have not written yet
             # The filesize is wrong until we write
@@ -1468,6 +1559,132 @@ def copyfileobj(inputfp, outputfp):
         outputfp.write(b"\x00")
 
 
+def _copy_local_file(inputfp, outputfp):
+    """
+    Copy the local regular file inputfp to outputfp, without going through
+    user space where the kernel supports it, and skipping holes
+    """
+    in_fd, out_fd = inputfp.fileno(), outputfp.fileno()
+    size = os.fstat(in_fd).st_size
+    for start, end in _get_data_segments(in_fd, size):
+        copied = _copy_fd_range(in_fd, out_fd, start, end - start)
+        if copied < end - start:  # the input file shrank meanwhile
+            size = start + copied
+            break
+    else:  # the input file might have grown meanwhile
+        while True:
+            grown = os.fstat(in_fd).st_size - size
+            if grown <= 0:
+                break
+            copied = _copy_fd_range(in_fd, out_fd, size, grown)
+            size += copied
+            if copied < grown:
+                break
+    os.ftruncate(out_fd, size)  # also creates a trailing hole
+    inputfp.seek(size)
+    outputfp.seek(size)
+
+
+def _copy_sparse_file(inputfp, in_fd, outputfp):
+    """
+    Copy the data segments of inputfp to outputfp, skipping holes
+
+    inputfp wraps the local file open with in_fd, and has a skip_zeros
+    method to account for the holes without reading them, like the
+    hash.FileWrapper needed to hash the file being copied.
+    """
+    size = os.fstat(in_fd).st_size
+    offset = 0
+    for start, end in _get_data_segments(in_fd, size):
+        if start > offset:
+            inputfp.skip_zeros(start - offset)
+            outputfp.seek(start - offset, os.SEEK_CUR)
+        _copy_blocks(inputfp, outputfp, end - start)
+        offset = end
+    if offset < size:
+        inputfp.skip_zeros(size - offset)
+        outputfp.seek(size)
+        outputfp.truncate()
+    # the input might have grown meanwhile
+    _copy_blocks(inputfp, outputfp)
+
+
+def _get_data_segments(fd, size):
+    """
+    Generate the (start, end) tuples of the data segments of file fd
+
+    If the platform or file system doesn't support finding holes, the whole
+    file is one data segment. The offset of fd is left unchanged.
+    """
+    if not hasattr(os, "SEEK_DATA") or not size:
+        if size:
+            yield (0, size)
+        return
+    offset = 0
+    while offset < size:
+        position = os.lseek(fd, 0, os.SEEK_CUR)
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        except OSError as exc:
+            if exc.errno == errno.ENXIO:  # only a hole until the end
+                break
+            if offset:
+                raise
+            end = start = 0  # holes aren't supported
+        finally:
+            os.lseek(fd, position, os.SEEK_SET)
+        if end <= start:
+            yield (offset, size)
+            break
+        yield (start, end)
+        offset = end
+
+
+def _copy_fd_range(in_fd, out_fd, offset, count):
+    """
+    Copy count bytes at offset of in_fd to the same offset of out_fd
+
+    The kernel copies the data without going through user space if possible.
+    Returns the number of bytes copied, less than count if in_fd was shorter.
+    """
+    end = offset + count
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(in_fd, out_fd, end - offset, offset, offset)
+                if not copied:
+                    return count - (end - offset)
+                offset += copied
+            return count
+        except OSError as exc:
+            if exc.errno not in _KERNEL_COPY_ERRNOS:
+                raise
+    if hasattr(os, "sendfile"):
+        try:
+            os.lseek(out_fd, offset, os.SEEK_SET)
+            while offset < end:
+                copied = os.sendfile(out_fd, in_fd, offset, end - offset)
+                if not copied:
+                    return count - (end - offset)
+                offset += copied
+            return count
+        except OSError as exc:
+            if exc.errno not in _KERNEL_COPY_ERRNOS:
+                raise
+    os.lseek(in_fd, offset, os.SEEK_SET)
+    os.lseek(out_fd, offset, os.SEEK_SET)
+    while offset < end:
+        inbuf = os.read(in_fd, min(consts.BLOCKSIZE, end - offset))
+        if not inbuf:
+            break
+        written = 0
+        while written < len(inbuf):
+            written += os.write(out_fd, inbuf[written:])
+        offset += len(inbuf)
+    return count - (end - offset)
+
+
 def copy(rpin: RORPath, rpout: RPath, compress=0):
     """Copy RPath or RORPath rpin to rpout.  Works for symlinks, dirs, etc.
 
@@ -1696,13 +1913,18 @@ def rename(rp_source, rp_dest):
 
 
 # @API(get_rpath_data, 300)
-def get_rpath_data(filename, base, index):
+def get_rpath_data(filename, base, index, stat_cache=None, statblock=None):
     """
     Generate and return the data dictionary for the given path
+
+    If a stat cache is given, the costly metadata is taken from it as long
+    as the file looks unchanged, and the cache is updated.
+    If a statblock is given, it is used instead of calling lstat again.
     """
 
     try:
-        statblock = os.lstat(filename)
+        if statblock is None:
+            statblock = os.lstat(filename)
     except (FileNotFoundError, NotADirectoryError, PermissionError):
         # FIXME not sure if this shouldn't trigger a warning but doing it
         # generates (too) many messages during the tests
@@ -1770,7 +1992,15 @@ def get_rpath_data(filename, base, index):
         data["mtime"] = int(statblock[stat.ST_MTIME])
         data["atime"] = int(statblock[stat.ST_ATIME])
         data["ctime"] = int(statblock[stat.ST_CTIME])
-    return _add_rpath_metadata(base, index, data)
+    if stat_cache is None:
+        return _add_rpath_metadata(base, index, data)
+    cached_data = stat_cache.get(index, statblock)
+    if cached_data is None:
+        data = _add_rpath_metadata(base, index, data)
+    else:
+        data.update(cached_data)
+    stat_cache.set(index, statblock, data)
+    return data
 
 
 def _add_rpath_metadata(base, index, data):
@@ -23,13 +23,17 @@ Parses includes and excludes to yield correct files.  More
 documentation on what this code does can be found on the man page.
 """
 
+import concurrent.futures
 import os
+import queue
 import re
+import stat
 import sys
+import threading
 import typing
 
 from rdiff_backup import robust, rorpiter, rpath
-from rdiffbackup.singletons import generics, log
+from rdiffbackup.singletons import consts, generics, log, specifics
 from rdiffbackup.utils import convert
 
 
@@ -97,13 +101,22 @@ class Select:
     MIN: typing.Final[int] = 0
     MAX: typing.Final[int] = 1
 
-    def __init__(self, rootrp):
-        """Select initializer.  rpath is the root directory"""
+    def __init__(self, rootrp, stat_cache=None, scan_threads=0):
+        """Select initializer.  rpath is the root directory
+
+        The optional stat cache is used to avoid reading again the costly
+        metadata of unchanged files, it is closed once iteration is complete.
+        If scan_threads is positive and the root directory is local, directory
+        listings and lstat results are prefetched by as many threads.
+        """
         assert isinstance(
             rootrp, rpath.RPath
         ), "Root path '{rp}' must be a real remote path.".format(rp=rootrp)
         self.selection_functions = []
         self.rpath = rootrp
+        self.stat_cache = stat_cache
+        self.scan_threads = scan_threads
+        self._scanner = None
         self.prefix = self.rpath.path
         self.prefixindex = tuple([x for x in self.prefix.split(b"/") if x])
         self._init_parsing_mapping()
@@ -116,6 +129,8 @@ class Select:
         usually self.select_default.  Returns self.iter just for convenience.
         """
         self.rpath.setdata()  # this may have changed since Select init
+        if self.scan_threads > 0 and self.rpath.conn is specifics.local_connection:
+            self._scanner = _ThreadedScanner(self.scan_threads)
         select_iter = self._iterate_rpath(self.rpath)
         return select_iter
 
@@ -248,13 +263,13 @@ class Select:
 
         def diryield(rp):
             """
-            Generate relevant files in directory rpath
+            Return an iterator of the relevant files in directory rpath
 
-            Returns (rpath, num) where INCLUDE means rpath should be
+            Yields (rpath, num) where INCLUDE means rpath should be
             generated normally, DOSCAN means the rpath is a directory
             and should be included iff something inside is included.
             """
-            for filename in self._listdir_sorted(rp):
+            for filename, statblock in self._listdir_sorted(rp):
                 # First check if path is excluded by filename to reduce IO calls
                 minimal_rp = rp.new_index_empty(rp.index + (filename,))
                 s = self._select_filename(minimal_rp)
@@ -262,7 +277,7 @@ class Select:
                     continue
                 # If filename is not excluded, run all selection functions.
                 new_rp = robust.check_common_error(
-                    error_handler, rp.append, (filename,)
+                    error_handler, self._append, (rp, filename, statblock)
                 )
                 if new_rp and new_rp.lstat():
                     s = self.select_default(new_rp)
@@ -273,6 +288,7 @@ class Select:
 
         yield rpath
         if not rpath.isdir():
+            self._close_iteration()
             return
         diryield_stack = [diryield(rpath)]
         delayed_rp_stack = []
@@ -296,6 +312,31 @@ class Select:
             elif val == Select.DOSCAN:
                 delayed_rp_stack.append(rpath)
                 diryield_stack.append(diryield(rpath))
+        self._close_iteration()
+
+    def _append(self, dir_rp, filename, statblock=None):
+        """
+        Return the rpath of filename within dir_rp
+
+        The stat cache and the statblock prefetched by the scanner are used
+        if available.
+        """
+        if self.stat_cache is None and statblock is None:
+            return dir_rp.append(filename)
+        new_rp = dir_rp.new_index_empty(dir_rp.index + (filename,))
+        new_rp.data = rpath.get_rpath_data(
+            new_rp.path, new_rp.base, new_rp.index, self.stat_cache, statblock
+        )
+        return new_rp
+
+    def _close_iteration(self):
+        """Close the stat cache and the scanner once the iteration is complete"""
+        if self.stat_cache is not None:
+            self.stat_cache.close()
+            self.stat_cache = None
+        if self._scanner is not None:
+            self._scanner.close()
+            self._scanner = None
 
     def _get_relative_index(self, filename):
         """return the index of a file relative to the current prefix
@@ -309,15 +350,40 @@ class Select:
         return fileindex[len(self.prefixindex) :]
 
     def _listdir_sorted(self, dir_rp):
-        """List directory rpath with error logging and sorting entries"""
+        """
+        List directory rpath with error logging and sorting entries
+
+        Return a list of tuples (filename, statblock), where the statblock
+        is None unless it was prefetched by the scanner.
+        """
 
         def error_handler(exc):
             log.ErrorLog("ListError", dir_rp, exc)
             return []
 
+        if self._scanner is not None:
+            dir_listing = robust.check_common_error(
+                error_handler, self._scanner.listdir, (dir_rp,)
+            )
+            # only the listings are prefetched, the entries themselves are
+            # created later and in order, as the stat cache requires it
+            self._scanner.prefetch(
+                dir_rp,
+                [
+                    filename
+                    for filename, statblock in dir_listing
+                    if statblock is not None
+                    and stat.S_ISDIR(statblock.st_mode)
+                    and self._select_filename(
+                        dir_rp.new_index_empty(dir_rp.index + (filename,))
+                    )
+                    != Select.EXCLUDE
+                ],
+            )
+            return dir_listing
         dir_listing = robust.check_common_error(error_handler, dir_rp.listdir)
         dir_listing.sort()
-        return dir_listing
+        return [(filename, None) for filename in dir_listing]
 
     def _parse_catch_error(self, exc):
         """Deal with selection error exc"""
@@ -836,6 +902,108 @@ probably isn't what you meant""".format(se=self.selection_functions[-1].name))
         return os.fsencode(res)  # but we want a bytes matching pattern
 
 
+class _ThreadedScanner:
+    """
+    Prefetch directory listings and lstat results with a pool of threads
+
+    The selection requests listings in depth-first order, i.e. in increasing
+    index order, and asks in advance for the listings of the sub-directories
+    found in each listing and not excluded by their name, of which only the
+    ones coming next in this order are kept, so that their system calls
+    overlap with the processing of the entries already listed. The threads are daemons so that a listing hanging
+    on an unresponsive network mount doesn't prevent the program from exiting.
+    """
+
+    def __init__(self, threads):
+        self._queue = queue.SimpleQueue()
+        for thread_num in range(threads):
+            threading.Thread(
+                target=self._work,
+                name="rdiff-backup-scan-{nr}".format(nr=thread_num),
+                daemon=True,
+            ).start()
+        self._threads = threads
+        self._max_pending = threads * consts.SCAN_PREFETCH_PER_THREAD
+        self._pending = {}
+
+    def prefetch(self, dir_rp, dirnames):
+        """
+        Schedule the listings of the sub-directories dirnames of dir_rp
+
+        The sub-directories are given in increasing order, the listings
+        furthest in the depth-first order are discarded if too many are
+        pending.
+        """
+        for dirname in dirnames:
+            index = dir_rp.index + (dirname,)
+            if index not in self._pending:
+                future = concurrent.futures.Future()
+                self._pending[index] = future
+                self._queue.put((future, os.path.join(dir_rp.path, dirname)))
+        while len(self._pending) > self._max_pending:
+            self._pending.pop(max(self._pending)).cancel()
+
+    def listdir(self, dir_rp):
+        """
+        Return the sorted list of tuples (filename, statblock) of dir_rp
+
+        The statblock is None if it couldn't be prefetched.
+        """
+        index = dir_rp.index
+        # listings scheduled before the requested one won't be requested
+        # anymore, most probably because their directory vanished
+        for old_index in [key for key in self._pending if key < index]:
+            self._pending.pop(old_index).cancel()
+        future = self._pending.pop(index, None)
+        if future is None:
+            return _scan_directory(dir_rp.path)
+        return future.result()
+
+    def close(self):
+        """Discard the remaining prefetched listings and stop the threads"""
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+        for thread_num in range(self._threads):
+            self._queue.put(None)
+
+    def _work(self):
+        """List the directories scheduled until the scanner is closed"""
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, dir_path = task
+            if not future.set_running_or_notify_cancel():
+                continue  # the listing was discarded meanwhile
+            try:
+                future.set_result(_scan_directory(dir_path))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+
+def _scan_directory(dir_path):
+    """
+    Return the sorted list of tuples (filename, statblock) of dir_path
+
+    The statblock is None if lstat failed, or under Windows where os.scandir
+    doesn't return inode and device numbers, lstat is then called again by
+    the selection.
+    """
+    entries = []
+    with os.scandir(dir_path) as dir_iter:
+        for entry in dir_iter:
+            statblock = None
+            if os.name != "nt":
+                try:
+                    statblock = entry.stat(follow_symlinks=False)
+                except OSError:
+                    pass
+            entries.append((entry.name, statblock))
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+
 class FilterIter:
     """Filter rorp_iter using a Select object, removing excluded rorps"""
 
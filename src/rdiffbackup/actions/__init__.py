@@ -31,7 +31,7 @@ import tempfile
 import yaml
 from rdiff_backup import Security, SetConnections, Time
 from rdiffbackup.singletons import consts, log, specifics
-from rdiffbackup.utils import argopts
+from rdiffbackup.utils import argopts, compressors
 
 # The default regexp for not compressing those files
 DEFAULT_NOT_COMPRESSED_REGEXP = (
@@ -128,6 +128,12 @@ COMMON_PARSER.add_argument(
     default=int(os.getenv("RDIFF_BACKUP_VERBOSITY", "3")),
     help="[opt] overall verbosity on terminal and in logfiles (default is 3)",
 )
+COMMON_PARSER.add_argument(
+    "--wire-compression",
+    default=False,
+    action=argparse.BooleanOptionalAction,
+    help="[opt] compress (or not) the data exchanged with remote locations",
+)
 
 
 # === DEFINE PARENT PARSERS ===
@@ -305,6 +311,34 @@ COMPRESSION_PARSER.add_argument(
     help="[sub] regexp to select files not being compressed "
     "(default is '{}')".format(DEFAULT_NOT_COMPRESSED_REGEXP),
 )
+COMPRESSION_PARSER.add_argument(
+    "--compression-threads",
+    type=argopts.non_negative_int,
+    default=0,
+    metavar="N",
+    help="[sub] compress files written to the repository in N parallel "
+    "threads (default is 0, compress in the main thread)",
+)
+COMPRESSION_PARSER.add_argument(
+    "--compression-codec",
+    choices=compressors.get_names(),
+    help="[sub] codec compressing snapshot, diff and metadata files, saved "
+    "in the repository for the next backups (default is the saved codec "
+    "or '{}')".format(compressors.DEFAULT),
+)
+
+METADATA_CACHE_PARSER = argparse.ArgumentParser(
+    add_help=False, description="[parent] options related to the metadata cache"
+)
+METADATA_CACHE_PARSER.add_argument(
+    "--metadata-cache-size",
+    type=int,
+    default=0,
+    metavar="MIB",
+    help="[sub] keep up to MIB mebibytes of metadata of older backups "
+    "in the repository, to avoid patching it from diffs when reading it "
+    "(default is 0, no cache)",
+)
 
 RESTRICT_PARSER = argparse.ArgumentParser(
     add_help=False,
@@ -590,9 +624,12 @@ class BaseAction:
                 term_verbosity=log.Log.term_verbosity,
             )
             Security.initialize(self.get_security_class(), cmdpairs)
-            self.connected_locations = list(
-                map(SetConnections.get_connected_rpath, cmdpairs)
-            )
+            self.connected_locations = [
+                SetConnections.get_connected_rpath(
+                    cmdpair, wire_compression=self.values.get("wire_compression")
+                )
+                for cmdpair in cmdpairs
+            ]
 
             # if a connection is None, it's an error
             for conn, loc in zip(self.connected_locations, self.values["locations"]):
@@ -21,6 +21,7 @@
 A built-in rdiff-backup action plug-in to backup a source to a target directory.
 """
 
+import argparse
 import time
 
 from rdiff_backup import Time
@@ -41,6 +42,7 @@ class BackupAction(actions.BaseAction):
         actions.COMPRESSION_PARSER,
         actions.SELECTION_PARSER,
         actions.FILESYSTEM_PARSER,
+        actions.METADATA_CACHE_PARSER,
         actions.USER_GROUP_PARSER,
         actions.STATISTICS_PARSER,
     ]
@@ -54,8 +56,108 @@ class BackupAction(actions.BaseAction):
             nargs=2,
             help="locations of SOURCE_DIR and to which REPOSITORY to backup",
         )
+        subparser.add_argument(
+            "--detect-moves",
+            default=False,
+            action=argparse.BooleanOptionalAction,
+            help="[opt] send new files as diff against the files of the "
+            "previous backup with same size and modification time, so that "
+            "moved or copied files aren't transferred again (default is off)",
+        )
+        subparser.add_argument(
+            "--group-commit",
+            type=int,
+            default=0,
+            metavar="N",
+            help="[opt] sync the repository once per group of up to N changed "
+            "files instead of once per file (default is 0, no grouping)",
+        )
+        subparser.add_argument(
+            "--hard-links-memory-limit",
+            type=int,
+            default=0,
+            metavar="MIB",
+            help="[opt] keep up to about MIB mebibytes of hard link "
+            "information in memory, the rest being spilled to a temporary "
+            "file (default is 0, no limit)",
+        )
+        subparser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            metavar="N",
+            help="[opt] compute signatures and deltas of changed files "
+            "in N parallel processes (default is 1)",
+        )
+        subparser.add_argument(
+            "--metadata-format",
+            choices=["text", "binary"],
+            default=None,
+            help="[opt] format of the metadata files written to the repository, "
+            "saved for the next backups (default is the saved format or text)",
+        )
+        subparser.add_argument(
+            "--resume",
+            default=False,
+            action=argparse.BooleanOptionalAction,
+            help="[opt] if the previous backup failed, keep the files it "
+            "already transferred, and send them as diff against these "
+            "instead of transferring them again (default is off)",
+        )
+        subparser.add_argument(
+            "--scan-threads",
+            type=int,
+            default=0,
+            metavar="N",
+            help="[opt] prefetch directory listings and file status of the "
+            "source in N parallel threads (default is 0, no prefetching)",
+        )
+        subparser.add_argument(
+            "--similar-basis",
+            default=False,
+            action=argparse.BooleanOptionalAction,
+            help="[opt] send new files as diff against a file of the previous "
+            "backup with same name elsewhere or similar name in the same "
+            "directory, and of similar size (default is off)",
+        )
+        subparser.add_argument(
+            "--source-hash-cache",
+            type=str,
+            metavar="FILE_PATH",
+            help="[opt] cache file on the source side remembering the SHA1 "
+            "hashes of the files read, for later comparisons by hash",
+        )
+        subparser.add_argument(
+            "--source-stat-cache",
+            type=str,
+            metavar="FILE_PATH",
+            help="[opt] cache file on the source side remembering costly "
+            "metadata like EAs and ACLs of unchanged files across backups",
+        )
         return subparser
 
+    def pre_check(self):
+        ret_code = super().pre_check()
+
+        if self.values["jobs"] < 1:
+            log.Log(
+                "The number of parallel jobs must be at least 1, "
+                "not {jo}".format(jo=self.values["jobs"]),
+                log.ERROR,
+            )
+            ret_code |= consts.RET_CODE_ERR
+        # the parallel jobs are forked processes, and forking a process
+        # while other threads are running can leave locks held in the child
+        if self.values["jobs"] > 1 and self.values["scan_threads"] > 0:
+            log.Log(
+                "Parallel jobs and scan threads can't be combined, "
+                "use either --jobs or --scan-threads",
+                log.ERROR,
+            )
+            ret_code |= consts.RET_CODE_ERR
+
+        return ret_code
+
     def connect(self):
         conn_value = super().connect()
         if conn_value.is_connection_ok():
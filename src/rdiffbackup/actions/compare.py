@@ -38,7 +38,7 @@ class CompareAction(actions.BaseAction):
 
     name = "compare"
     security = "validate"
-    parent_parsers = [actions.SELECTION_PARSER]
+    parent_parsers = [actions.SELECTION_PARSER, actions.METADATA_CACHE_PARSER]
 
     @classmethod
     def add_action_subparser(cls, sub_handler):
@@ -55,6 +55,13 @@ class CompareAction(actions.BaseAction):
             default="now",
             help="compare with the backup at the given time, default is 'now'",
         )
+        subparser.add_argument(
+            "--source-hash-cache",
+            type=str,
+            metavar="FILE_PATH",
+            help="[opt] cache file on the source side remembering the SHA1 "
+            "hashes of unchanged files, used by the hash method",
+        )
         subparser.add_argument(
             "locations",
             metavar="[[USER@]SERVER::]PATH",
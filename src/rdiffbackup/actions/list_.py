@@ -43,6 +43,7 @@ class ListAction(actions.BaseAction):
 
     name = "list"
     security = "validate"
+    parent_parsers = [actions.METADATA_CACHE_PARSER]
 
     @classmethod
     def add_action_subparser(cls, sub_handler):
@@ -40,6 +40,7 @@ class RestoreAction(actions.BaseAction):
         actions.COMPRESSION_PARSER,
         actions.SELECTION_PARSER,
         actions.FILESYSTEM_PARSER,
+        actions.METADATA_CACHE_PARSER,
         actions.USER_GROUP_PARSER,
     ]
 
@@ -55,6 +56,14 @@ class RestoreAction(actions.BaseAction):
             action="store_true",
             help="restore from a specific increment as first parameter",
         )
+        subparser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            metavar="N",
+            help="[opt] restore files needing decompression or patching in N "
+            "parallel processes and write files in N threads (default is 1)",
+        )
         subparser.add_argument(
             "locations",
             metavar="[[USER@]SERVER::]PATH",
@@ -63,6 +72,19 @@ class RestoreAction(actions.BaseAction):
         )
         return subparser
 
+    def pre_check(self):
+        ret_code = super().pre_check()
+
+        if self.values["jobs"] < 1:
+            log.Log(
+                "The number of parallel jobs must be at least 1, "
+                "not {jo}".format(jo=self.values["jobs"]),
+                log.ERROR,
+            )
+            ret_code |= consts.RET_CODE_ERR
+
+        return ret_code
+
     def connect(self):
         conn_value = super().connect()
         if conn_value.is_connection_ok():
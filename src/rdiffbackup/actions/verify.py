@@ -24,9 +24,11 @@ This plug-in verifies that files in a repository at a given time
 have the correct hash.
 """
 
+import argparse
+
 from rdiffbackup import actions
 from rdiffbackup.locations import repository
-from rdiffbackup.singletons import consts
+from rdiffbackup.singletons import consts, log
 
 
 class VerifyAction(actions.BaseAction):
@@ -37,6 +39,7 @@ class VerifyAction(actions.BaseAction):
 
     name = "verify"
     security = "validate"
+    parent_parsers = [actions.METADATA_CACHE_PARSER]
 
     @classmethod
     def add_action_subparser(cls, sub_handler):
@@ -47,6 +50,35 @@ class VerifyAction(actions.BaseAction):
             default="now",
             help="as of which time to check the files' hashes (default is now/latest)",
         )
+        subparser.add_argument(
+            "--full-older-than",
+            metavar="TIME",
+            default="1M",
+            help="[opt] with --incremental, verify all files anyway if the last "
+            "full verification is older than TIME (default is 1M)",
+        )
+        subparser.add_argument(
+            "--incremental",
+            default=False,
+            action=argparse.BooleanOptionalAction,
+            help="[opt] only verify files whose data in the repository changed "
+            "since they were last verified successfully (default is off)",
+        )
+        subparser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            metavar="N",
+            help="[opt] read files ahead and compute their hashes in N "
+            "parallel threads (default is 1)",
+        )
+        subparser.add_argument(
+            "--resume",
+            default=True,
+            action=argparse.BooleanOptionalAction,
+            help="[opt] resume an interrupted verification at the same time "
+            "where it stopped, else start from the beginning (default is on)",
+        )
         subparser.add_argument(
             "locations",
             metavar="[[USER@]SERVER::]PATH",
@@ -55,6 +87,19 @@ class VerifyAction(actions.BaseAction):
         )
         return subparser
 
+    def pre_check(self):
+        ret_code = super().pre_check()
+
+        if self.values["jobs"] < 1:
+            log.Log(
+                "The number of parallel jobs must be at least 1, "
+                "not {jo}".format(jo=self.values["jobs"]),
+                log.ERROR,
+            )
+            ret_code |= consts.RET_CODE_ERR
+
+        return ret_code
+
     def connect(self):
         conn_value = super().connect()
         if conn_value.is_connection_ok():
@@ -92,6 +137,11 @@ class VerifyAction(actions.BaseAction):
         self.action_time = self.repo.get_parsed_time(self.values["at"])
         if self.action_time is None:
             return consts.RET_CODE_ERR
+        # the time is parsed again where the verification happens
+        if self.values["incremental"] and (
+            self.repo.get_parsed_time(self.values["full_older_than"]) is None
+        ):
+            return consts.RET_CODE_ERR
 
         return consts.RET_CODE_OK
 
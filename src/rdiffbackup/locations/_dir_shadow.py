@@ -24,20 +24,25 @@ it has no real life of itself, i.e. it has only class methods and can't
 be instantiated.
 """
 
+import io
+import os
 import sys
+import tempfile
 
 from rdiff_backup import (
     hash,
     iterfile,
+    librsync,
     Rdiff,
     robust,
     rorpiter,
     rpath,
     selection,
 )
-from rdiffbackup.locations import location
+from rdiffbackup.locations import location, stat_cache
 from rdiffbackup.locations.map import hardlinks as map_hardlinks
 from rdiffbackup.singletons import consts, log, specifics
+from rdiffbackup.utils import parallel
 
 # ### COPIED FROM BACKUP ####
 
@@ -49,6 +54,7 @@ class ReadDirShadow(location.LocationShadow):
     """
 
     _select = None  # will be set to source Select iterator
+    _hash_cache = None  # will be set to a source hash cache if requested
 
     # @API(ReadDirShadow.init, 300)  # inherited
     # @API(ReadDirShadow.check, 300)  # inherited
@@ -85,7 +91,14 @@ class ReadDirShadow(location.LocationShadow):
         ):
             log.Log("Symbolic links excluded on Windows", log.NOTE)
             select_opts.insert(0, ("exclude-symbolic-links", None))
-        sel = selection.Select(base_rp)
+        cache_path = cls._values.get("source_stat_cache")
+        if cache_path:
+            cache = stat_cache.get_stat_cache(cache_path, base_rp.path)
+        else:
+            cache = None
+        sel = selection.Select(
+            base_rp, cache, scan_threads=cls._values.get("scan_threads") or 0
+        )
         sel.parse_selection_args(select_opts)
         sel_iter = sel.get_select_iter()
         cache_size = consts.PIPELINE_MAX_LENGTH * 3  # to and from+leeway
@@ -112,14 +125,16 @@ class ReadDirShadow(location.LocationShadow):
         Return diffs of any files with signature in dest_sigiter
         """
         error_handler = robust.get_error_handler("ListError")
+        cls._open_hash_cache()
 
         def attach_snapshot(diff_rorp, src_rp):
             """Attach file of snapshot to diff_rorp, w/ error checking"""
+            on_close = cls._get_hash_setter(src_rp)
             fileobj = robust.check_common_error(
                 error_handler, rpath.RPath.open, (src_rp, "rb")
             )
             if fileobj:
-                diff_rorp.setfile(hash.FileWrapper(fileobj))
+                diff_rorp.setfile(hash.FileWrapper(fileobj, on_close))
             else:
                 diff_rorp.zero()
             diff_rorp.set_attached_filetype("snapshot")
@@ -127,7 +142,9 @@ class ReadDirShadow(location.LocationShadow):
         def attach_diff(diff_rorp, src_rp, dest_sig):
             """Attach file of diff to diff_rorp, w/ error checking"""
             fileobj = robust.check_common_error(
-                error_handler, Rdiff.get_delta_sigrp_hash, (dest_sig, src_rp)
+                error_handler,
+                Rdiff.get_delta_sigrp_hash,
+                (dest_sig, src_rp, cls._get_hash_setter(src_rp)),
             )
             if fileobj:
                 diff_rorp.setfile(fileobj)
@@ -136,7 +153,30 @@ class ReadDirShadow(location.LocationShadow):
                 diff_rorp.zero()
                 diff_rorp.set_attached_filetype("snapshot")
 
-        for dest_sig in dest_sigiter:
+        def attach_diff_data(diff_rorp, src_rp, dest_sig, future, on_close):
+            """Attach diff computed by a worker, w/ error checking"""
+            exc = future.exception()  # waits for the worker
+            if isinstance(exc, parallel.WORKER_ERRORS + (librsync.librsyncError,)):
+                log.Log(
+                    "Computing delta of file {fi} in parallel failed with "
+                    "exception '{ex}', trying again".format(fi=src_rp, ex=exc),
+                    log.INFO,
+                )
+                attach_diff(diff_rorp, src_rp, dest_sig)
+                return
+            delta_hash = robust.check_common_error(
+                error_handler, lambda rp: future.result(), (src_rp,)
+            )
+            if delta_hash:
+                if on_close:
+                    on_close(delta_hash[1])
+                diff_rorp.setfile(Rdiff.DeltaTempFile(*delta_hash))
+                diff_rorp.set_attached_filetype("diff")
+            else:
+                diff_rorp.zero()
+                diff_rorp.set_attached_filetype("snapshot")
+
+        for dest_sig, future, on_close in cls._iterate_sigs_tasks(dest_sigiter):
             if dest_sig is iterfile.MiscIterFlushRepeat:
                 yield iterfile.MiscIterFlush  # Flush buffer when get_sigs does
                 continue
@@ -144,6 +184,8 @@ class ReadDirShadow(location.LocationShadow):
             diff_rorp = src_rp.getRORPath()
             if dest_sig.isflaglinked():
                 diff_rorp.flaglinked(dest_sig.get_link_flag())
+            elif future is not None:
+                attach_diff_data(diff_rorp, src_rp, dest_sig, future, on_close)
             elif src_rp.isreg():
                 reset_perms = False
                 if (
@@ -166,6 +208,124 @@ class ReadDirShadow(location.LocationShadow):
                 diff_rorp.set_attached_filetype("snapshot")
             yield diff_rorp
 
+        cls._close_hash_cache()
+
+    @classmethod
+    def _iterate_sigs_tasks(cls, dest_sigiter):
+        """
+        Yield tuples (dest_sig, future, on_close) from the signatures iterator
+
+        Without parallel jobs, the future is always None and the deltas are
+        computed as usual, else the deltas of readable regular files are
+        computed by a pool of processes and the future holds their result,
+        on_close being then the function to call with the hash of the file.
+        """
+        jobs = cls._values.get("jobs") or 1
+        if jobs <= 1:
+            for dest_sig in dest_sigiter:
+                yield (dest_sig, None, None)
+            return
+        tasks = {}
+
+        def buffer_sigs(dest_sigiter):
+            """
+            Read attached signature files in memory
+
+            Signatures coming through a connection must be read before the
+            next one is fetched, which happens as we read ahead.
+            """
+            for dest_sig in dest_sigiter:
+                if dest_sig is not iterfile.MiscIterFlushRepeat and dest_sig.file:
+                    sig_fp = dest_sig.open("rb")
+                    sig_data = sig_fp.read()
+                    sig_fp.close()
+                    dest_sig = dest_sig.getRORPath()
+                    dest_sig.setfile(io.BytesIO(sig_data))
+                yield dest_sig
+
+        def get_task(dest_sig):
+            if dest_sig is iterfile.MiscIterFlushRepeat:
+                return None
+            if not dest_sig.isreg() or dest_sig.isflaglinked() or not dest_sig.file:
+                return None
+            src_rp = cls._select.get(dest_sig.index)
+            if not (src_rp and src_rp.isreg() and src_rp.readable()):
+                return None
+            sig_fp = dest_sig.open("rb")
+            sig_data = sig_fp.read()
+            sig_fp.close()
+            # the status must be taken before the worker reads the file
+            tasks[dest_sig.index] = (sig_data, cls._get_hash_setter(src_rp))
+            return (Rdiff.get_delta_path_hash, sig_data, src_rp.path, temp_dir)
+
+        # the window must stay well below the size of the selection cache
+        window = min(2 * jobs, consts.PIPELINE_MAX_LENGTH // 4)
+        temp_dir = tempfile.gettempdir()
+        for dest_sig, future in parallel.imap_ordered(
+            buffer_sigs(dest_sigiter), get_task, jobs, window
+        ):
+            if future is None:
+                if dest_sig is not iterfile.MiscIterFlushRepeat:
+                    tasks.pop(dest_sig.index, None)  # task not submitted
+                yield (dest_sig, None, None)
+            else:
+                sig_data, on_close = tasks.pop(dest_sig.index)
+                # the signature is attached again in case the worker fails
+                dest_sig = dest_sig.getRORPath()
+                dest_sig.setfile(io.BytesIO(sig_data))
+                yield (dest_sig, future, on_close)
+
+    @classmethod
+    def _open_hash_cache(cls):
+        """Open the source hash cache if one has been requested"""
+        cache_path = cls._values.get("source_hash_cache")
+        if cache_path:
+            cls._hash_cache = stat_cache.get_hash_cache(cache_path, cls._base_dir.path)
+        else:
+            cls._hash_cache = None
+
+    @classmethod
+    def _close_hash_cache(cls):
+        """Close the source hash cache, writing it for the next runs"""
+        if cls._hash_cache:
+            cls._hash_cache.close()
+            cls._hash_cache = None
+
+    @classmethod
+    def _get_hash_setter(cls, src_rp):
+        """
+        Return a function recording the hash of src_rp in the hash cache
+
+        The status of the file is taken immediately, hence before it is read,
+        so that a file changed while being read won't match it anymore.
+        None is returned if there is no hash cache or the file is gone.
+        """
+        if not cls._hash_cache:
+            return None
+        try:
+            statblock = os.lstat(src_rp.path)
+        except OSError:
+            return None
+        return lambda sha1_digest: cls._hash_cache.set(
+            src_rp.index, statblock, sha1_digest
+        )
+
+    @classmethod
+    def _get_sha1(cls, src_rp):
+        """
+        Return the hex SHA1 digest of src_rp, from the hash cache if possible
+        """
+        if not cls._hash_cache:
+            return hash.compute_sha1(src_rp)
+        statblock = os.lstat(src_rp.path)
+        sha1_digest = cls._hash_cache.get(src_rp.index, statblock)
+        if sha1_digest is None:
+            sha1_digest = hash.compute_sha1(src_rp)
+        else:
+            src_rp.set_sha1(sha1_digest)
+        cls._hash_cache.set(src_rp.index, statblock, sha1_digest)
+        return sha1_digest
+
     # @API(ReadDirShadow.compare_meta, 201)
     @classmethod
     def compare_meta(cls, repo_iter):
@@ -195,11 +355,12 @@ class ReadDirShadow(location.LocationShadow):
                 return 0
             elif (
                 src_rp.getsize() == mir_rorp.getsize()
-                and hash.compute_sha1(src_rp) == verify_sha1
+                and cls._get_sha1(src_rp) == verify_sha1
             ):
                 return 0
             return 1
 
+        cls._open_hash_cache()
         src_iter = cls.get_select()
         for src_rp, mir_rorp in rorpiter.Collate2Iters(src_iter, repo_iter):
             report = cls._get_basic_report(src_rp, mir_rorp, hashes_changed)
@@ -208,6 +369,8 @@ class ReadDirShadow(location.LocationShadow):
             else:
                 cls._log_success(src_rp, mir_rorp)
 
+        cls._close_hash_cache()
+
     # @API(ReadDirShadow.compare_full, 201)
     @classmethod
     def compare_full(cls, repo_iter):
@@ -380,11 +543,17 @@ class WriteDirShadow(location.LocationShadow):
         correction requirements, so it seemed easier to just repeat it
         all in this module.
         """
-        ITR = rorpiter.IterTreeReducer(_DirPatchITRB, [cls._base_dir])
-        for diff in rorpiter.FillInIter(diff_iter, cls._base_dir):
-            log.Log("Processing changed file {cf}".format(cf=diff), log.INFO)
-            ITR(diff.index, diff)
-        ITR.finish_processing()
+        jobs = cls._values.get("jobs") or 1
+        writer = parallel.ThreadTasks(jobs) if jobs > 1 else None
+        try:
+            ITR = rorpiter.IterTreeReducer(_DirPatchITRB, [cls._base_dir, writer])
+            for diff in rorpiter.FillInIter(diff_iter, cls._base_dir):
+                log.Log("Processing changed file {cf}".format(cf=diff), log.INFO)
+                ITR(diff.index, diff)
+            ITR.finish_processing()
+        finally:
+            if writer is not None:
+                writer.close()
         cls._base_dir.setdata()
 
     # @API(WriteDirShadow.get_fs_abilities, 201)  # inherited
@@ -402,14 +571,19 @@ class _DirPatchITRB(rorpiter.ITRBranch):
 
     This code was originally taken from backup.py.  However, because
     of different error correction requirements, it is repeated here.
+
+    If a parallel.ThreadTasks writer is given, regular files whose data
+    can be read from any thread are written by the writer's threads, and
+    directories wait for all pending files before being finished.
     """
 
-    def __init__(self, basis_root_rp):
+    def __init__(self, basis_root_rp, writer=None):
         """Set basis_root_rp, the base of the tree to be incremented"""
         assert (
             basis_root_rp.conn is specifics.local_connection
         ), "Function shall be called only locally."
         self.basis_root_rp = basis_root_rp
+        self.writer = writer
         self.dir_replacement, self.dir_update = None, None
         self.cached_rp = None
 
@@ -422,8 +596,18 @@ class _DirPatchITRB(rorpiter.ITRBranch):
         """Patch base_rp with diff_rorp (case where neither is directory)"""
         rp = self._get_rp_from_root(index)
         tf = rp.get_temp_rpath(sibling=True)
-        self._patch_to_temp(rp, diff_rorp, tf)
-        rpath.rename(tf, rp)
+        if self.writer is None:
+            self._patch_to_temp(rp, diff_rorp, tf)
+            rpath.rename(tf, rp)
+        elif self._can_write_in_thread(diff_rorp):
+            self.writer.submit(
+                self._write_file, self.basis_root_rp.new_index(index), diff_rorp, tf
+            )
+        else:
+            if diff_rorp.isflaglinked():
+                self.writer.wait()  # the link target must have been written
+            self._patch_to_temp(rp, diff_rorp, tf)
+            rpath.rename(tf, rp)
 
     def start_process_directory(self, index, diff_rorp):
         """Start processing directory - record information for later"""
@@ -441,6 +625,8 @@ class _DirPatchITRB(rorpiter.ITRBranch):
 
     def end_process_directory(self):
         """Finish processing directory"""
+        if self.writer is not None:
+            self.writer.wait()  # the content must be complete before attributes
         if self.dir_update:
             assert (
                 self.base_rp.isdir()
@@ -452,6 +638,29 @@ class _DirPatchITRB(rorpiter.ITRBranch):
             if self.dir_replacement.lstat():
                 rpath.rename(self.dir_replacement, self.base_rp)
 
+    def _can_write_in_thread(self, diff_rorp):
+        """
+        True if the diff is a regular file which can be written in a thread
+
+        Files embedded in the stream of a remote connection must be read
+        in turn, and hard links need their target to be written first.
+        """
+        return (
+            diff_rorp.isreg()
+            and not diff_rorp.isflaglinked()
+            and diff_rorp.get_attached_filetype() == "snapshot"
+            and diff_rorp.file is not None
+            # the attached file is wrapped in a closing hook
+            and not isinstance(
+                getattr(diff_rorp.file, "file", diff_rorp.file), iterfile.UnwrapFile
+            )
+        )
+
+    def _write_file(self, rp, diff_rorp, tf):
+        """Write the regular file of diff_rorp to rp through tf"""
+        self._patch_to_temp(rp, diff_rorp, tf)
+        rpath.rename(tf, rp)
+
     def _get_rp_from_root(self, index):
         """Return RPath by adding index to self.basis_root_rp"""
         if not self.cached_rp or self.cached_rp.index != index:
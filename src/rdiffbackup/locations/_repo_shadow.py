@@ -24,18 +24,24 @@ it has no real life of itself, i.e. it has only class methods and can't
 be instantiated.
 """
 
+import bisect
 import errno
+import hashlib
+import heapq
 import io
 import os
 import re
 import socket
 import sys
 import tempfile
+import time
 import yaml
+import zlib
 from rdiff_backup import (
     C,
     hash,
     iterfile,
+    librsync,
     Rdiff,
     robust,
     rorpiter,
@@ -44,13 +50,13 @@ from rdiff_backup import (
     selection,
     Time,
 )
-from rdiffbackup import meta_mgr
+from rdiffbackup import meta, meta_mgr
 from rdiffbackup.locations import fs_abilities, increment, location
 from rdiffbackup.locations.map import filenames as map_filenames
 from rdiffbackup.locations.map import hardlinks as map_hardlinks
 from rdiffbackup.locations.map import longnames as map_longnames
 from rdiffbackup.singletons import consts, fstats, generics, log, specifics, sstats
-from rdiffbackup.utils import convert, locking, quoting, simpleps
+from rdiffbackup.utils import compressors, convert, locking, parallel, quoting, simpleps
 
 # ### COPIED FROM BACKUP ####
 
@@ -79,6 +85,8 @@ class RepoShadow(location.LocationShadow):
     _configs = {
         "chars_to_quote": {"type": bytes},
         "special_escapes": {"type": set},
+        "metadata_format": {"type": bytes},
+        "compression_codec": {"type": bytes},
     }
 
     LOCK_MODE = {
@@ -439,8 +447,20 @@ class RepoShadow(location.LocationShadow):
         """
         Clear the given rdiff-backup-data if possible, it's faster than
         trying to do a regression, which would probably anyway fail.
-        """
-        cls._data_dir.delete()  # setdata is implicit
+
+        If the backup is resumed, the files partially transferred are kept,
+        the ones fully transferred are anyway found unchanged in the mirror.
+        """
+        if cls._values.get("resume"):
+            stash = _ResumeStash(cls._data_dir.append(_ResumeStash.NAME), cls._base_dir)
+            _RegressJournal(
+                cls._data_dir.append(_RegressJournal.NAME), cls._base_dir
+            ).stash_temps(stash)
+            for filename in cls._data_dir.listdir():
+                if filename != _ResumeStash.NAME:
+                    cls._data_dir.append(filename).delete()
+        else:
+            cls._data_dir.delete()  # setdata is implicit
         cls._incs_dir.setdata()
 
     @classmethod
@@ -536,7 +556,9 @@ class RepoShadow(location.LocationShadow):
             sel.parse_rbdir_exclude()
             return sel.get_select_iter()
 
-        meta_manager = meta_mgr.get_meta_manager(cls._data_dir, True)
+        # the snapshot of the previous backup is cached when replaced by a diff
+        cache_size = cls._values.get("metadata_cache_size", 0) * 1024 * 1024
+        meta_manager = meta_mgr.get_meta_manager(cls._data_dir, True, cache_size)
         if previous_time:  # it's an increment, not the first mirror
             rorp_iter = meta_manager.get_metas_at_time(previous_time)
             if rorp_iter:
@@ -552,6 +574,10 @@ class RepoShadow(location.LocationShadow):
         representing the epoch in seconds of the previous backup,
         false (==0) if we are just mirroring.
         """
+        if generics.preserve_hardlinks:
+            map_hardlinks.initialize(
+                cls._values.get("hard_links_memory_limit", 0) * 1024 * 1024
+            )
         dest_iter = cls._get_dest_select(baserp, previous_time)
         collated = rorpiter.Collate2Iters(source_iter, dest_iter)
         cls.CCPP = _CacheCollatedPostProcess(
@@ -562,12 +588,63 @@ class RepoShadow(location.LocationShadow):
             cls._values.get("null_separator") and b"\0" or b"\n",
         )
         # pipeline len adds some leeway over just*3 (to and from and back)
+        group_files = cls._values.get("group_commit")
+        if previous_time and group_files and generics.do_fsync:
+            cls.CCPP.group_commit = _GroupCommit(
+                cls.CCPP, cls._data_dir.append(_GroupCommit.JOURNAL_NAME), group_files
+            )
+        detect_moves = cls._values.get("detect_moves")
+        similar_basis = cls._values.get("similar_basis")
+        if previous_time and (detect_moves or similar_basis):
+            mirror_iter = meta_mgr.get_meta_manager().get_metas_at_time(previous_time)
+            if mirror_iter:
+                cls.CCPP.move_detector = _MoveDetector(
+                    baserp,
+                    cls._data_dir,
+                    mirror_iter,
+                    detect_moves=bool(detect_moves),
+                    similar_basis=bool(similar_basis),
+                )
+        cls.CCPP.regress_journal = _RegressJournal(
+            cls._data_dir.append(_RegressJournal.NAME), baserp
+        )
+        cls.CCPP.regress_journal.open(Time.getcurtime())
+        stash_rp = cls._data_dir.append(_ResumeStash.NAME)
+        if stash_rp.isdir():
+            cls.CCPP.resume_stash = _ResumeStash(stash_rp, baserp)
 
     @classmethod
     def _sigs_iterator(cls, baserp, is_local):
         """
         Yield signatures of any changed destination files
         """
+        jobs = cls._values.get("jobs") or 1
+        changed_iter = cls._iterate_changed_rorps(is_local)
+        if jobs > 1:
+            sig_iter = cls._get_sigs_parallel(baserp, changed_iter, jobs)
+        else:
+            sig_iter = (
+                (
+                    changed
+                    if changed is iterfile.MiscIterFlushRepeat
+                    else cls._get_one_sig(baserp, *changed)
+                )
+                for changed in changed_iter
+            )
+        for sig in sig_iter:
+            if sig is iterfile.MiscIterFlushRepeat:
+                yield sig
+            elif sig:
+                cls.CCPP.flag_changed(sig.index)
+                yield sig
+
+    @classmethod
+    def _iterate_changed_rorps(cls, is_local):
+        """
+        Yield tuples (index, src_rorp, dest_rorp) of changed files
+
+        The flushing marker is yielded as well if the pipe needs to be flushed.
+        """
         flush_threshold = consts.PIPELINE_MAX_LENGTH - 2
         num_rorps_seen = 0
         for src_rorp, dest_rorp in cls.CCPP:
@@ -588,19 +665,86 @@ class RepoShadow(location.LocationShadow):
                 )
             ):
                 index = src_rorp and src_rorp.index or dest_rorp.index
-                sig = cls._get_one_sig(baserp, index, src_rorp, dest_rorp)
-                if sig:
-                    cls.CCPP.flag_changed(index)
-                    yield sig
+                if src_rorp and dest_rorp and cls.CCPP.move_detector is not None:
+                    cls.CCPP.move_detector.set_changed(index)
+                yield (index, src_rorp, dest_rorp)
+
+    @classmethod
+    def _get_sigs_parallel(cls, baserp, changed_iter, jobs):
+        """
+        Yield signatures like _get_one_sig but using a pool of processes
+
+        Signatures of readable regular files are computed in full by the
+        workers, everything else is handled as usual when the item's turn
+        comes, so that signatures are still yielded in index order.
+        """
+
+        def get_sig_rp(changed):
+            """Return mirror path if the signature can be offloaded"""
+            if changed is iterfile.MiscIterFlushRepeat:
+                return None
+            index, src_rorp, dest_rorp = changed
+            if not (dest_rorp and dest_rorp.isreg()):
+                return None
+            if cls.CCPP.resume_stash is not None and index in cls.CCPP.resume_stash:
+                return None
+            if (
+                generics.preserve_hardlinks
+                and src_rorp
+                and map_hardlinks.is_linked(src_rorp)
+            ):
+                return None
+            dest_rp = map_longnames.get_mirror_rp(baserp, dest_rorp)
+            if dest_rp.isreg() and dest_rp.readable():
+                return dest_rp
+            return None
+
+        def get_task(item):
+            changed, dest_rp = item
+            return dest_rp and (Rdiff.get_signature_data, dest_rp.path)
+
+        # the window must stay well below the size of the CCPP cache
+        window = min(2 * jobs, consts.PIPELINE_MAX_LENGTH // 4)
+        items = ((changed, get_sig_rp(changed)) for changed in changed_iter)
+        for (changed, dest_rp), future in parallel.imap_ordered(
+            items, get_task, jobs, window
+        ):
+            if changed is iterfile.MiscIterFlushRepeat:
+                yield changed
+                continue
+            index, src_rorp, dest_rorp = changed
+            if future is None:
+                yield cls._get_one_sig(baserp, index, src_rorp, dest_rorp)
+                continue
+            dest_sig = dest_rorp.getRORPath()
+            try:
+                dest_sig.setfile(io.BytesIO(future.result()))
+            except (OSError, librsync.librsyncError) + parallel.WORKER_ERRORS as exc:
+                log.Log(
+                    "Computing signature of file {fi} in parallel failed "
+                    "with exception '{ex}', trying again".format(fi=dest_rp, ex=exc),
+                    log.INFO,
+                )
+                sig_fp = cls._get_one_sig_fp(dest_rp)
+                if sig_fp is None:
+                    dest_sig = None
+                else:
+                    dest_sig.setfile(sig_fp)
+            yield dest_sig
 
     @classmethod
     def _get_one_sig(cls, baserp, index, src_rorp, dest_rorp):
         """Return a signature given source and destination rorps"""
-        if (
+        is_linked = (
             generics.preserve_hardlinks
             and src_rorp
             and map_hardlinks.is_linked(src_rorp)
-        ):
+        )
+        if src_rorp and not is_linked and cls.CCPP.resume_stash is not None:
+            dest_sig = cls.CCPP.resume_stash.get_sig(index, src_rorp, dest_rorp)
+            if dest_sig is not None:
+                return dest_sig
+        if is_linked:
             dest_sig = rpath.RORPath(index)
             dest_sig.flaglinked(map_hardlinks.get_link_index(src_rorp))
         elif dest_rorp:
@@ -611,6 +755,10 @@ class RepoShadow(location.LocationShadow):
                 if sig_fp is None:
                     return None
                 dest_sig.setfile(sig_fp)
+        elif src_rorp and cls.CCPP.move_detector is not None:
+            dest_sig = cls.CCPP.move_detector.get_sig(index, src_rorp)
+            if dest_sig is None:
+                dest_sig = rpath.RORPath(index)
         else:
             dest_sig = rpath.RORPath(index)
         return dest_sig
@@ -854,7 +1002,9 @@ class RepoShadow(location.LocationShadow):
         if rest_time is None:
             rest_time = cls._restore_time
 
-        meta_manager = meta_mgr.get_meta_manager(cls._data_dir, True)
+        # metadata patched from diffs is cached if requested
+        cache_size = cls._values.get("metadata_cache_size", 0) * 1024 * 1024
+        meta_manager = meta_mgr.get_meta_manager(cls._data_dir, True, cache_size)
         rorp_iter = meta_manager.get_metas_at_time(rest_time, cls.mirror_base.index)
         if not rorp_iter:
             if require_metadata:
@@ -957,6 +1107,19 @@ class RepoShadow(location.LocationShadow):
     @classmethod
     def _get_diffs_from_collated(cls, collated):
         """Get diff iterator from collated"""
+        jobs = cls._values.get("jobs") or 1
+        if jobs > 1:
+            return cls._get_diffs_parallel(cls._iterate_diffs(collated, True), jobs)
+        return (diff for diff, rf in cls._iterate_diffs(collated, False))
+
+    @classmethod
+    def _iterate_diffs(cls, collated, defer_data):
+        """
+        Yield tuples (diff, rf) from collated
+
+        rf is the _RestoreFile of the diff if the restore of its data has
+        been deferred, else None, see _get_diff.
+        """
         for mir_rorp, target_rorp in collated:
             if generics.preserve_hardlinks and mir_rorp:
                 map_hardlinks.add_rorp(mir_rorp, target_rorp)
@@ -969,27 +1132,93 @@ class RepoShadow(location.LocationShadow):
                     and not map_hardlinks.rorp_eq(mir_rorp, target_rorp)
                 )
             ):
-                diff = cls._get_diff(mir_rorp, target_rorp)
+                diff, rf = cls._get_diff(mir_rorp, target_rorp, defer_data)
             else:
-                diff = None
+                diff, rf = None, None
             if generics.preserve_hardlinks and mir_rorp:
                 map_hardlinks.del_rorp(mir_rorp)
             if diff:
-                yield diff
+                yield diff, rf
 
     @classmethod
-    def _get_diff(cls, mir_rorp, target_rorp):
-        """Get a diff for mir_rorp at time"""
+    def _get_diff(cls, mir_rorp, target_rorp, defer_data=False):
+        """
+        Get a tuple (diff, rf) for mir_rorp at time
+
+        If defer_data is true and the data of a regular file can only be
+        restored by decompressing or patching increments, no file is
+        attached to the diff and its _RestoreFile is returned as rf instead
+        of None, so that the caller can restore the data itself.
+        """
         if not mir_rorp:
             mir_rorp = rpath.RORPath(target_rorp.index)
         elif generics.preserve_hardlinks and map_hardlinks.is_linked(mir_rorp):
             mir_rorp.flaglinked(map_hardlinks.get_link_index(mir_rorp))
         elif mir_rorp.isreg():
             expanded_index = cls.mirror_base.index + mir_rorp.index
-            file_fp = cls.rf_cache.get_fp(expanded_index, mir_rorp)
+            rf = cls.rf_cache.get_rf(expanded_index, mir_rorp)
+            if not rf:
+                file_fp = cls.rf_cache.get_missing_fp(expanded_index)
+            elif defer_data and rf.get_patch_paths():
+                mir_rorp.set_attached_filetype("snapshot")
+                return mir_rorp, rf
+            else:
+                file_fp = rf.get_restore_fp()
             mir_rorp.setfile(hash.FileWrapper(file_fp))
         mir_rorp.set_attached_filetype("snapshot")
-        return mir_rorp
+        return mir_rorp, None
+
+    @classmethod
+    def _get_diffs_parallel(cls, diff_iter, jobs):
+        """
+        Yield diffs like _get_diffs_from_collated but using a pool of processes
+
+        The data of files whose increments must be decompressed or patched
+        is restored by the workers into temporary files, everything else
+        is restored as usual when the diff's turn comes, so that diffs are
+        still yielded in index order.
+        """
+        temp_dir = tempfile.gettempdir()
+
+        def get_task(item):
+            diff, rf = item
+            return rf and (Rdiff.patch_data_to_temp, rf.get_patch_paths(), temp_dir)
+
+        def open_temp(temp_path):
+            """Open the temporary file, which is removed once closed"""
+            temp_fp = os.fdopen(
+                os.open(
+                    temp_path,
+                    os.O_RDONLY
+                    | getattr(os, "O_BINARY", 0)
+                    | getattr(os, "O_TEMPORARY", 0),
+                ),
+                "rb",
+            )
+            if not hasattr(os, "O_TEMPORARY"):
+                os.unlink(temp_path)  # data stays available until closed
+            return temp_fp
+
+        # the window must stay well below the size of the pipeline
+        window = min(2 * jobs, consts.PIPELINE_MAX_LENGTH // 4)
+        for (diff, rf), future in parallel.imap_ordered(
+            diff_iter, get_task, jobs, window
+        ):
+            if future is not None:
+                try:
+                    file_fp = open_temp(future.result())
+                except (
+                    OSError,
+                    librsync.librsyncError,
+                ) + parallel.WORKER_ERRORS as exc:
+                    log.Log(
+                        "Restoring file {fi} in parallel failed with "
+                        "exception '{ex}', trying again".format(fi=diff, ex=exc),
+                        log.INFO,
+                    )
+                    file_fp = rf.get_restore_fp()
+                diff.setfile(hash.FileWrapper(file_fp))
+            yield diff
 
     # ### COPIED FROM RESTORE (LIST) ####
 
@@ -1241,6 +1470,7 @@ class RepoShadow(location.LocationShadow):
             )
             return consts.RET_CODE_WARN
 
+        meta_mgr.invalidate_cache(cls._data_dir)
         for rp in yield_files(cls._data_dir):
             if (rp.isincfile() and rp.getinctime() < removal_time) or (
                 rp.isdir() and not rp.listdir()
@@ -1295,6 +1525,8 @@ class RepoShadow(location.LocationShadow):
         Returns OK if something was removed, else a warning
         """
         file_removed = False
+        if not cls._values["dry_run"]:
+            meta_mgr.invalidate_cache(cls._data_dir)
         for meta_prefix in cls.META_FILES:
             for meta_file in cls._data_dir.append(meta_prefix).get_incfiles_list():
                 file_removed |= cls._remove_from_metadata(meta_file, meta_prefix)
@@ -1335,6 +1567,8 @@ class RepoShadow(location.LocationShadow):
         This function is used to remove the repo path from the given `meta_file`.
         """
 
+        if meta_prefix == b"mirror_metadata" and cls._is_binary_metadata(meta_file):
+            return cls._remove_from_binary_metadata(meta_file)
         anything_removed = False
         start_marker, quote_fn, unquote_fn, matches = cls.META_FILES[meta_prefix]
         repopath = cls._ref_path.get_indexpath()
@@ -1359,27 +1593,7 @@ class RepoShadow(location.LocationShadow):
                             b"  AlternateIncrementName "
                         ) or line.startswith(b"  AlternateMirrorName "):
                             alt_name = unquote_fn(line.strip(b"\n").rsplit(b" ", 1)[1])
-                            alt_rp = map_longnames.get_long_rp(alt_name)
-
-                            for inc_rp in alt_rp.get_incfiles_list():
-                                log.Log(
-                                    "Removing long increment {ip}".format(ip=inc_rp),
-                                    log.INFO,
-                                )
-                                if not cls._values["dry_run"]:
-                                    inc_rp.delete()
-                            if alt_rp.lstat():
-                                log.Log(
-                                    "Removing long file {ip}".format(ip=alt_rp),
-                                    log.INFO,
-                                )
-                                if not cls._values["dry_run"]:
-                                    alt_rp.delete()
-                            else:
-                                log.Log(
-                                    "No long file {ip} to remove".format(ip=alt_rp),
-                                    log.INFO,
-                                )
+                            cls._remove_long_file(alt_name)
 
                         line = in_fp.readline()
                     anything_removed |= True
@@ -1396,6 +1610,73 @@ class RepoShadow(location.LocationShadow):
             rpath.rename(tmp_file, meta_file)
         return anything_removed
 
+    @classmethod
+    def _is_binary_metadata(cls, meta_file):
+        """
+        Returns True if the given metadata file is in binary format
+        """
+        if meta_file.isinccompressed():
+            return False
+        with meta_file.open("rb") as meta_fp:
+            return meta.is_binary_file(meta_fp)
+
+    @classmethod
+    def _remove_from_binary_metadata(cls, meta_file):
+        """
+        Remove the repo path from the given binary `meta_file`
+
+        The binary format can't be edited textually, so the objects are
+        read and the ones not within the repo path written to a new file.
+        """
+        anything_removed = False
+        ref_index = cls._ref_path.index
+        log.Log(
+            "Removing entry/ies of or within '{rp}' from '{mf}'".format(
+                rp=convert.to_safe_str(cls._ref_path.get_indexpath()),
+                mf=convert.to_safe_str(meta_file),
+            ),
+            log.INFO,
+        )
+        meta_class = meta_mgr.get_meta_list()[0]
+        tmp_file = meta_file.get_temp_rpath(sibling=True)
+        writer = meta_class(
+            tmp_file, "w", compress=generics.compression, check_path=0, binary=True
+        )
+        try:
+            for rorp in meta_class(meta_file, "r").get_objects():
+                if rorp.index[: len(ref_index)] == ref_index:
+                    if rorp.has_alt_mirror_name():
+                        cls._remove_long_file(rorp.get_alt_mirror_name())
+                    elif rorp.has_alt_inc_name():
+                        cls._remove_long_file(rorp.get_alt_inc_name())
+                    anything_removed |= True
+                else:
+                    writer.write_object(rorp)
+        finally:
+            writer.close()
+        if cls._values["dry_run"] or not anything_removed:
+            tmp_file.delete()
+        else:
+            rpath.rename(tmp_file, meta_file)
+        return anything_removed
+
+    @classmethod
+    def _remove_long_file(cls, alt_name):
+        """
+        Remove the long file and its increments with the alternate name
+        """
+        alt_rp = map_longnames.get_long_rp(alt_name)
+        for inc_rp in alt_rp.get_incfiles_list():
+            log.Log("Removing long increment {ip}".format(ip=inc_rp), log.INFO)
+            if not cls._values["dry_run"]:
+                inc_rp.delete()
+        if alt_rp.lstat():
+            log.Log("Removing long file {ip}".format(ip=alt_rp), log.INFO)
+            if not cls._values["dry_run"]:
+                alt_rp.delete()
+        else:
+            log.Log("No long file {ip} to remove".format(ip=alt_rp), log.INFO)
+
     @classmethod
     def _get_removal_time(cls, time_string, show_sizes):
         """
@@ -1529,41 +1810,91 @@ class RepoShadow(location.LocationShadow):
         )
         repo_iter = cls.init_and_get_loop(verify_time)
         base_index = cls.mirror_base.index
+        jobs = cls._values.get("jobs") or 1
 
-        bad_files = 0
-        no_hash = 0
-        ret_code = consts.RET_CODE_OK
-        for repo_rorp in repo_iter:
-            if not repo_rorp.isreg():
-                continue
-            verify_sha1 = map_hardlinks.get_hash(repo_rorp)
-            if not verify_sha1:
-                log.Log(
-                    "Cannot find SHA1 digest for file {fi}, perhaps "
-                    "because this feature was added in v1.1.1".format(fi=repo_rorp),
-                    log.WARNING,
-                )
-                no_hash += 1
-                ret_code |= consts.RET_CODE_FILE_WARN
-                continue
+        checkpoint = cls._get_verify_checkpoint(base_index)
+        bad_files = checkpoint.bad_files
+        no_hash = checkpoint.no_hash
+        ledger = cls._get_verify_ledger(base_index)
+        items = cls._get_verify_items(repo_iter, base_index, checkpoint, ledger)
+
+        def get_task(item):
+            repo_rorp, verify_sha1, key, verified = item
+            if not verify_sha1 or verified:
+                return None
             fp = cls.rf_cache.get_fp(base_index + repo_rorp.index, repo_rorp)
-            computed_hash = hash.compute_sha1_fp(fp)
-            if computed_hash == verify_sha1:
-                log.Log(
-                    "Verified SHA1 digest of file {fi}".format(fi=repo_rorp), log.INFO
+            return (hash.compute_sha1_fp, fp)
+
+        if jobs > 1:
+            # the files are read ahead in order and hashed in threads,
+            # hashlib releasing the GIL while hashing
+            results = (
+                (item, future and future.result())
+                for item, future in parallel.imap_ordered(
+                    items, get_task, jobs, threads=True
                 )
-            else:
-                bad_files += 1
+            )
+        else:
+            results = (
+                (item, task and task[0](*task[1:]))
+                for item in items
+                for task in (get_task(item),)
+            )
+
+        try:
+            for (repo_rorp, verify_sha1, key, verified), computed_hash in results:
+                if verified:
+                    log.Log(
+                        "Skipped file {fi} unchanged since its last "
+                        "verification".format(fi=repo_rorp),
+                        log.INFO,
+                    )
+                    ledger.set(repo_rorp.index, verify_sha1, key)
+                elif not verify_sha1:
+                    log.Log(
+                        "Cannot find SHA1 digest for file {fi}, perhaps "
+                        "because this feature was added in v1.1.1".format(fi=repo_rorp),
+                        log.WARNING,
+                    )
+                    no_hash += 1
+                elif computed_hash == verify_sha1:
+                    log.Log(
+                        "Verified SHA1 digest of file {fi}".format(fi=repo_rorp),
+                        log.INFO,
+                    )
+                    if key is not None:
+                        ledger.set(repo_rorp.index, verify_sha1, key)
+                else:
+                    bad_files += 1
+                    log.Log(
+                        "Computed SHA1 digest of file {fi} '{cd}' "
+                        "doesn't match recorded digest of '{rd}'. "
+                        "Your backup repository may be corrupted!".format(
+                            fi=repo_rorp, cd=computed_hash, rd=verify_sha1
+                        ),
+                        log.ERROR,
+                    )
+                checkpoint.update(repo_rorp.index, bad_files, no_hash)
+        except BaseException:
+            checkpoint.write()  # the next verification resumes from there
+            if ledger:
+                ledger.discard()
+            raise
+        checkpoint.remove()
+        if ledger:
+            ledger.commit()
+            if ledger.skipped:
                 log.Log(
-                    "Computed SHA1 digest of file {fi} '{cd}' "
-                    "doesn't match recorded digest of '{rd}'. "
-                    "Your backup repository may be corrupted!".format(
-                        fi=repo_rorp, cd=computed_hash, rd=verify_sha1
-                    ),
-                    log.ERROR,
+                    "Verification skipped {sk} files unchanged since their "
+                    "last verification".format(sk=ledger.skipped),
+                    log.NOTE,
                 )
-                ret_code |= consts.RET_CODE_FILE_ERR
         cls.finish_loop()
+        ret_code = consts.RET_CODE_OK
+        if bad_files:
+            ret_code |= consts.RET_CODE_FILE_ERR
+        if no_hash:
+            ret_code |= consts.RET_CODE_FILE_WARN
         if bad_files:
             log.Log(
                 "Verification found {cf} potentially corrupted files".format(
@@ -1587,6 +1918,88 @@ class RepoShadow(location.LocationShadow):
             log.Log("All files verified successfully", log.NOTE)
         return ret_code
 
+    @classmethod
+    def _get_verify_items(cls, repo_iter, base_index, checkpoint, ledger):
+        """
+        Yield tuples (rorp, recorded hash, ledger key, already verified)
+        of the regular files left to verify
+        """
+        for repo_rorp in repo_iter:
+            if not repo_rorp.isreg():
+                continue
+            if checkpoint.is_done(repo_rorp.index):
+                if ledger:
+                    ledger.keep(repo_rorp.index)
+                continue
+            verify_sha1 = map_hardlinks.get_hash(repo_rorp)
+            key = None
+            if ledger and verify_sha1:
+                rf = cls.rf_cache.get_rf(base_index + repo_rorp.index, repo_rorp)
+                if rf:
+                    key = ledger.get_key(rf)
+            yield (
+                repo_rorp,
+                verify_sha1,
+                key,
+                key is not None
+                and ledger.is_verified(repo_rorp.index, verify_sha1, key),
+            )
+
+    @classmethod
+    def _get_verify_checkpoint(cls, base_index):
+        """
+        Return the checkpoint of the verification, loaded if it's resumed
+        """
+        # the restore time is the backup time verified, whatever time given
+        checkpoint = _VerifyCheckpoint(
+            cls._data_dir.append(_VerifyCheckpoint.NAME),
+            cls._restore_time,
+            base_index,
+        )
+        if not cls._is_data_dir_writable():
+            # a checkpoint which can't be removed would be resumed forever
+            log.Log(
+                "Progress of verification can't be recorded in read-only "
+                "repository, an interrupted verification will start from "
+                "the beginning",
+                log.NOTE,
+            )
+            checkpoint.disable()
+        elif cls._values.get("resume", True):
+            checkpoint.load()
+        else:
+            checkpoint.remove()
+        return checkpoint
+
+    @classmethod
+    def _get_verify_ledger(cls, base_index):
+        """
+        Return the ledger of verified files if requested and possible, else None
+        """
+        if not cls._values.get("incremental"):
+            return None
+        if base_index:
+            log.Log(
+                "Incremental verification is only possible for the whole "
+                "repository, all files of the sub-path will be verified",
+                log.NOTE,
+            )
+            return None
+        ledger = _VerifyLedger(cls._data_dir.append(_VerifyLedger.NAME))
+        full_older_than = cls.get_parsed_time(cls._values["full_older_than"])
+        ledger.open(full_older_than, Time.getcurtime(), cls._is_data_dir_writable())
+        return ledger
+
+    @classmethod
+    def _is_data_dir_writable(cls):
+        """
+        Return True if a verification may record its state in the repository
+
+        It may not if the server is restricted to read-only access, or if the
+        data directory isn't writable, e.g. on a read-only mount.
+        """
+        return not Security.is_read_only() and os.access(cls._data_dir.path, os.W_OK)
+
     @classmethod
     def _open_logfile(cls):
         """
@@ -1621,7 +2034,9 @@ class RepoShadow(location.LocationShadow):
             return None
         stats_rp = increment.get_increment(
             cls._data_dir.append(b"file_statistics"),
-            cls._values["compression"] and "data.gz" or "data",
+            cls._values["compression"]
+            and b"data." + compressors.get_suffix(generics.compression_codec)
+            or b"data",
             Time.getcurtime(),
         )
         if stats_rp.lstat():
@@ -1707,14 +2122,42 @@ information in it.
         assert (
             cls._base_dir.conn is cls._incs_dir.conn is specifics.local_connection
         ), "Regress must happen locally."
+        meta_mgr.invalidate_cache(cls._data_dir)
         meta_manager, former_current_mirror_rp = cls._set_regress_time()
         cls._set_restore_times()
         _RegressFile.initialize(cls._restore_time, cls._mirror_time)
         cls._regress_rbdir(meta_manager)
-        ITR = rorpiter.IterTreeReducer(_RepoRegressITRB, [])
-        for rf in cls._iterate_meta_rfs(cls._base_dir, cls._incs_dir):
+        _GroupCommit.regress(cls._data_dir.append(_GroupCommit.JOURNAL_NAME))
+        journal = _RegressJournal(
+            cls._data_dir.append(_RegressJournal.NAME), cls._base_dir
+        )
+        if cls._values.get("resume"):
+            stash = _ResumeStash(cls._data_dir.append(_ResumeStash.NAME), cls._base_dir)
+            journal.stash_temps(stash, cls._unsuccessful_backup_time)
+        else:
+            stash = None
+        relaxed_dirs = journal.prepare(cls._unsuccessful_backup_time)
+        if relaxed_dirs is None:
+            rf_iter = cls._iterate_meta_rfs(cls._base_dir, cls._incs_dir)
+        else:
+            log.Log(
+                "Regressing only the paths recorded in journal {rj}".format(
+                    rj=journal.journal_rp
+                ),
+                log.NOTE,
+            )
+            rf_iter = cls._iterate_journal_rfs(journal.iterate_indexes(relaxed_dirs))
+        ITR = rorpiter.IterTreeReducer(_RepoRegressITRB, [stash])
+        for rf in rf_iter:
             ITR(rf.index, rf)
         ITR.finish_processing()
+        journal.remove()
+        if stash is not None and stash.kept:
+            log.Log(
+                "{nr} files transferred by the failed backup are kept in {rs} "
+                "to resume from".format(nr=stash.kept, rs=stash.stash_rp),
+                log.NOTE,
+            )
         if former_current_mirror_rp:
             if generics.do_fsync:
                 # Sync first, since we are marking dest dir as good now
@@ -1941,12 +2384,7 @@ information in it.
         root_rf = _RegressFile(mirror_rp, inc_rp, inc_rp.get_incfiles_list())
 
         def helper(rf):
-            mirror_rp = rf.mirror_rp
-            if specifics.process_uid != 0:
-                if mirror_rp.isreg() and not mirror_rp.readable():
-                    mirror_rp.chmod(0o400 | mirror_rp.getperms())
-                elif mirror_rp.isdir() and not mirror_rp.hasfullperms():
-                    mirror_rp.chmod(0o700 | mirror_rp.getperms())
+            cls._make_accessible(rf.mirror_rp)
             yield rf
             if rf.mirror_rp.isdir() or rf.inc_rp.isdir():
                 for sub_rf in rf.yield_sub_rfs():
@@ -1955,6 +2393,88 @@ information in it.
 
         return helper(root_rf)
 
+    @classmethod
+    def _iterate_journal_rfs(cls, indexes):
+        """
+        Yield _RegressFile objects with metadata for the given indexes only
+
+        Like _iterate_meta_rfs, but instead of walking the mirror and
+        increments directories, only the paths at the indexes recorded by
+        the journal of the failed backup are considered.
+        """
+        index_rorps = (rpath.RORPath(index) for index in indexes)
+        collated = rorpiter.Collate2Iters(index_rorps, cls._yield_metadata())
+        inc_lists = {}  # listings of the increment directories being visited
+        for index_rorp, metadata_rorp in collated:
+            if not index_rorp:
+                continue  # not touched by the failed backup
+            if metadata_rorp and metadata_rorp.has_alt_mirror_name():
+                raw_rf = None  # the mirror file is in the long names directory
+            else:
+                raw_rf = cls._get_journal_rf(index_rorp.index, inc_lists)
+            raw_rf = map_longnames.update_rf(
+                raw_rf, metadata_rorp, cls._base_dir, _RegressFile
+            )
+            if not raw_rf:
+                continue
+            raw_rf.set_metadata_rorp(metadata_rorp)
+            if metadata_rorp:
+                raw_rf.index = metadata_rorp.index
+            yield raw_rf
+
+    @classmethod
+    def _get_journal_rf(cls, index, inc_lists):
+        """
+        Return the _RegressFile at index, None if its name is too long
+
+        inc_lists caches the sorted listings of the increment directories,
+        so that each is only read once while visiting its files.
+        """
+        try:
+            mirror_rp = cls._base_dir.new_index(index)
+            inc_rp = cls._incs_dir.new_index(index)
+        except OSError as exc:
+            log.Log(
+                "Path at index {ix} can't be regressed due to exception "
+                "'{ex}'".format(ix=index, ex=exc),
+                log.INFO,
+            )
+            return None
+        cls._make_accessible(mirror_rp)
+        dirname, basename = inc_rp.dirsplit()
+        for cached_dir in list(inc_lists):
+            if not dirname.startswith(cached_dir):
+                del inc_lists[cached_dir]  # directory left for good
+        if dirname not in inc_lists:
+            parent_dir = inc_rp.__class__(inc_rp.conn, dirname, ())
+            if parent_dir.isdir():
+                inc_lists[dirname] = (parent_dir, sorted(parent_dir.listdir()))
+            else:
+                inc_lists[dirname] = (parent_dir, [])
+        parent_dir, filenames = inc_lists[dirname]
+        inc_list = []
+        pos = bisect.bisect_left(filenames, basename)
+        while pos < len(filenames) and filenames[pos].startswith(basename):
+            inc = parent_dir.append(filenames[pos])
+            if inc.isincfile() and inc.getincbase().path == inc_rp.path:
+                inc_list.append(inc)
+            pos += 1
+        return _RegressFile(mirror_rp, inc_rp, inc_list)
+
+    @staticmethod
+    def _make_accessible(mirror_rp):
+        """
+        Change permissions of an unreadable mirror file or directory
+
+        We don't have to change them back later because regress will do
+        that for us.
+        """
+        if specifics.process_uid != 0:
+            if mirror_rp.isreg() and not mirror_rp.readable():
+                mirror_rp.chmod(0o400 | mirror_rp.getperms())
+            elif mirror_rp.isdir() and not mirror_rp.hasfullperms():
+                mirror_rp.chmod(0o700 | mirror_rp.getperms())
+
     @classmethod
     def _yield_metadata(cls):
         """
@@ -1991,7 +2511,7 @@ information in it.
         or None if the configuration doesn't exist.
         """
         # the key is used as filename for now, acceptable values are
-        # chars_to_quote or special_escapes
+        # chars_to_quote, special_escapes, metadata_format or compression_codec
         if key not in cls._configs:
             raise ValueError("Config key '{ck}' isn't valid")
         rp = cls._data_dir.append(key)
@@ -2232,6 +2752,19 @@ class _CacheCollatedPostProcess:
         # the parent directories of the last item in the cache.
         self.parent_list = []
 
+        # Optional _GroupCommit object deferring the changes to the mirror
+        # files until their increments are durable
+        self.group_commit = None
+
+        # Optional _MoveDetector object finding the basis of new files
+        self.move_detector = None
+
+        # Optional _RegressJournal object recording the paths changed
+        self.regress_journal = None
+
+        # Optional _ResumeStash object with the data kept from a failed backup
+        self.resume_stash = None
+
     def __iter__(self):
         return self
 
@@ -2266,6 +2799,8 @@ class _CacheCollatedPostProcess:
     def set_inc(self, index, inc):
         """Set the increment of the current file"""
         self.cache_dict[index][4] = inc
+        if self.move_detector is not None:
+            self.move_detector.set_inc(index, inc)
 
     def get_rorps(self, index):
         """Retrieve (source_rorp, dest_rorp) from cache"""
@@ -2316,6 +2851,10 @@ class _CacheCollatedPostProcess:
 
     def close(self):
         """Process the remaining elements in the cache"""
+        if self.group_commit is not None:
+            self.group_commit.close()
+        if self.move_detector is not None:
+            self.move_detector.close()
         while self.cache_indices:
             self._shorten_cache()
         while self.dir_perms_list:
@@ -2323,6 +2862,12 @@ class _CacheCollatedPostProcess:
             dir_rp.chmod(perms)
         self.metawriter.close()
         meta_mgr.get_meta_manager().convert_meta_main_to_diff()
+        if self.regress_journal is not None:
+            self.regress_journal.close()
+        if self.resume_stash is not None:
+            self.resume_stash.close()
+        if generics.preserve_hardlinks:
+            map_hardlinks.close()
 
     def _pre_process(self, source_rorp, dest_rorp):
         """
@@ -2353,6 +2898,8 @@ class _CacheCollatedPostProcess:
         in self.dir_perms_list so the old perms can be restored.
         """
         dest_rp = self.dest_root_rp.new_index(dest_rorp.index)
+        if self.regress_journal is not None:
+            self.regress_journal.add_perms(dest_rorp.index)
         dest_rp.chmod(0o700 | dest_rorp.getperms())
         if source_rorp and source_rorp.isdir():
             self.dir_perms_list.append((dest_rp, source_rorp.getperms()))
@@ -2360,6 +2907,8 @@ class _CacheCollatedPostProcess:
     def _shorten_cache(self):
         """Remove one element from cache, possibly adding it to metadata"""
         first_index = self.cache_indices[0]
+        if self.group_commit is not None and first_index in self.group_commit:
+            self.group_commit.commit()  # the success flag must be known
         del self.cache_indices[0]
         try:
             (
@@ -2508,6 +3057,8 @@ class _RepoPatchITRB(rorpiter.ITRBranch):
         assert (
             not mirror_rp.isdir()
         ), "Mirror path '{rp}' points to a directory.".format(rp=mirror_rp)
+        if self.CCPP.regress_journal is not None:
+            self.CCPP.regress_journal.add_index(index)
         tf = mirror_rp.get_temp_rpath(sibling=True)
         result = self._patch_to_temp(mirror_rp, diff_rorp, tf)
         if result == self.UNCHANGED:
@@ -2535,6 +3086,8 @@ class _RepoPatchITRB(rorpiter.ITRBranch):
         self.base_rp, discard = map_longnames.get_mirror_inc_rps(
             self.CCPP.get_rorps(index), self.basis_root_rp
         )
+        if self.CCPP.regress_journal is not None:
+            self.CCPP.regress_journal.add_index(index)
         if diff_rorp.isdir():
             self._prepare_dir(diff_rorp, self.base_rp)
         elif self._set_dir_replacement(diff_rorp, self.base_rp):
@@ -2570,6 +3123,8 @@ class _RepoPatchITRB(rorpiter.ITRBranch):
         Returns True if able to write new as desired, False if
         UpdateError or similar gets in the way.
         """
+        if self.CCPP.regress_journal is not None:
+            self.CCPP.regress_journal.add_temp(new)
         if diff_rorp.isflaglinked():
             result = self._patch_hardlink_to_temp(basis_rp, diff_rorp, new)
             if result == self.FAILED or result == self.UNCHANGED:
@@ -2647,7 +3202,7 @@ class _RepoPatchITRB(rorpiter.ITRBranch):
             rp=diff_rorp, exp="diff", att=diff_rorp.get_attached_filetype()
         )
         report = robust.check_common_error(
-            self.error_handler, Rdiff.patch_local, (basis_rp, diff_rorp, new)
+            self.error_handler, self._patch_local, (basis_rp, diff_rorp, new)
         )
         if isinstance(report, hash.Report):
             if self.CCPP.update_hash(diff_rorp.index, report.sha1_digest):
@@ -2660,6 +3215,17 @@ class _RepoPatchITRB(rorpiter.ITRBranch):
         else:
             return self.DONE
 
+    def _patch_local(self, basis_rp, diff_rorp, new):
+        """
+        Patch basis_rp with the diff attached to diff_rorp into new
+
+        The data kept from a failed backup replaces basis_rp if the
+        signature was computed from it.
+        """
+        stash = self.CCPP.resume_stash
+        resume_basis_rp = stash and stash.pop_basis_rp(diff_rorp.index)
+        return Rdiff.patch_local(resume_basis_rp or basis_rp, diff_rorp, new)
+
     def _matches_cached_rorp(self, diff_rorp, new_rp):
         """
         Return self.DONE if new_rp matches cached src rorp else self.FAILED
@@ -2739,6 +3305,7 @@ class _RepoIncrementITRB(_RepoPatchITRB):
     def __init__(self, basis_root_rp, inc_root_rp, rorp_cache, previous_time):
         self.inc_root_rp = inc_root_rp
         self.previous_time = previous_time
+        self.new_signature = None  # signature of the patched file
         _RepoPatchITRB.__init__(self, basis_root_rp, rorp_cache)
 
     def fast_process_file(self, index, diff_rorp):
@@ -2746,7 +3313,13 @@ class _RepoIncrementITRB(_RepoPatchITRB):
         mirror_rp, inc_prefix = map_longnames.get_mirror_inc_rps(
             self.CCPP.get_rorps(index), self.basis_root_rp, self.inc_root_rp
         )
+        if self.CCPP.regress_journal is not None:
+            self.CCPP.regress_journal.add_index(index)
+        group = self.CCPP.group_commit
+        if group is not None and diff_rorp.isflaglinked():
+            group.commit()  # the file linked to must be in place
         tf = mirror_rp.get_temp_rpath(sibling=True)
+        self.new_signature = None
         result = self._patch_to_temp(mirror_rp, diff_rorp, tf)
         if result == self.UNCHANGED:
             log.Log("File content unchanged, only copying attributes", log.INFO)
@@ -2756,10 +3329,14 @@ class _RepoIncrementITRB(_RepoPatchITRB):
             inc = robust.check_common_error(
                 self.error_handler,
                 increment.make_increment,
-                (tf, mirror_rp, inc_prefix, self.previous_time),
+                (tf, mirror_rp, inc_prefix, self.previous_time, self.new_signature),
             )
             if inc is not None and not isinstance(inc, int):
                 self.CCPP.set_inc(index, inc)
+                if group is not None and (tf.lstat() or mirror_rp.lstat()):
+                    # the group makes the increment durable before rp changes
+                    group.add(index, tf if tf.lstat() else None, mirror_rp)
+                    return
                 if inc.isreg():
                     inc.fsync_with_dir()  # Write inc before rp changed
                 if tf.lstat():
@@ -2778,11 +3355,39 @@ class _RepoIncrementITRB(_RepoPatchITRB):
         if tf.lstat():
             tf.delete()
 
+    def _patch_local(self, basis_rp, diff_rorp, new):
+        """
+        Patch basis_rp with the diff attached to diff_rorp into new
+
+        The signature of new is calculated on the fly and kept, so that the
+        reverse diff increment doesn't need to read new again.
+        A new file is patched against the file it was moved from, if any,
+        and any file against the data kept from a failed backup, if used.
+        """
+        detector = self.CCPP.move_detector
+        move_basis_rp = detector and detector.pop_basis_rp(diff_rorp.index)
+        stash = self.CCPP.resume_stash
+        resume_basis_rp = stash and stash.pop_basis_rp(diff_rorp.index)
+        if resume_basis_rp:
+            basis_rp = resume_basis_rp
+        elif move_basis_rp:
+            basis_rp = move_basis_rp
+        try:
+            report, self.new_signature = Rdiff.patch_local_with_signature(
+                basis_rp, diff_rorp, new, diff_rorp.getsize()
+            )
+        finally:
+            if move_basis_rp:
+                detector.release_basis_rp(move_basis_rp)
+        return report
+
     def start_process_directory(self, index, diff_rorp):
         """Start processing directory"""
         self.base_rp, inc_prefix = map_longnames.get_mirror_inc_rps(
             self.CCPP.get_rorps(index), self.basis_root_rp, self.inc_root_rp
         )
+        if self.CCPP.regress_journal is not None:
+            self.CCPP.regress_journal.add_index(index)
         self.base_rp.setdata()
         assert (
             diff_rorp.isdir() or self.base_rp.isdir()
@@ -2790,10 +3395,17 @@ class _RepoIncrementITRB(_RepoPatchITRB):
             ipath=diff_rorp, bpath=self.base_rp
         )
         if diff_rorp.isdir():
+            # a file replaced by the directory is deleted right away, without
+            # waiting for the group commit to make its increment durable
+            replaces_file = self.base_rp.lstat() and not self.base_rp.isdir()
             inc = increment.make_increment(
                 diff_rorp, self.base_rp, inc_prefix, self.previous_time
             )
-            if inc and inc.isreg():
+            if (
+                inc
+                and inc.isreg()
+                and (self.CCPP.group_commit is None or replaces_file)
+            ):
                 inc.fsync_with_dir()  # must write inc before rp changed
             self.base_rp.setdata()  # in case written by increment above
             self._prepare_dir(diff_rorp, self.base_rp)
@@ -2805,48 +3417,1115 @@ class _RepoIncrementITRB(_RepoPatchITRB):
                 self.CCPP.set_inc(index, inc)
                 self.CCPP.flag_success(index)
 
+    def end_process_directory(self):
+        """Finish processing directory, once its content is in place"""
+        if self.CCPP.group_commit is not None:
+            self.CCPP.group_commit.commit_dir(self.base_index)
+        _RepoPatchITRB.end_process_directory(self)
 
-class _CachedRF:
-    """Store _RestoreFile objects until they are needed
 
-    The code above would like to pretend it has random access to RFs,
-    making one for a particular index at will.  However, in general
-    this involves listing and filtering a directory, which can get
-    expensive.
+class _GroupCommit:
+    """
+    Defer the changes to mirror files until their increments are durable
+
+    Instead of fsync'ing each increment before the mirror file it saves is
+    replaced, the replacements (renames of patched temporary files or
+    deletions) are gathered in groups, and a single sync of the file system
+    makes all increments of a group durable before its changes are applied.
+    The temporary files of the group are recorded in a journal next to the
+    current_mirror marker, so that a regress can remove the ones left over
+    by an interrupted group. As the mirror files are only changed after the
+    sync, a regress can always find the increments it needs.
+    """
 
-    Thus, when a _CachedRF retrieves an _RestoreFile, it creates all the
-    RFs of that directory at the same time, and doesn't have to
-    recalculate.  It assumes the indices will be in order, so the
-    cache is deleted if a later index is requested.
+    JOURNAL_NAME = b"group_journal"
 
-    """
+    def __init__(self, ccpp, journal_rp, max_files):
+        self.CCPP = ccpp
+        self.journal_rp = journal_rp
+        self.max_files = max_files
+        # maps indexes to (temp_rp, mirror_rp), temp_rp is None for deletion
+        self._pending = {}
+        self.error_handler = robust.get_error_handler("UpdateError")
 
-    def __init__(self, root_rf):
-        """Initialize _CachedRF, self.rf_list variable"""
-        self.root_rf = root_rf
-        self.rf_list = []  # list should filled in index order
-        if specifics.process_uid != 0:
-            self.perm_changer = _PermissionChanger(root_rf.mirror_rp)
+    def __contains__(self, index):
+        return index in self._pending
 
-    def get_fp(self, index, mir_rorp):
-        """Return the file object (for reading) of given index"""
-        rf = map_longnames.update_rf(
-            self._get_rf(index, mir_rorp),
-            mir_rorp,
-            self.root_rf.mirror_rp,
-            _RestoreFile,
-        )
-        if not rf:
-            log.Log(
-                "Unable to retrieve data for file {fi}! The cause is "
-                "probably data loss from the backup repository".format(
-                    fi=(index and "/".join(index) or ".")
+    def add(self, index, temp_rp, mirror_rp):
+        """Schedule the renaming of temp_rp or the deletion of mirror_rp"""
+        self._pending[index] = (temp_rp, mirror_rp)
+        if len(self._pending) >= self.max_files:
+            self.commit()
+
+    def commit_dir(self, dir_index):
+        """
+        Commit the group if it changes files directly within the directory
+
+        This must happen before the directory's attributes are set, as
+        renaming files into a directory changes its modification time.
+        """
+        for index in self._pending:
+            if index[:-1] == dir_index:
+                self.commit()
+                return
+
+    def commit(self):
+        """Sync the file system and apply the pending changes"""
+        if not self._pending:
+            return
+        log.Log(
+            "Committing group of {nr} changed files".format(nr=len(self._pending)),
+            log.DEBUG,
+        )
+        if self.journal_rp.lstat():
+            self.journal_rp.delete()
+        self.journal_rp.write_bytes(
+            b"".join(
+                temp_rp.path + b"\0"
+                for temp_rp, mirror_rp in self._pending.values()
+                if temp_rp is not None
+            )
+        )
+        C.sync()  # increments, temporary files and journal are now durable
+        for index, (temp_rp, mirror_rp) in self._pending.items():
+            if temp_rp is None:
+                mirror_rp.delete()
+                self.CCPP.flag_deleted(index)
+                continue
+            if (
+                robust.check_common_error(
+                    self.error_handler, rpath.rename, (temp_rp, mirror_rp)
+                )
+                is None
+            ):
+                self.CCPP.flag_success(index)
+            temp_rp.setdata()
+            if temp_rp.lstat():
+                temp_rp.delete()
+        self._pending.clear()
+
+    def close(self):
+        """Commit the last group and remove the journal"""
+        self.commit()
+        if self.journal_rp.lstat():
+            self.journal_rp.delete()
+
+    @staticmethod
+    def regress(journal_rp):
+        """Remove the temporary files left over by an interrupted group"""
+        if not journal_rp.lstat():
+            return
+        for temp_path in journal_rp.get_bytes().split(b"\0"):
+            if not temp_path:
+                continue
+            temp_rp = journal_rp.newpath(temp_path)
+            if temp_rp.lstat():
+                log.Log(
+                    "Deleting temporary file {tf} of interrupted group".format(
+                        tf=temp_rp
+                    ),
+                    log.INFO,
+                )
+                temp_rp.delete()
+        journal_rp.delete()
+
+
+class _RegressJournal:
+    """
+    Record the paths touched by a backup, so that a regress only visits them
+
+    The journal is a sequence of null terminated fields, made of a header
+    with the time of the backup session and the boot ID of the system,
+    followed by one record per path, each written before the path changes.
+    A record starts with its type: the index of a path processed in index
+    order, the index of a directory whose permissions were relaxed ahead of
+    processing, the path of a temporary file relative to the mirror root, or
+    the start of a regress.
+    The records are only flushed and not synced, hence the journal can't be
+    trusted after a reboot, nor if an earlier regress was interrupted, as it
+    doesn't record the changes of the regress itself. A regress then walks
+    the whole repository, as it does without journal.
+    """
+
+    NAME = b"regress_journal"
+    _MAGIC = b"rdiff-backup regress journal"
+    _VERSION = b"1"
+    _INDEX = b"i"
+    _PERMS = b"p"
+    _TEMP = b"t"
+    _REGRESS = b"r"
+
+    def __init__(self, journal_rp, mirror_rp):
+        self.journal_rp = journal_rp
+        self.mirror_rp = mirror_rp
+        self._fp = None
+        self._last_index = None
+
+    def open(self, backup_time):
+        """Start the journal of the backup session at backup_time"""
+        try:
+            self._fp = self.journal_rp.open("wb")
+            self._write_fields(
+                self._MAGIC, self._VERSION, b"%d" % backup_time, _get_boot_id()
+            )
+        except OSError as exc:
+            log.Log(
+                "Regress journal {rj} can't be written due to exception '{ex}', "
+                "a regress would need to go through all files".format(
+                    rj=self.journal_rp, ex=exc
                 ),
                 log.WARNING,
             )
-            return io.BytesIO()
+            self._fp = None
+
+    def add_index(self, index):
+        """Record the path at index before the backup processes it"""
+        if index != self._last_index:
+            self._write_fields(self._INDEX + b"/".join(index))
+            self._last_index = index
+
+    def add_perms(self, index):
+        """Record the directory at index before its permissions are relaxed"""
+        self._write_fields(self._PERMS + b"/".join(index))
+
+    def add_temp(self, temp_rp):
+        """Record the temporary file before it's created"""
+        self._write_fields(
+            self._TEMP + os.path.relpath(temp_rp.path, self.mirror_rp.path)
+        )
+
+    def close(self):
+        """Remove the journal, the backup having completed"""
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+        self.remove()
+
+    def prepare(self, backup_time):
+        """
+        Check the journal and delete the temporary files it records
+
+        Return the sorted indexes of the directories with relaxed permissions,
+        or None if the journal doesn't exist or can't be trusted for the
+        failed backup session at backup_time.
+        """
+        self.journal_rp.setdata()
+        if not self.journal_rp.lstat():
+            return None
+        try:
+            relaxed_dirs, temps = self._check(backup_time)
+        except (OSError, StopIteration, ValueError) as exc:
+            log.Log(
+                "Regress journal {rj} can't be used due to '{ex}', all files "
+                "will be regressed".format(rj=self.journal_rp, ex=exc),
+                log.NOTE,
+            )
+            return None
+        with self.journal_rp.open("ab") as fp:
+            fp.write(self._REGRESS + b"\0")
+        for _, temp_path in temps:
+            temp_rp = self.mirror_rp.newpath(
+                os.path.join(self.mirror_rp.path, temp_path)
+            )
+            if temp_rp.lstat():
+                log.Log(
+                    "Deleting temporary file {tf} of failed backup".format(tf=temp_rp),
+                    log.INFO,
+                )
+                temp_rp.delete()
+        return sorted(set(relaxed_dirs))
+
+    def stash_temps(self, stash, backup_time=None):
+        """
+        Move the temporary files recorded to the resume stash
+
+        Each temporary file holds the partial content of the path whose
+        index was recorded before it.  Nothing is moved unless the journal
+        is valid for the failed backup session at backup_time, or for any
+        session if backup_time is None.
+        """
+        self.journal_rp.setdata()
+        if not self.journal_rp.lstat():
+            return
+        try:
+            temps = self._check(backup_time)[1]
+        except (OSError, StopIteration, ValueError) as exc:
+            log.Log(
+                "Regress journal {rj} can't be used due to '{ex}', no "
+                "temporary file is kept to resume from".format(
+                    rj=self.journal_rp, ex=exc
+                ),
+                log.INFO,
+            )
+            return
+        for index, temp_path in temps:
+            if not index:
+                continue
+            temp_rp = self.mirror_rp.newpath(
+                os.path.join(self.mirror_rp.path, temp_path)
+            )
+            if temp_rp.isreg() and temp_rp.getsize():
+                stash.add(index, temp_rp, partial=True)
+
+    def iterate_indexes(self, relaxed_dirs):
+        """
+        Yield in order the indexes to regress, starting with the root
+
+        relaxed_dirs is the list returned by prepare.
+        """
+        last_index = ()
+        yield last_index
+        with self.journal_rp.open("rb") as fp:
+            fields = _read_fields(fp, strict=False)
+            for _ in range(4):  # skip the header, already checked
+                next(fields)
+            indexes = (
+                self._get_index(field) for field in fields if field[:1] == self._INDEX
+            )
+            for index in heapq.merge(indexes, relaxed_dirs):
+                if index > last_index:
+                    yield index
+                    last_index = index
+
+    def remove(self):
+        """Delete the journal, if it exists"""
+        self.journal_rp.setdata()
+        if self.journal_rp.lstat():
+            self.journal_rp.delete()
+
+    def _check(self, backup_time):
+        """
+        Read the whole journal and raise ValueError if it can't be used
+
+        Return the list of directories with relaxed permissions and the list
+        of temporary paths recorded, each with the index recorded before it.
+        The journal may be of any backup session if backup_time is None.
+        """
+        relaxed_dirs = []
+        temps = []
+        last_index = None
+        with self.journal_rp.open("rb") as fp:
+            fields = _read_fields(fp, strict=False)
+            magic, version, journal_time, boot_id = [next(fields) for _ in range(4)]
+            if (magic, version) != (self._MAGIC, self._VERSION):
+                raise ValueError("unknown format")
+            if backup_time is not None and int(journal_time) != backup_time:
+                raise ValueError("journal of another backup session")
+            if boot_id != _get_boot_id():
+                raise ValueError("system rebooted since the backup")
+            for field in fields:
+                record_type, value = field[:1], field[1:]
+                if record_type == self._INDEX:
+                    index = self._get_index(field)
+                    if last_index is not None and index <= last_index:
+                        raise ValueError("indexes out of order")
+                    last_index = index
+                elif record_type == self._PERMS:
+                    relaxed_dirs.append(self._get_index(field))
+                elif record_type == self._TEMP:
+                    temps.append((last_index, self._get_temp_path(value)))
+                elif record_type == self._REGRESS:
+                    raise ValueError("earlier regress interrupted")
+                else:
+                    raise ValueError("unknown record type")
+        return relaxed_dirs, temps
+
+    def _write_fields(self, *fields):
+        """Write the given fields, each terminated by a null character"""
+        if self._fp is None:
+            return
+        self._fp.write(b"".join(field + b"\0" for field in fields))
+        self._fp.flush()  # the record must reach the OS before the change
+
+    @staticmethod
+    def _get_temp_path(value):
+        """Return the normalized temporary path, if it's within the mirror"""
+        temp_path = os.path.normpath(value)
+        if (
+            os.path.isabs(temp_path)
+            or temp_path == b"."
+            or temp_path.split(os.sep.encode())[0] == b".."
+        ):
+            raise ValueError(
+                "temporary path {tp} outside of the mirror".format(
+                    tp=os.fsdecode(value)
+                )
+            )
+        return temp_path
+
+    @staticmethod
+    def _get_index(field):
+        """Return the index recorded in the field, after its type"""
+        if len(field) > 1:
+            return tuple(field[1:].split(b"/"))
+        return ()
+
+
+class _ResumeStash:
+    """
+    Keep the files transferred by a failed backup, to resume from them
+
+    When a failed backup is regressed, the mirror files it had already
+    replaced are hard linked into the stash before they are regressed, and
+    the temporary files it was writing are moved there.  The next backup
+    computes the signature of a changed or new file from its stashed
+    version instead of the mirror file, so that the data already
+    transferred is sent as diff, and removes the stash once done.
+    A partial file is completed with the content of the mirror file, if
+    any, to serve as basis for the rest of the file.
+    The files are named after the SHA1 hash of their index, so that no
+    directory structure or long names need to be handled.
+    """
+
+    NAME = b"resume_data"
+    _PARTIAL = b".partial"
+
+    def __init__(self, stash_rp, mirror_root_rp):
+        self.stash_rp = stash_rp
+        self.mirror_root_rp = mirror_root_rp
+        self.kept = 0
+        self.resumed = 0
+        self._bases = {}  # maps indexes to the stashed basis used
+
+    def __contains__(self, index):
+        return bool(
+            self._get_rp(index).lstat() or self._get_rp(index, partial=True).lstat()
+        )
+
+    def add(self, index, rp, partial=False):
+        """Keep rp as content of the path at index, moved if partial"""
+        stash_file_rp = self._get_rp(index, partial)
+        try:
+            if not self.stash_rp.isdir():
+                self.stash_rp.mkdir()
+            if stash_file_rp.lstat():
+                stash_file_rp.delete()
+            if partial:
+                rpath.rename(rp, stash_file_rp)
+            else:
+                stash_file_rp.hardlink(rp.path)
+        except OSError as exc:
+            log.Log(
+                "File {fi} can't be kept to resume from due to exception "
+                "'{ex}'".format(fi=rp, ex=exc),
+                log.INFO,
+            )
+            return
+        self.kept += 1
+
+    def get_sig(self, index, src_rorp, dest_rorp):
+        """
+        Return the signature of the stashed version of the file, or None
+
+        The signature looks like the one of the mirror file, or of a new
+        file if there is none.
+        """
+        if not src_rorp.isreg() or (dest_rorp and not dest_rorp.isreg()):
+            return None
+        basis_rp = self._get_basis_rp(index)
+        if basis_rp is None:
+            return None
+        try:
+            sig_data = Rdiff.get_signature_data(basis_rp.path)
+        except OSError as exc:
+            log.Log(
+                "Signature of {ba} kept for file {fi} couldn't be computed "
+                "due to exception '{ex}'".format(ba=basis_rp, fi=src_rorp, ex=exc),
+                log.INFO,
+            )
+            return None
+        log.Log(
+            "File {fi} is sent as diff against the data kept from the "
+            "failed backup".format(fi=src_rorp),
+            log.INFO,
+        )
+        self._bases[index] = basis_rp
+        self.resumed += 1
+        if dest_rorp:
+            dest_sig = dest_rorp.getRORPath()
+        else:
+            dest_sig = rpath.RORPath(index, {"type": "reg", "size": src_rorp.getsize()})
+        dest_sig.setfile(io.BytesIO(sig_data))
+        return dest_sig
+
+    def pop_basis_rp(self, index):
+        """Return the stashed basis used for the file at index, or None"""
+        return self._bases.pop(index, None)
+
+    def close(self):
+        """Remove the stash, the backup being complete"""
+        if self.resumed:
+            log.Log(
+                "{nr} files were sent as diff against the data kept from the "
+                "failed backup".format(nr=self.resumed),
+                log.NOTE,
+            )
+        self.stash_rp.setdata()
+        if self.stash_rp.lstat():
+            self.stash_rp.delete()
+
+    def _get_basis_rp(self, index):
+        """Return the stashed file for index, completing a partial one"""
+        basis_rp = self._get_rp(index)
+        if basis_rp.isreg():
+            return basis_rp
+        partial_rp = self._get_rp(index, partial=True)
+        if not partial_rp.isreg():
+            return None
+        mirror_rp = self.mirror_root_rp.new_index(index)
+        try:
+            if mirror_rp.isreg():
+                # not appending, so that holes of the mirror file are seeked
+                with partial_rp.open("r+b") as out_fp, mirror_rp.open("rb") as in_fp:
+                    out_fp.seek(0, os.SEEK_END)
+                    rpath.copyfileobj(in_fp, out_fp)
+            rpath.rename(partial_rp, basis_rp)
+        except OSError as exc:
+            log.Log(
+                "Partial file {pf} can't be completed due to exception "
+                "'{ex}'".format(pf=partial_rp, ex=exc),
+                log.INFO,
+            )
+            return None
+        basis_rp.setdata()
+        return basis_rp
+
+    def _get_rp(self, index, partial=False):
+        """Return the path of the stashed file for index"""
+        name = hashlib.sha1(b"/".join(index)).hexdigest().encode()
+        if partial:
+            name += self._PARTIAL
+        return self.stash_rp.append(name)
+
+
+class _VerifyCheckpoint:
+    """
+    Record the progress of a verification, so that it can be resumed
+
+    The checkpoint file holds the verified time and sub-path, the index of
+    the last verified file, and the numbers of bad files and of files
+    without hash found so far, separated by null characters.  It's written
+    at most every interval seconds and when the verification is
+    interrupted, and removed once the verification is complete.
+    """
+
+    NAME = b"verify_checkpoint"
+    interval = 60  # seconds between two writes of the checkpoint
+
+    def __init__(self, checkpoint_rp, verify_time, base_index):
+        self.checkpoint_rp = checkpoint_rp
+        self.key = (b"%d" % verify_time, b"/".join(base_index))
+        self.index = None  # index of the last verified file
+        self.bad_files = 0
+        self.no_hash = 0
+        self._last_write = time.time()
+        self._changed = False
+        self._writable = True
+        self._enabled = True
+
+    def disable(self):
+        """Never read, write nor remove the checkpoint file"""
+        self._writable = self._enabled = False
+
+    def load(self):
+        """Load the progress of a previous verification with the same key"""
+        if not self.checkpoint_rp.lstat():
+            return
+        try:
+            verify_time, base, bad_files, no_hash, index = (
+                self.checkpoint_rp.get_bytes().split(b"\0")
+            )
+            if (verify_time, base) != self.key:
+                return  # another time or path was being verified
+            self.bad_files = int(bad_files)
+            self.no_hash = int(no_hash)
+        except (OSError, ValueError) as exc:
+            log.Log(
+                "Verification checkpoint {cp} can't be read due to exception "
+                "'{ex}', verification starts from the beginning".format(
+                    cp=self.checkpoint_rp, ex=exc
+                ),
+                log.WARNING,
+            )
+            return
+        self.index = tuple(index.split(b"/")) if index else ()
+        log.Log(
+            "Resuming interrupted verification after file {fi}".format(
+                fi=self.index and "/".join(map(os.fsdecode, self.index)) or "."
+            ),
+            log.NOTE,
+        )
+
+    def is_done(self, index):
+        """Return True if the file at index was verified before resuming"""
+        return self.index is not None and index <= self.index
+
+    def update(self, index, bad_files, no_hash):
+        """Record the file at index as verified, write checkpoint if due"""
+        self.index = index
+        self.bad_files = bad_files
+        self.no_hash = no_hash
+        self._changed = True
+        if time.time() - self._last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """Write the checkpoint file atomically if anything changed"""
+        if not (self._changed and self._writable):
+            return
+        temp_rp = self.checkpoint_rp.get_temp_rpath(sibling=True)
+        try:
+            temp_rp.write_bytes(
+                b"\0".join(
+                    self.key
+                    + (
+                        b"%d" % self.bad_files,
+                        b"%d" % self.no_hash,
+                        b"/".join(self.index),
+                    )
+                )
+            )
+            rpath.rename(temp_rp, self.checkpoint_rp)
+        except OSError as exc:
+            log.Log(
+                "Progress of verification can't be recorded in {cp} due to "
+                "exception '{ex}', an interrupted verification will start "
+                "from the beginning".format(cp=self.checkpoint_rp, ex=exc),
+                log.WARNING,
+            )
+            self._writable = False
+            temp_rp.setdata()
+            if temp_rp.lstat():
+                temp_rp.delete()
+        self._changed = False
+        self._last_write = time.time()
+
+    def remove(self):
+        """Remove the checkpoint file, if any"""
+        if not (self._enabled and self.checkpoint_rp.lstat()):
+            return
+        try:
+            self.checkpoint_rp.delete()
+        except OSError as exc:
+            log.Log(
+                "Verification checkpoint {cp} can't be removed due to "
+                "exception '{ex}', remove it or the next verification "
+                "might resume from it".format(cp=self.checkpoint_rp, ex=exc),
+                log.WARNING,
+            )
+
+
+class _VerifyLedger:
+    """
+    Record the files verified successfully, to skip them while unchanged
+
+    The ledger file is a gzipped sequence of null terminated fields, made
+    of a header with the time of the last full verification, followed by
+    one record per verified file with its index, its SHA1 digest and a key
+    describing the mirror file and increments it was restored from.
+    A file whose record still matches doesn't need to be read again, as
+    long as the last full verification isn't too old.
+    The records are read and written in index order, so that the ledger
+    never needs to be held in memory, and the new ledger only replaces the
+    old one once the verification is complete.
+    """
+
+    NAME = b"verify_ledger"
+    _MAGIC = b"rdiff-backup verify ledger"
+    _VERSION = b"1"
+
+    def __init__(self, ledger_rp):
+        self.ledger_rp = ledger_rp
+        self.skipped = 0
+        self._old_fp = None
+        self._old_fields = None
+        self._old_record = None
+        self._temp_rp = None
+        self._new_fp = None
+
+    def open(self, full_older_than, verify_start, writable=True):
+        """
+        Open the old and the new ledger, return True if the old one is used
+
+        The old ledger isn't used if it's missing or unreadable, or if its
+        last full verification is older than full_older_than, in which case
+        all files must be verified, making it a full verification started
+        at verify_start.  If the repository isn't writable, the old ledger
+        is only read.
+        """
+        full_time = self._open_old(full_older_than)
+        if full_time is None:
+            full_time = verify_start
+        if not writable:
+            log.Log(
+                "Verification ledger {vl} can't be updated in read-only "
+                "repository, the files verified won't be recorded".format(
+                    vl=self.ledger_rp
+                ),
+                log.NOTE,
+            )
+            return self._old_fp is not None
+        self._temp_rp = self.ledger_rp.get_temp_rpath(sibling=True)
+        try:
+            self._new_fp = self._temp_rp.open("wb", b"gz")
+            self._write_fields(self._MAGIC, self._VERSION, b"%d" % full_time)
+        except OSError as exc:
+            self._write_failed(exc)
+        return self._old_fp is not None
+
+    def is_verified(self, index, sha1, key):
+        """Return True if the file at index was verified since it changed"""
+        self._skip_old_records(index)
+        if self._old_record == (index, sha1, key):
+            self.skipped += 1
+            return True
+        return False
+
+    def keep(self, index):
+        """Keep the old record of index, the file being verified anyway"""
+        self._skip_old_records(index)
+        if self._old_record is not None and self._old_record[0] == index:
+            self.set(*self._old_record)
+
+    def set(self, index, sha1, key):
+        """Record the file at index as verified"""
+        if not self._new_fp:
+            return
+        try:
+            self._write_fields(b"/".join(index), sha1.encode(), key)
+        except OSError as exc:
+            self._write_failed(exc)
+
+    def commit(self):
+        """Replace the old ledger with the new one"""
+        if not self._new_fp:
+            return
+        self._close_old()
+        try:
+            self._new_fp.close()
+            self._new_fp = None
+            self._temp_rp.setdata()
+            rpath.rename(self._temp_rp, self.ledger_rp)
+        except OSError as exc:
+            self._write_failed(exc)
+
+    def discard(self, keep_old=False):
+        """Throw away the new ledger, e.g. if the verification failed"""
+        if not keep_old:
+            self._close_old()
+        try:
+            if self._new_fp:
+                self._new_fp.close()
+            if self._temp_rp:
+                self._temp_rp.setdata()
+                if self._temp_rp.lstat():
+                    self._temp_rp.delete()
+        except OSError as exc:
+            log.Log(
+                "Temporary verification ledger {tl} can't be removed due to "
+                "exception '{ex}'".format(tl=self._temp_rp, ex=exc),
+                log.WARNING,
+            )
+        self._new_fp = None
+
+    @staticmethod
+    def get_key(rf):
+        """Return a key describing the data the _RestoreFile is restored from"""
+        key = []
+        for inc_rp in rf.relevant_incs:
+            key.append(os.path.basename(inc_rp.path))
+            if inc_rp.lstat():
+                key.extend(
+                    b"%d" % value
+                    for value in (
+                        inc_rp.getinode(),
+                        inc_rp.getsize(),
+                        inc_rp.getmtime(),
+                        inc_rp.getctime(),
+                    )
+                )
+        return b"/".join(key)
+
+    def _open_old(self, full_older_than):
+        """Open the old ledger, return the time of its last full verification"""
+        if not self.ledger_rp.lstat():
+            return None
+        try:
+            self._old_fp = self.ledger_rp.open("rb", b"gz")
+            self._old_fields = _read_fields(self._old_fp)
+            magic, version, full_time = [next(self._old_fields) for _ in range(3)]
+            if (magic, version) != (self._MAGIC, self._VERSION):
+                raise ValueError("unknown format")
+            full_time = int(full_time)
+        except (OSError, EOFError, StopIteration, ValueError, zlib.error) as exc:
+            log.Log(
+                "Verification ledger {vl} can't be read due to exception "
+                "'{ex}', all files will be verified".format(vl=self.ledger_rp, ex=exc),
+                log.WARNING,
+            )
+            self._close_old()
+            return None
+        if full_time < full_older_than:
+            log.Log(
+                "Last full verification at {ft} is too old, all files will "
+                "be verified".format(ft=Time.timetopretty(full_time)),
+                log.NOTE,
+            )
+            self._close_old()
+            return None
+        self._old_record = self._read_old_record()
+        return full_time
+
+    def _close_old(self):
+        """Close the old ledger, if it's open"""
+        if self._old_fp:
+            self._old_fp.close()
+        self._old_fp = self._old_fields = self._old_record = None
+
+    def _skip_old_records(self, index):
+        """Read the old records until the one at or after index"""
+        while self._old_record is not None and self._old_record[0] < index:
+            self._old_record = self._read_old_record()
+
+    def _read_old_record(self):
+        """Return the next record (index, sha1, key) of the old ledger"""
+        if not self._old_fp:
+            return None
+        try:
+            index, sha1, key = [next(self._old_fields) for _ in range(3)]
+            return (tuple(index.split(b"/")), sha1.decode(), key)
+        except StopIteration:
+            pass
+        except (OSError, EOFError, ValueError, zlib.error) as exc:
+            log.Log(
+                "Verification ledger {vl} is corrupted due to exception "
+                "'{ex}', ignoring the rest of it".format(vl=self.ledger_rp, ex=exc),
+                log.WARNING,
+            )
+        self._close_old()
+        return None
+
+    def _write_failed(self, exc):
+        """Log the failure to write the new ledger and throw it away"""
+        log.Log(
+            "Verification ledger {vl} can't be written due to exception "
+            "'{ex}', the next verification will verify all files".format(
+                vl=self.ledger_rp, ex=exc
+            ),
+            log.WARNING,
+        )
+        self.discard(keep_old=True)
+
+    def _write_fields(self, *fields):
+        """Write the given fields, each terminated by a null character"""
+        self._new_fp.write(b"".join(field + b"\0" for field in fields))
+
+
+class _MoveDetector:
+    """
+    Send new files as diff against the mirror files they were moved from
+
+    When a file is moved or copied within the source, the new path looks
+    like a new file and would be sent in full.  The detector remembers the
+    regular files of the previous backup by size and modification time (and
+    inode and SHA1 if recorded), and offers the signature of a matching file
+    as basis for new source files, so that only a delta is transferred.
+    The source doesn't see the difference with a normal changed file.
+
+    If requested, a new file without such a match is instead sent as diff
+    against a similar file of the previous backup: a file with the same
+    name elsewhere, or a file in the same directory with a similar name
+    (e.g. rotated logs or versioned artifacts), or at least with the same
+    extension (e.g. copy of a template), each of a similar size.
+
+    The basis must have the same content when the signature is computed and
+    when the delta is applied.  Mirror files at a later index are only
+    changed after the new file is patched, earlier ones must be unchanged
+    or deleted by the current backup, the latter being read from their
+    snapshot increment once the mirror file is gone.
+    """
+
+    min_size = 64 * 1024  # smaller files aren't worth the detour
+
+    _digits_regexp = re.compile(rb"[0-9]+")
+
+    def __init__(
+        self,
+        mirror_root_rp,
+        temp_dir_rp,
+        mirror_iter,
+        detect_moves=True,
+        similar_basis=False,
+    ):
+        self.mirror_root_rp = mirror_root_rp
+        self.temp_dir_rp = temp_dir_rp
+        self.detect_moves = detect_moves
+        self.similar_basis = similar_basis
+        # maps (size, mtime) to lists of (index, inode, devloc, sha1)
+        self._candidates = {}
+        # map basenames, (parent index, name pattern) and (parent index,
+        # extension) to lists of (size, index), sorted once all are known
+        self._by_name = {}
+        self._by_pattern = {}
+        self._by_extension = {}
+        self._indexes = set()
+        for rorp in mirror_iter:
+            if (
+                rorp.isreg()
+                and rorp.getsize() >= self.min_size
+                and not rorp.has_alt_mirror_name()
+            ):
+                if detect_moves:
+                    self._candidates.setdefault(
+                        (rorp.getsize(), rorp.getmtime()), []
+                    ).append(
+                        (
+                            rorp.index,
+                            rorp.data.get("inode") if rorp.getnumlinks() > 1 else None,
+                            rorp.data.get("devloc"),
+                            rorp.data.get("sha1"),
+                        )
+                    )
+                if similar_basis:
+                    self._add_similar(rorp.index, rorp.getsize())
+                self._indexes.add(rorp.index)
+        for cands_map in (self._by_name, self._by_pattern, self._by_extension):
+            for cands in cands_map.values():
+                cands.sort()
+        self._changed = set()  # candidates changed in place by this backup
+        self._incs = {}  # snapshot increments of deleted candidates
+        self._bases = {}  # maps new indexes to the candidate index chosen
+        self._temp_rps = set()
+        self.moves = 0
+
+    def set_changed(self, index):
+        """Exclude the mirror file at index, changed in place, as basis"""
+        if index in self._indexes:
+            self._changed.add(index)
+
+    def set_inc(self, index, inc):
+        """Remember the snapshot increment of a deleted mirror file"""
+        if (
+            index in self._indexes
+            and inc.isincfile()
+            and inc.getinctype() == b"snapshot"
+        ):
+            self._incs[index] = inc
+
+    def get_sig(self, index, src_rorp):
+        """
+        Return the signature of a basis for the new source file, or None
+
+        The signature has the index of the new file but is computed from
+        the mirror file it was most probably moved or copied from.
+        """
+        if not src_rorp.isreg() or src_rorp.getsize() < self.min_size:
+            return None
+        basis_index = None
+        if self.detect_moves:
+            basis_index = self._find(index, src_rorp)
+        if basis_index is None and self.similar_basis:
+            basis_index = self._find_similar(index, src_rorp)
+        if basis_index is None:
+            return None
+        basis_rp = self.get_basis_rp(basis_index)
+        if basis_rp is None:
+            return None
+        try:
+            sig_data = Rdiff.get_signature_data(basis_rp.path)
+        except OSError as exc:
+            log.Log(
+                "Signature of basis {ba} for new file {fi} couldn't be "
+                "computed due to exception '{ex}'".format(
+                    ba=basis_rp, fi=src_rorp, ex=exc
+                ),
+                log.INFO,
+            )
+            return None
+        finally:
+            self.release_basis_rp(basis_rp)
+        log.Log(
+            "New file {fi} is sent as diff against {ba}".format(
+                fi=src_rorp, ba=self.mirror_root_rp.new_index(basis_index)
+            ),
+            log.INFO,
+        )
+        self._bases[index] = basis_index
+        self.moves += 1
+        dest_sig = rpath.RORPath(index, {"type": "reg", "size": src_rorp.getsize()})
+        dest_sig.setfile(io.BytesIO(sig_data))
+        return dest_sig
+
+    def pop_basis_rp(self, index):
+        """Return the basis chosen for the new file at index, or None"""
+        basis_index = self._bases.pop(index, None)
+        if basis_index is None:
+            return None
+        return self.get_basis_rp(basis_index)
+
+    def get_basis_rp(self, basis_index):
+        """
+        Return the path holding the current content of the candidate
+
+        The snapshot increment of a deleted mirror file is decompressed into
+        a temporary file, to be released after use.
+        """
+        inc = self._incs.get(basis_index)
+        if inc is None:
+            mirror_rp = self.mirror_root_rp.new_index(basis_index)
+            return mirror_rp if mirror_rp.isreg() else None
+        if not inc.isinccompressed():
+            return inc
+        temp_rp = self.temp_dir_rp.get_temp_rpath()
+        temp_rp.write_from_fileobj(inc.open("rb", inc.isinccompressed()))
+        self._temp_rps.add(temp_rp.path)
+        return temp_rp
+
+    def release_basis_rp(self, basis_rp):
+        """Remove the basis if it's a temporary file"""
+        if basis_rp.path in self._temp_rps:
+            self._temp_rps.remove(basis_rp.path)
+            basis_rp.delete()
+
+    def close(self):
+        if self.moves:
+            log.Log(
+                "{nr} new files were sent as diff against other files of "
+                "the previous backup".format(nr=self.moves),
+                log.NOTE,
+            )
+
+    def _find(self, index, src_rorp):
+        """Return the index of a candidate matching the source file, or None"""
+        found = None
+        for cand_index, inode, devloc, sha1 in self._candidates.get(
+            (src_rorp.getsize(), src_rorp.getmtime()), ()
+        ):
+            if cand_index in self._changed:
+                continue
+            if inode is not None and (inode, devloc) != (
+                src_rorp.data.get("inode"),
+                src_rorp.data.get("devloc"),
+            ):
+                continue
+            if sha1 and src_rorp.has_sha1() and sha1 != src_rorp.get_sha1():
+                continue
+            if cand_index[-1:] == index[-1:]:
+                return cand_index  # same name, most probably a moved file
+            if found is None:
+                found = cand_index
+        return found
+
+    def _find_similar(self, index, src_rorp):
+        """
+        Return the index of a candidate similar to the source file, or None
+
+        Candidates are looked for in decreasing order of likelihood: same
+        name in another directory, same name with other numbers (like
+        "app.log.1" and "app.log.2") in the same directory, and finally
+        same extension in the same directory.  Only candidates of a similar
+        size are considered, the closest in size being preferred.
+        """
+        name = index[-1]
+        for cands in (
+            self._by_name.get(name, ()),
+            self._by_pattern.get((index[:-1], self._digits_regexp.sub(b"0", name)), ()),
+            self._by_extension.get((index[:-1], os.path.splitext(name)[1]), ()),
+        ):
+            found = self._get_closest(cands, src_rorp.getsize())
+            if found is not None:
+                return found
+        return None
+
+    def _add_similar(self, index, size):
+        """Register the mirror file at index as basis for similar files"""
+        cand = (size, index)
+        name = index[-1]
+        self._by_name.setdefault(name, []).append(cand)
+        self._by_pattern.setdefault(
+            (index[:-1], self._digits_regexp.sub(b"0", name)), []
+        ).append(cand)
+        extension = os.path.splitext(name)[1]
+        if extension:
+            self._by_extension.setdefault((index[:-1], extension), []).append(cand)
+
+    def _get_closest(self, cands, size):
+        """
+        Return the index of the candidate closest in size, or None
+
+        The candidates being sorted by size, they are looked at from the
+        given size outwards, until one is found or they differ too much in
+        size, which would make a poor basis.
+        """
+        high = bisect.bisect_left(cands, (size,))
+        low = high - 1
+        while low >= 0 or high < len(cands):
+            if high >= len(cands) or (
+                low >= 0 and size - cands[low][0] <= cands[high][0] - size
+            ):
+                cand_size, cand_index = cands[low]
+                low -= 1
+            else:
+                cand_size, cand_index = cands[high]
+                high += 1
+            if cand_size < size // 2:
+                low = -1  # the next smaller candidates are even smaller
+            elif cand_size > size * 2:
+                high = len(cands)  # and the next larger ones even larger
+            elif cand_index not in self._changed:
+                return cand_index
+        return None
+
+
+class _CachedRF:
+    """Store _RestoreFile objects until they are needed
+
+    The code above would like to pretend it has random access to RFs,
+    making one for a particular index at will.  However, in general
+    this involves listing and filtering a directory, which can get
+    expensive.
+
+    Thus, when a _CachedRF retrieves an _RestoreFile, it creates all the
+    RFs of that directory at the same time, and doesn't have to
+    recalculate.  It assumes the indices will be in order, so the
+    cache is deleted if a later index is requested.
+
+    """
+
+    def __init__(self, root_rf):
+        """Initialize _CachedRF, self.rf_list variable"""
+        self.root_rf = root_rf
+        self.rf_list = []  # list should filled in index order
+        if specifics.process_uid != 0:
+            self.perm_changer = _PermissionChanger(root_rf.mirror_rp)
+
+    def get_fp(self, index, mir_rorp):
+        """Return the file object (for reading) of given index"""
+        rf = self.get_rf(index, mir_rorp)
+        if not rf:
+            return self.get_missing_fp(index)
         return rf.get_restore_fp()
 
+    def get_rf(self, index, mir_rorp):
+        """Return the _RestoreFile of given index, or a false value"""
+        return map_longnames.update_rf(
+            self._get_rf(index, mir_rorp),
+            mir_rorp,
+            self.root_rf.mirror_rp,
+            _RestoreFile,
+        )
+
+    def get_missing_fp(self, index):
+        """Warn about the missing file of given index, return empty file"""
+        log.Log(
+            "Unable to retrieve data for file {fi}! The cause is "
+            "probably data loss from the backup repository".format(
+                fi=(index and "/".join(index) or ".")
+            ),
+            log.WARNING,
+        )
+        return io.BytesIO()
+
     def close(self):
         """Finish remaining rps in _PermissionChanger"""
         if specifics.process_uid != 0:
@@ -2998,7 +4677,13 @@ class _RestoreFile:
         return rorp
 
     def get_restore_fp(self):
-        """Return file object of restored data"""
+        """
+        Return file object of restored data
+
+        The diffs are stacked lazily on top of each other, so that the
+        restored data is only computed while it is read, without writing
+        any intermediate file.
+        """
 
         def get_fp():
             current_fp = self._get_first_fp()
@@ -3007,20 +4692,9 @@ class _RestoreFile:
                 assert (
                     inc_diff.getinctype() == b"diff"
                 ), "Path '{irp!r}' must be of type 'diff'.".format(irp=inc_diff)
-                delta_fp = inc_diff.open("rb", inc_diff.isinccompressed())
-                try:
-                    new_fp = tempfile.TemporaryFile()
-                    Rdiff.write_patched_fp(current_fp, delta_fp, new_fp)
-                    new_fp.seek(0)
-                except OSError:
-                    tmpdir = tempfile.gettempdir()
-                    log.Log(
-                        "Error while writing to temporary directory "
-                        "{td}".format(td=tmpdir),
-                        log.ERROR,
-                    )
-                    raise
-                current_fp = new_fp
+                current_fp = librsync.LazyPatchedFile(
+                    current_fp, self._open_seekable(inc_diff)
+                )
             return current_fp
 
         def error_handler(exc):
@@ -3048,6 +4722,20 @@ rdiff-backup destination directory, or a bug in rdiff-backup""".format(
             return io.BytesIO()
         return robust.check_common_error(error_handler, get_fp)
 
+    def get_patch_paths(self):
+        """
+        Return the paths needed to restore the data in a worker, or None
+
+        The paths are returned as a list of tuples (path, compression suffix
+        or None) as expected by Rdiff.patch_data_to_temp, None is returned
+        if the data can be read as is from the mirror or snapshot file.
+        """
+        if not self.relevant_incs[-1].isreg():
+            return None
+        if len(self.relevant_incs) == 1 and not self.relevant_incs[0].isinccompressed():
+            return None
+        return [(inc.path, inc.isinccompressed() or None) for inc in self.relevant_incs]
+
     def yield_sub_rfs(self):
         """Return _RestoreFiles under current _RestoreFile (which is dir)"""
         if not self.mirror_rp.isdir() and not self.inc_rp.isdir():
@@ -3127,16 +4815,27 @@ rdiff-backup destination directory, or a bug in rdiff-backup""".format(
         assert (
             first_inc.getinctype() == b"snapshot"
         ), "Path '{srp}' must be of type 'snapshot'.".format(srp=first_inc)
-        if not first_inc.isinccompressed():
-            return first_inc.open("rb")
+        if len(self.relevant_incs) == 1:  # no diff to apply, no seek needed
+            return first_inc.open("rb", first_inc.isinccompressed())
+        return self._open_seekable(first_inc)
+
+    @staticmethod
+    def _open_seekable(inc):
+        """
+        Return a file object of the data of the increment, fit for seeking
 
+        The diffs seek around in their basis and in themselves, which is
+        slow in a compressed file, as each backward seek decompresses it
+        again from its start, hence compressed data is copied to a real file.
+        """
+        if not inc.isinccompressed():
+            return inc.open("rb")
         try:
-            # current_fp must be a real (uncompressed) file
-            current_fp = tempfile.TemporaryFile()
-            fp = first_inc.open("rb", compress=1)
-            rpath.copyfileobj(fp, current_fp)
+            temp_fp = tempfile.TemporaryFile()
+            fp = inc.open("rb", inc.isinccompressed())
+            rpath.copyfileobj(fp, temp_fp)
             fp.close()
-            current_fp.seek(0)
+            temp_fp.seek(0)
         except OSError:
             tmpdir = tempfile.gettempdir()
             log.Log(
@@ -3144,7 +4843,7 @@ rdiff-backup destination directory, or a bug in rdiff-backup""".format(
                 log.ERROR,
             )
             raise
-        return current_fp
+        return temp_fp
 
     def _yield_mirrorrps(self, mirrorrp):
         """Yield mirrorrps underneath given mirrorrp"""
@@ -3298,9 +4997,10 @@ class _RepoRegressITRB(rorpiter.ITRBranch):
     matter for regular files.
     """
 
-    def __init__(self):
+    def __init__(self, resume_stash=None):
         """Just initialize some variables to None"""
         self.rf = None  # will hold _RegressFile applying to a directory
+        self.resume_stash = resume_stash
 
     def can_fast_process(self, index, rf):
         """True if none of the rps is a directory"""
@@ -3310,6 +5010,8 @@ class _RepoRegressITRB(rorpiter.ITRBranch):
         """Process when nothing is a directory"""
         if not rf.metadata_rorp.equal_loose(rf.mirror_rp):
             log.Log("Regressing file {fi}".format(fi=rf.metadata_rorp), log.INFO)
+            if self.resume_stash is not None and rf.mirror_rp.isreg():
+                self.resume_stash.add(index, rf.mirror_rp)
             if rf.metadata_rorp.isreg():
                 self._restore_orig_regfile(rf)
             else:
@@ -3400,3 +5102,36 @@ class _RepoRegressITRB(rorpiter.ITRBranch):
             rpath.copy_attribs(rf.metadata_rorp, rf.mirror_rp)
         if generics.fsync_directories:
             rf.mirror_rp.get_parent_rp().fsync()  # force move before inc delete
+
+
+def _read_fields(fp, strict=True):
+    """
+    Yield the null terminated fields read from the file object
+
+    A last field without null character is a truncated record, which raises
+    a ValueError if strict, else it is ignored.
+    """
+    rest = b""
+    while True:
+        buf = fp.read(consts.BLOCKSIZE)
+        if not buf:
+            break
+        *fields, rest = (rest + buf).split(b"\0")
+        yield from fields
+    if rest and strict:
+        raise ValueError("truncated record")
+
+
+def _get_boot_id():
+    """
+    Return a value identifying the current boot of the system
+
+    Where the kernel doesn't offer a boot ID, the boot time is estimated
+    from the clocks and rounded to the minute, hence a reboot might be
+    detected without one having happened.
+    """
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "rb") as fd:
+            return fd.read().strip()
+    except OSError:
+        return b"%d" % round((time.time() - time.monotonic()) / 60)
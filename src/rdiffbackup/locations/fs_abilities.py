@@ -33,6 +33,7 @@ from rdiff_backup import robust, selection, Time
 from rdiffbackup.meta import acl_win  # FIXME there should be no dependency
 from rdiffbackup.locations.map import filenames as map_filenames
 from rdiffbackup.singletons import consts, generics, log, specifics
+from rdiffbackup.utils import compressors
 
 
 class FSAbilities:
@@ -59,6 +60,7 @@ class FSAbilities:
     escape_trailing_spaces = None
     # True if trailing spaces or periods at end of filenames aren't preserved
     symlink_perms = None  # True if symlink perms are affected by umask
+    compression_codecs = None  # names of the compression codecs available
 
     def __init__(self, root_rp, writable=True):
         """
@@ -66,6 +68,7 @@ class FSAbilities:
         """
         self.root_rp = root_rp
         self.writable = writable
+        self.compression_codecs = compressors.get_available_names()
         if self.writable:
             self._detect_readwrite()
         else:
@@ -106,6 +109,7 @@ class FSAbilities:
                     ("Windows reserved filenames", self.win_reserved_filenames),
                 ]
             )
+            addline("Compression codecs", ", ".join(self.compression_codecs))
         else:
             s.append("Detected abilities for read-only file system")
 
@@ -870,6 +874,69 @@ class SetGlobals:
             Time.set_current_time(Time.getcurtime())
             log.Log("Enabled use_compatible_timestamps", log.INFO)
 
+    def set_metadata_format(self, repo):
+        """
+        Set the format of the metadata files written to the repository
+
+        A format given on the command line is saved in the repository for
+        the next sessions, else the previously saved format is used, text
+        being the default.
+        """
+        metadata_format = self.values.get("metadata_format")
+        if metadata_format:
+            if repo.set_metadata_format(metadata_format.encode("ascii")):
+                log.Log(
+                    "Metadata format of repository changed to '{mf}', "
+                    "existing metadata files remain readable".format(
+                        mf=metadata_format
+                    ),
+                    log.NOTE,
+                )
+        else:
+            saved_format = repo.get_metadata_format()
+            if saved_format:
+                metadata_format = saved_format.decode("ascii").strip()
+            else:
+                metadata_format = "text"
+        generics.set("metadata_format", metadata_format)
+
+    def set_compression_codec(self, repo):
+        """
+        Set the codec compressing the files written to the repository
+
+        A codec given on the command line is saved in the repository for
+        the next sessions, else the previously saved codec is used, gzip
+        being the default.  Files compressed with other codecs remain
+        readable, as long as their codec is available.
+        Returns an error code if the codec isn't available on the repository
+        side but would be needed.
+        """
+        codec = self.values.get("compression_codec")
+        if codec:
+            if repo.set_compression_codec(codec.encode("ascii")):
+                log.Log(
+                    "Compression codec of repository changed to '{cc}', "
+                    "existing compressed files remain readable".format(cc=codec),
+                    log.NOTE,
+                )
+        else:
+            saved_codec = repo.get_compression_codec()
+            if saved_codec:
+                codec = saved_codec.decode("ascii").strip()
+            else:
+                codec = compressors.DEFAULT
+        if generics.compression and codec not in self.dest_fsa.compression_codecs:
+            log.Log(
+                "Compression codec '{cc}' isn't available on the repository "
+                "side, only {ac} are".format(
+                    cc=codec, ac=", ".join(self.dest_fsa.compression_codecs)
+                ),
+                log.ERROR,
+            )
+            return consts.RET_CODE_ERR
+        generics.set("compression_codec", codec)
+        return consts.RET_CODE_OK
+
 
 class Dir2RepoSetGlobals(SetGlobals):
     """
@@ -886,21 +953,23 @@ class Dir2RepoSetGlobals(SetGlobals):
         """
         Given rps for source filesystem and repository, set fsa globals
         """
-        self.set_eas()
-        self.set_acls()
-        self.set_win_acls()
-        self.set_resource_forks()
-        self.set_carbonfile()
-        self.set_hardlinks()
-        self.set_fsync_directories()
-        self.set_change_ownership()
-        self.set_high_perms()
-        self.set_symlink_perms()
+        with generics.gathered_settings():  # sent in one batch
+            self.set_eas()
+            self.set_acls()
+            self.set_win_acls()
+            self.set_resource_forks()
+            self.set_carbonfile()
+            self.set_hardlinks()
+            self.set_fsync_directories()
+            self.set_change_ownership()
+            self.set_high_perms()
+            self.set_symlink_perms()
         self.set_chars_to_quote(self.repo)
         self.set_special_escapes(self.repo)
         self.set_compatible_timestamps()
+        self.set_metadata_format(self.repo)
 
-        return consts.RET_CODE_OK
+        return self.set_compression_codec(self.repo)
 
     def set_special_escapes(self, repo):
         """
@@ -978,9 +1047,13 @@ class Dir2RepoSetGlobals(SetGlobals):
         """
         active_attr, write_attr, conn_attr = attr_triple
         generics.set(active_attr, src_support and toggle)
-        self.in_conn.specifics.set(conn_attr, src_support and toggle)
+        generics.call_gathered(
+            self.in_conn, "specifics.set", conn_attr, src_support and toggle
+        )
         generics.set(write_attr, dest_support and toggle)
-        self.out_conn.specifics.set(conn_attr, dest_support and toggle)
+        generics.call_gathered(
+            self.out_conn, "specifics.set", conn_attr, dest_support and toggle
+        )
 
     def _get_ctq_from_fsas(self):
         """
@@ -1083,16 +1156,17 @@ class Repo2DirSetGlobals(SetGlobals):
         """
         `Set fsa related globals for restore session, given in/out rps
         """
-        self.set_eas()
-        self.set_acls()
-        self.set_win_acls()
-        self.set_resource_forks()
-        self.set_carbonfile()
-        self.set_hardlinks()
-        # No need to fsync anything when restoring
-        self.set_change_ownership()
-        self.set_high_perms()
-        self.set_symlink_perms()
+        with generics.gathered_settings():  # sent in one batch
+            self.set_eas()
+            self.set_acls()
+            self.set_win_acls()
+            self.set_resource_forks()
+            self.set_carbonfile()
+            self.set_hardlinks()
+            # No need to fsync anything when restoring
+            self.set_change_ownership()
+            self.set_high_perms()
+            self.set_symlink_perms()
         self.set_chars_to_quote(self.repo)
         self.set_special_escapes(self.repo)
         self.set_compatible_timestamps()
@@ -1169,8 +1243,12 @@ class Repo2DirSetGlobals(SetGlobals):
         active_attr, write_attr, conn_attr = attr_triple
         generics.set(active_attr, dest_support and toggle)
         generics.set(write_attr, dest_support and toggle)
-        self.out_conn.specifics.set(conn_attr, dest_support and toggle)
-        self.in_conn.specifics.set(conn_attr, src_support and toggle)
+        generics.call_gathered(
+            self.out_conn, "specifics.set", conn_attr, dest_support and toggle
+        )
+        generics.call_gathered(
+            self.in_conn, "specifics.set", conn_attr, src_support and toggle
+        )
 
 
 class SingleRepoSetGlobals(Repo2DirSetGlobals):
@@ -1188,20 +1266,24 @@ class SingleRepoSetGlobals(Repo2DirSetGlobals):
         """
         Set fsa related globals for operation on single filesystem
         """
-        self.set_eas()
-        self.set_acls()
-        self.set_win_acls()
-        self.set_resource_forks()
-        self.set_carbonfile()
-        if self.repo.must_be_writable:
-            self.set_hardlinks()
-            self.set_fsync_directories()  # especially needed for regression
-            self.set_change_ownership()
-            self.set_high_perms()
-            self.set_symlink_perms()
+        with generics.gathered_settings():  # sent in one batch
+            self.set_eas()
+            self.set_acls()
+            self.set_win_acls()
+            self.set_resource_forks()
+            self.set_carbonfile()
+            if self.repo.must_be_writable:
+                self.set_hardlinks()
+                self.set_fsync_directories()  # especially needed for regression
+                self.set_change_ownership()
+                self.set_high_perms()
+                self.set_symlink_perms()
         self.set_chars_to_quote(self.repo)
         self.set_special_escapes(self.repo)
         self.set_compatible_timestamps()
+        if self.repo.must_be_writable:
+            self.set_metadata_format(self.repo)
+            return self.set_compression_codec(self.repo)
 
         return consts.RET_CODE_OK
 
@@ -1249,4 +1331,6 @@ class SingleRepoSetGlobals(Repo2DirSetGlobals):
         active_attr, write_attr, conn_attr = attr_triple
         generics.set(active_attr, fsa_support and toggle)
         generics.set(write_attr, fsa_support and toggle)
-        self.conn.specifics.set(conn_attr, fsa_support and toggle)
+        generics.call_gathered(
+            self.conn, "specifics.set", conn_attr, fsa_support and toggle
+        )
@@ -21,7 +21,8 @@
 import os
 import re
 from rdiff_backup import Rdiff, rpath, Time
-from rdiffbackup.singletons import consts, log, specifics, sstats
+from rdiffbackup.singletons import consts, generics, log, specifics, sstats
+from rdiffbackup.utils import compressors
 
 compression = True
 not_compressed_regexp = None
@@ -78,7 +79,7 @@ class StoredRPath(rpath.RPath):
             return False
 
     def isinccompressed(self):
-        """Return true if inc file is compressed"""
+        """Return the codec's suffix if inc file is compressed, else False"""
         return self.inc_compressed
 
     def getinctype(self):
@@ -127,13 +128,14 @@ def init(compression_value=True, not_compressed_regexp_str=None):
     return consts.RET_CODE_OK
 
 
-def make_increment(new, mirror, incpref, inc_time=None):
+def make_increment(new, mirror, incpref, inc_time=None, new_signature=None):
     """
     Main file incrementing function, returns inc file created
 
     new is the file on the active partition,
     mirror is the mirrored file from the last backup,
-    incpref is the prefix of the increment file.
+    incpref is the prefix of the increment file,
+    new_signature is the optional librsync signature of new, if known.
 
     This function basically moves the information about the mirror
     file to incpref, inc_time being the (previous) time of the mirror.
@@ -147,7 +149,7 @@ def make_increment(new, mirror, incpref, inc_time=None):
     elif mirror.isdir():
         incrp = _make_dir_increment(mirror, incpref, inc_time)
     elif new.isreg() and mirror.isreg():
-        incrp = _make_diff_increment(new, mirror, incpref, inc_time)
+        incrp = _make_diff_increment(new, mirror, incpref, inc_time, new_signature)
     else:
         incrp = _make_snapshot_increment(mirror, incpref, inc_time)
     sstats.SessionStats.add_increment(incrp)
@@ -185,11 +187,13 @@ def get_increment(rp, typestr, inc_time):
 
 def _parse_increment_name(basename):
     """
-    Returns None or tuple of (is_compressed, timestr, timeepoch, type, and basename)
+    Returns None or tuple of (compressed, timestr, timeepoch, type, and basename)
+
+    compressed is the suffix of the compression codec, e.g. b"gz", or False.
     """
     dotsplit = basename.split(b".")
-    if dotsplit[-1] == b"gz":
-        compressed = True
+    if compressors.get_name(dotsplit[-1]):
+        compressed = dotsplit[-1]
         if len(dotsplit) < 4:
             return None
         timestring, ext = dotsplit[-3:-1]
@@ -230,7 +234,8 @@ def _make_snapshot_increment(mirror, incpref, inc_time):
     """Copy mirror to incfile, since new is quite different"""
     compress = _is_compressed(mirror)
     if compress and mirror.isreg():
-        snapshotrp = get_increment(incpref, b"snapshot.gz", inc_time)
+        compress = compressors.get_suffix(generics.compression_codec)
+        snapshotrp = get_increment(incpref, b"snapshot." + compress, inc_time)
     else:
         snapshotrp = get_increment(incpref, b"snapshot", inc_time)
 
@@ -254,11 +259,12 @@ def _make_snapshot_increment(mirror, incpref, inc_time):
     return snapshotrp
 
 
-def _make_diff_increment(new, mirror, incpref, inc_time):
+def _make_diff_increment(new, mirror, incpref, inc_time, new_signature=None):
     """Make incfile which is a diff new -> mirror"""
     compress = _is_compressed(mirror)
     if compress:
-        diff = get_increment(incpref, b"diff.gz", inc_time)
+        compress = compressors.get_suffix(generics.compression_codec)
+        diff = get_increment(incpref, b"diff." + compress, inc_time)
     else:
         diff = get_increment(incpref, b"diff", inc_time)
 
@@ -273,7 +279,7 @@ def _make_diff_increment(new, mirror, incpref, inc_time):
             old_mirror_perms = mirror.getperms()
             mirror.chmod(0o400 | old_mirror_perms)
 
-    Rdiff.write_delta(new, mirror, diff, compress)
+    Rdiff.write_delta(new, mirror, diff, compress, new_signature)
 
     if old_new_perms:
         new.chmod(old_new_perms)
@@ -30,18 +30,190 @@ source side should only transmit inode information.
 """
 
 import errno
+import itertools
+import os
+import pickle
+import tempfile
 
-# The keys in this dictionary are (inode, devloc) pairs.  The values
-# are a tuple (index, remaining_links, dest_key, sha1sum) where index
-# is the rorp index of the first such linked file, remaining_links is
-# the number of files hard linked to this one we may see, and key is
-# either (dest_inode, dest_devloc) or None, and represents the
-# hardlink info of the existing file on the destination.  Finally
-# sha1sum is the hash of the file if it exists, or None.
-_inode_index = {}
+from rdiffbackup.singletons import consts, log
+
+# The inode number is packed together with the device location in a single
+# integer key if it fits in this number of bits, see _get_inode_key
+_INODE_BITS = 64
+
+# Rough size in bytes of one entry of the inode dictionaries, used to
+# translate a memory limit into a number of entries
+_ENTRY_SIZE = 256
+
+
+class _InodeIndex:
+    """
+    Dictionary of inode keys, possibly bounded in memory
+
+    Without maximum number of entries, it behaves like a plain dictionary.
+    Else the least recently used entries beyond the maximum are spilled to
+    a temporary SQLite database on disk, sorted by key, and brought back in
+    memory as soon as they are used again.
+    Keys and values must be picklable, and values can't be None.
+    """
+
+    def __init__(self, max_entries=0):
+        self.max_entries = max_entries
+        self.spilled = 0
+        self._entries = {}
+        self._store = None
+        self._store_path = None
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if self.max_entries:
+            self._entries.pop(key, None)  # moved at the end as most recent
+        self._entries[key] = value
+        if self.max_entries and len(self._entries) > self.max_entries:
+            self._spill()
+
+    def __delitem__(self, key):
+        if self.pop(key) is None:
+            raise KeyError(key)
+
+    def get(self, key):
+        """Return the value of the key, None if there is none"""
+        if not self.max_entries:
+            return self._entries.get(key)
+        value = self._entries.get(key)
+        if value is None and self._store is not None:
+            value = self._load(key)
+        if value is not None:
+            self[key] = value
+        return value
+
+    def pop(self, key):
+        """Remove the key and return its value, None if there is none"""
+        if self.get(key) is None:
+            return None
+        if self._store is not None:
+            self._store.execute("DELETE FROM entries WHERE key = ?", (_dumps(key),))
+        return self._entries.pop(key)
+
+    def close(self):
+        """Remove all entries and the temporary database"""
+        self._entries.clear()
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+        if self._store_path is not None:
+            os.remove(self._store_path)
+            self._store_path = None
+
+    def _load(self, key):
+        """
+        Return the value of the key stored on disk, None if there is none
+
+        The value on disk remains until it is overwritten by the next spill,
+        the one in memory having precedence.
+        """
+        row = self._store.execute(
+            "SELECT value FROM entries WHERE key = ?", (_dumps(key),)
+        ).fetchone()
+        return row and pickle.loads(row[0])
+
+    def _spill(self):
+        """Write the least recently used quarter of entries to disk"""
+        if self._store is None and not self._open_store():
+            self.max_entries = 0  # we keep everything in memory
+            return
+        keys = list(itertools.islice(self._entries, max(1, self.max_entries // 4)))
+        self._store.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+            ((_dumps(key), _dumps(self._entries.pop(key))) for key in keys),
+        )
+        self.spilled += len(keys)
+
+    def _open_store(self):
+        """Create the temporary database, return False if not possible"""
+        try:
+            import sqlite3
+        except ImportError:
+            log.Log(
+                "Hard link information can't be spilled to disk without "
+                "the sqlite3 module, it is all kept in memory",
+                log.WARNING,
+            )
+            return False
+        temp_fd, self._store_path = tempfile.mkstemp(
+            prefix="rdiff-backup-hardlinks-", suffix=".db"
+        )
+        os.close(temp_fd)
+        # the database is only temporary, hence it doesn't need to be safe,
+        # and all changes happen in a single transaction never committed
+        self._store = sqlite3.connect(self._store_path, isolation_level=None)
+        self._store.execute("PRAGMA journal_mode = OFF")
+        self._store.execute("PRAGMA synchronous = OFF")
+        self._store.execute(
+            "CREATE TABLE entries (key BLOB PRIMARY KEY, value BLOB) WITHOUT ROWID"
+        )
+        self._store.execute("BEGIN")
+        # the open database doesn't need its name anymore, removing it right
+        # away avoids leaving it behind if the backup fails or is killed
+        try:
+            os.remove(self._store_path)
+            self._store_path = None
+        except OSError:  # e.g. under Windows, it's then removed when closing
+            pass
+        return True
+
+
+# The keys in this dictionary are inode keys, see _get_inode_key.  The
+# values are a tuple (dir_path, name, remaining_links, dest_key, sha1sum)
+# where dir_path and name represent the rorp index of the first such linked
+# file, see _pack_index, remaining_links is the number of files hard linked
+# to this one we may see, and key is either the inode key of the existing
+# file on the destination, "NA" or None.  Finally sha1sum is the hash of
+# the file if it exists, or None.
+_inode_index = _InodeIndex()
 
 # This dictionary only holds sha1sum of old hardlinks
-_inode_old_index = {}
+_inode_old_index = _InodeIndex()
+
+# The directory path of the last packed index, shared by the next ones
+_last_dir_path = b""
+
+
+def initialize(memory_limit=0):
+    """
+    Reset the hard link dictionaries
+
+    If memory_limit isn't 0, the dictionaries are kept together under
+    roughly that many bytes of memory, the rest being spilled to disk.
+    """
+    global _inode_index, _inode_old_index
+    close()
+    max_entries = memory_limit and max(1, memory_limit // (2 * _ENTRY_SIZE))
+    _inode_index = _InodeIndex(max_entries)
+    _inode_old_index = _InodeIndex(max_entries)
+
+
+def close():
+    """
+    Empty the hard link dictionaries and remove their temporary databases
+    """
+    spilled = _inode_index.spilled + _inode_old_index.spilled
+    if spilled:
+        log.Log(
+            "{sp} hard link entries were spilled to disk to limit "
+            "memory usage".format(sp=spilled),
+            log.INFO,
+        )
+    _inode_index.close()
+    _inode_old_index.close()
 
 
 def add_rorp(rorp, dest_rorp=None):
@@ -64,7 +236,12 @@ def add_rorp(rorp, dest_rorp=None):
                 old_hash = _inode_old_index.pop(dest_key)
                 dest_rorp.set_sha1(old_hash)
         digest = rorp.has_sha1() and rorp.get_sha1() or None
-        _inode_index[rp_inode_key] = (rorp.index, rorp.getnumlinks(), dest_key, digest)
+        _inode_index[rp_inode_key] = (
+            *_pack_index(rorp.index),
+            rorp.getnumlinks(),
+            dest_key,
+            digest,
+        )
     return rp_inode_key
 
 
@@ -90,12 +267,12 @@ def del_rorp(rorp):
     val = _inode_index.get(rp_inode_key)
     if not val:
         return
-    index, remaining, dest_key, digest = val
+    dir_path, name, remaining, dest_key, digest = val
     if remaining == 1:
         del _inode_index[rp_inode_key]
         return 1
     else:
-        _inode_index[rp_inode_key] = (index, remaining - 1, dest_key, digest)
+        _inode_index[rp_inode_key] = (dir_path, name, remaining - 1, dest_key, digest)
         return 0
 
 
@@ -124,11 +301,11 @@ def rorp_eq(src_rorp, dest_rorp):
     if src_rorp.getnumlinks() != dest_rorp.getnumlinks():
         return False
     src_key = _get_inode_key(src_rorp)
-    index, remaining, dest_key, digest = _inode_index[src_key]
+    dir_path, name, remaining, dest_key, digest = _inode_index[src_key]
     if dest_key == "NA":
         # Allow this to be ok for first comparison, but not any
         # subsequent ones
-        _inode_index[src_key] = (index, remaining, None, None)
+        _inode_index[src_key] = (dir_path, name, remaining, None, None)
         return True
     try:
         return dest_key == _get_inode_key(dest_rorp)
@@ -146,21 +323,21 @@ def is_linked(rorp):
     dict_val = _inode_index.get(_get_inode_key(rorp))
     if not dict_val:
         return False
-    return dict_val[0] != rorp.index  # If equal, then rorp is first
+    return _unpack_index(*dict_val[:2]) != rorp.index  # If equal, rorp is first
 
 
 def get_link_index(rorp):
     """
     Return first index on target side rorp is already linked to
     """
-    return _inode_index[_get_inode_key(rorp)][0]
+    return _unpack_index(*_inode_index[_get_inode_key(rorp)][:2])
 
 
 def get_sha1(rorp):
     """
     Return sha1 digest of what rorp is linked to
     """
-    return _inode_index[_get_inode_key(rorp)][3]
+    return _inode_index[_get_inode_key(rorp)][4]
 
 
 def get_hash(rorp):
@@ -208,5 +385,48 @@ def link_rp(diff_rorp, dest_rpath, dest_root=None):
 def _get_inode_key(rorp):
     """
     Return rorp's key for _inode_ dictionaries
+
+    The inode and device location are packed into a single integer, which
+    takes less memory than a tuple, unless they don't fit, e.g. under
+    Windows where file IDs can have 128 bits.
+    """
+    inode, devloc = rorp.getinode(), rorp.getdevloc()
+    if 0 <= inode < 1 << _INODE_BITS and devloc >= 0:
+        return devloc << _INODE_BITS | inode
+    return (inode, devloc)
+
+
+def _pack_index(index):
+    """
+    Return a tuple (dir_path, name) representing compactly the index
+
+    Hard linked files are often in the same directory, which is the reason
+    why the same directory path object is shared between consecutive calls.
+    """
+    global _last_dir_path
+    if not index:
+        return (b"", None)
+    dir_path = b"/".join(index[:-1])
+    if dir_path == _last_dir_path:
+        dir_path = _last_dir_path
+    else:
+        _last_dir_path = dir_path
+    return (dir_path, index[-1])
+
+
+def _unpack_index(dir_path, name):
+    """
+    Return the index represented by dir_path and name, see _pack_index
+    """
+    if name is None:
+        return ()
+    if not dir_path:
+        return (name,)
+    return (*dir_path.split(b"/"), name)
+
+
+def _dumps(obj):
+    """
+    Return obj pickled, to be stored in the temporary database
     """
-    return (rorp.getinode(), rorp.getdevloc())
+    return pickle.dumps(obj, consts.PICKLE_PROTOCOL)
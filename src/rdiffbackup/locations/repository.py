@@ -291,3 +291,27 @@ class Repo(location.Location):
         Shadow function for RepoShadow.set_config for special_escapes
         """
         return self._shadow.set_config("special_escapes", special_escapes)
+
+    def get_metadata_format(self):
+        """
+        Shadow function for RepoShadow.get_config for metadata_format
+        """
+        return self._shadow.get_config("metadata_format")
+
+    def set_metadata_format(self, metadata_format):
+        """
+        Shadow function for RepoShadow.set_config for metadata_format
+        """
+        return self._shadow.set_config("metadata_format", metadata_format)
+
+    def get_compression_codec(self):
+        """
+        Shadow function for RepoShadow.get_config for compression_codec
+        """
+        return self._shadow.get_config("compression_codec")
+
+    def set_compression_codec(self, compression_codec):
+        """
+        Shadow function for RepoShadow.set_config for compression_codec
+        """
+        return self._shadow.set_config("compression_codec", compression_codec)
@@ -0,0 +1,379 @@
+# Copyright 2026 the rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA
+"""
+Persistent caches of the costly metadata and hashes of source files
+
+Extended attributes, access control lists, resource forks and carbon file
+information are expensive to read, especially from network filesystems,
+but they can't change without the change time (ctime) of the file changing
+as well. The cache remembers them together with the device, inode, size,
+modification and change times of each file, so that they don't need to be
+read again as long as none of these values changed.
+
+The SHA1 hashes of regular files are even more expensive to compute, as
+the whole file must be read, and are remembered the same way by the hash
+cache.
+
+The cache files are read and re-written in the order in which the source
+directory is walked, hence they never need to be held in memory.
+As they are unpickled, they are only read if they are regular files owned
+by the current user and not writable by anybody else, and are written
+accessible only to the current user.
+"""
+
+import gzip
+import os
+import pickle
+import stat
+import sys
+import zlib
+
+from rdiff_backup import Security
+from rdiffbackup.singletons import consts, log, specifics
+
+# the version must be increased if the format of the records changes
+FORMAT_VERSION = 1
+
+# the keys of the data dictionary taken from the cache instead of being read
+CACHED_KEYS = ("ea", "acl", "resourcefork", "carbonfile")
+
+# flags to open the cache files, which must not be symbolic links
+_O_FLAGS = getattr(os, "O_NOFOLLOW", 0) | getattr(os, "O_BINARY", 0)
+
+
+class StatCache:
+    """
+    Source stat cache, read from and written to a gzipped file of pickles
+
+    The file starts with a header, made of the format version, the base path
+    of the source directory and the metadata settings, followed by one record
+    per path made of its index, its stat key and its cached metadata.
+    An existing cache whose header doesn't match is ignored.
+    The indexes passed to get and set must be ever increasing, like the
+    indexes of a selection iterator.
+    """
+
+    name = "Source stat cache"
+
+    def __init__(self, cache_path, base_path):
+        self.cache_path = os.fsencode(cache_path)
+        self.header = (FORMAT_VERSION, os.fsencode(base_path), self._get_flags())
+        self.hits = 0
+        self.misses = 0
+        self._old_fp = self._open_old_cache()
+        self._old_record = self._read_old_record()
+        self._new_path = self.cache_path + b".tmp"
+        self._new_fp = self._open_new_cache()
+        pickle.dump(self.header, self._new_fp, consts.PICKLE_PROTOCOL)
+
+    def get(self, index, statblock):
+        """
+        Return the cached metadata of the index, None if it isn't cached
+
+        The statblock must be the one of the current version of the file,
+        cached metadata is only returned if the file looks unchanged.
+        """
+        while self._old_record is not None and self._old_record[0] < index:
+            self._old_record = self._read_old_record()
+        if (
+            self._old_record is not None
+            and self._old_record[0] == index
+            and self._old_record[1] == _get_stat_key(statblock)
+        ):
+            self.hits += 1
+            return self._old_record[2]
+        self.misses += 1
+        return None
+
+    def set(self, index, statblock, data):
+        """Remember the costly metadata of the given data dictionary"""
+        if data["type"] is None:
+            return
+        cached_data = {key: data[key] for key in CACHED_KEYS if key in data}
+        pickle.dump(
+            (index, _get_stat_key(statblock), cached_data),
+            self._new_fp,
+            consts.PICKLE_PROTOCOL,
+        )
+
+    def close(self):
+        """Replace the old cache with the newly written one"""
+        if self._old_fp:
+            _close_cache_file(self._old_fp)
+            self._old_fp = None
+        _close_cache_file(self._new_fp)
+        os.replace(self._new_path, self.cache_path)
+        log.Log(
+            "{na} {sc} had {hi} hits and {mi} misses".format(
+                na=self.name, sc=self.cache_path, hi=self.hits, mi=self.misses
+            ),
+            log.INFO,
+        )
+
+    def _open_old_cache(self):
+        """Return the opened old cache file if it fits the header, else None"""
+        old_fp = None
+        try:
+            old_fp = _open_trusted_file(self.cache_path)
+            old_header = pickle.load(old_fp)
+        except FileNotFoundError:
+            return None
+        except (
+            OSError,
+            EOFError,
+            ValueError,
+            pickle.UnpicklingError,
+            zlib.error,
+        ) as exc:
+            if old_fp:
+                _close_cache_file(old_fp)
+            log.Log(
+                "{na} {sc} can't be read due to exception '{ex}', "
+                "it will be re-created".format(
+                    na=self.name, sc=self.cache_path, ex=exc
+                ),
+                log.WARNING,
+            )
+            return None
+        if old_header != self.header:
+            log.Log(
+                "{na} {sc} doesn't fit the current source or "
+                "settings, it will be re-created".format(
+                    na=self.name, sc=self.cache_path
+                ),
+                log.NOTE,
+            )
+            _close_cache_file(old_fp)
+            return None
+        return old_fp
+
+    def _open_new_cache(self):
+        """Return the new cache file, open for writing"""
+        fd = os.open(
+            self._new_path,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_FLAGS,
+            0o600,
+        )
+        if os.chmod in os.supports_fd:
+            os.chmod(fd, 0o600)  # in case the file already existed
+        return gzip.GzipFile(fileobj=os.fdopen(fd, "wb"), mode="wb", compresslevel=1)
+
+    def _read_old_record(self):
+        """Return the next record of the old cache, None at its end"""
+        if not self._old_fp:
+            return None
+        try:
+            return pickle.load(self._old_fp)
+        except EOFError:
+            return None
+        except (OSError, pickle.UnpicklingError, zlib.error) as exc:
+            log.Log(
+                "{na} {sc} is corrupted due to exception '{ex}', "
+                "ignoring the rest of it".format(
+                    na=self.name, sc=self.cache_path, ex=exc
+                ),
+                log.WARNING,
+            )
+            return None
+
+    @staticmethod
+    def _get_flags():
+        """Return the settings deciding which metadata is read"""
+        return (
+            bool(specifics.eas_conn),
+            bool(specifics.acls_conn),
+            bool(specifics.resource_forks_conn),
+            bool(specifics.carbonfile_conn),
+        )
+
+
+class HashCache:
+    """
+    Source hash cache, read from and written to a gzipped file of pickles
+
+    The file starts with a header, made of the format version and the base
+    path of the source directory, followed by one record per regular file
+    made of its index, its stat key and the hex SHA1 digest of its content.
+    The indexes passed to get and set must be ever increasing, hashes set
+    for an index lower than the last one set are ignored.
+
+    The records of files whose hash isn't set again are kept as they are,
+    so that the hashes of files not read by a backup aren't forgotten.
+    """
+
+    name = "Source hash cache"
+
+    def __init__(self, cache_path, base_path):
+        self.cache_path = os.fsencode(cache_path)
+        self.base_path = os.fsencode(base_path)
+        self.header = (FORMAT_VERSION, self.base_path)
+        self.hits = 0
+        self.misses = 0
+        self._old_fp = self._open_old_cache()
+        self._old_record = self._read_old_record()
+        self._new_path = self.cache_path + b".tmp"
+        self._new_fp = self._open_new_cache()
+        pickle.dump(self.header, self._new_fp, consts.PICKLE_PROTOCOL)
+        self._last_index = None
+
+    def get(self, index, statblock):
+        """
+        Return the cached SHA1 digest of the index, None if it isn't cached
+
+        The statblock must have been taken before the file is read, the
+        digest is only returned if the file looks unchanged.
+        """
+        self._keep_old_records(index)
+        if (
+            self._old_record is not None
+            and self._old_record[0] == index
+            and self._old_record[1] == _get_stat_key(statblock)
+        ):
+            self.hits += 1
+            return self._old_record[2]
+        self.misses += 1
+        return None
+
+    def set(self, index, statblock, sha1_digest):
+        """
+        Remember the SHA1 digest of the file at index
+
+        The statblock must have been taken before the file was read, so that
+        a file changed while being read doesn't match anymore.
+        """
+        if self._new_fp is None:  # file closed after the cache
+            return
+        if self._last_index is not None and index <= self._last_index:
+            return
+        self._keep_old_records(index)
+        if self._old_record is not None and self._old_record[0] == index:
+            self._old_record = self._read_old_record()  # replaced
+        self._write_record((index, _get_stat_key(statblock), sha1_digest))
+
+    def close(self):
+        """Replace the old cache with the newly written one"""
+        self._keep_old_records(None)
+        if self._old_fp:
+            _close_cache_file(self._old_fp)
+            self._old_fp = None
+        _close_cache_file(self._new_fp)
+        self._new_fp = None
+        os.replace(self._new_path, self.cache_path)
+        log.Log(
+            "{na} {sc} had {hi} hits and {mi} misses".format(
+                na=self.name, sc=self.cache_path, hi=self.hits, mi=self.misses
+            ),
+            log.INFO,
+        )
+
+    def _keep_old_records(self, index):
+        """
+        Copy the old records before index (all if None) to the new cache
+
+        The files aren't checked again, a record of a file changed or
+        removed meanwhile can't match anymore anyway, as its stat key
+        changed.
+        """
+        while self._old_record is not None and (
+            index is None or self._old_record[0] < index
+        ):
+            if self._last_index is None or self._old_record[0] > self._last_index:
+                self._write_record(self._old_record)
+            self._old_record = self._read_old_record()
+
+    def _write_record(self, record):
+        """Write the record to the new cache"""
+        pickle.dump(record, self._new_fp, consts.PICKLE_PROTOCOL)
+        self._last_index = record[0]
+
+    # the cache files are opened and read the same way as the stat cache
+    _open_old_cache = StatCache._open_old_cache
+    _open_new_cache = StatCache._open_new_cache
+    _read_old_record = StatCache._read_old_record
+
+
+def get_stat_cache(cache_path, base_path):
+    """
+    Return a new StatCache object, None if not supported on this platform
+
+    Under Windows, the ctime is the creation time and can't be used to
+    detect metadata changes, and ACLs aren't cached.
+    A Security.Violation is raised if the cache path isn't allowed.
+    """
+    Security.vet_path(cache_path, writable=True)
+    if sys.platform.startswith("win") or specifics.win_acls_conn:
+        log.Log(
+            "Source stat cache isn't supported on this platform, ignoring it",
+            log.WARNING,
+        )
+        return None
+    return StatCache(cache_path, base_path)
+
+
+def get_hash_cache(cache_path, base_path):
+    """
+    Return a new HashCache object
+
+    A Security.Violation is raised if the cache path isn't allowed.
+    """
+    Security.vet_path(cache_path, writable=True)
+    return HashCache(cache_path, base_path)
+
+
+def _open_trusted_file(path):
+    """
+    Return the gzipped cache file at path, opened for reading
+
+    ValueError is raised if the file isn't a regular file owned by the
+    current user and only writable by them, as it would be unpickled.
+    """
+    fd = os.open(path, os.O_RDONLY | _O_FLAGS)
+    try:
+        statblock = os.fstat(fd)
+        if not stat.S_ISREG(statblock.st_mode):
+            raise ValueError("not a regular file")
+        if hasattr(os, "geteuid") and statblock.st_uid != os.geteuid():
+            raise ValueError("not owned by the current user")
+        if statblock.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError("writable by other users")
+    except BaseException:
+        os.close(fd)
+        raise
+    return gzip.GzipFile(fileobj=os.fdopen(fd, "rb"), mode="rb")
+
+
+def _close_cache_file(gzip_fp):
+    """Close the gzipped cache file and the file it wraps"""
+    raw_fp = gzip_fp.fileobj  # reset by close
+    try:
+        gzip_fp.close()
+    finally:
+        if raw_fp:
+            raw_fp.close()
+
+
+def _get_stat_key(statblock):
+    """Return the values of a stat result showing that a file changed"""
+    return (
+        statblock.st_dev,
+        statblock.st_ino,
+        statblock.st_size,
+        statblock.st_mtime_ns,
+        statblock.st_ctime_ns,
+    )
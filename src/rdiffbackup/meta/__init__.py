@@ -20,11 +20,25 @@
 Base module for any metadata class to derive from.
 """
 
+import bisect
+import os
 import re
+import struct
+import zlib
 
 from rdiff_backup import C
 from rdiffbackup.singletons import log
 
+# Magic string at the beginning of binary metadata files, followed by a byte
+# of flags, and magic string at the very end of the file
+BINARY_MAGIC = b"rdbmeta\x01"
+BINARY_END_MAGIC = b"rdbmidx\x01"
+BINARY_FLAG_ZLIB = 0x01
+
+_LENGTH = struct.Struct(">I")
+_OFFSET = struct.Struct(">Q")
+_TRAILER = struct.Struct(">Q8s")
+
 
 class ParsingError(Exception):
     """This is raised when bad or unparsable data is received"""
@@ -67,15 +81,26 @@ class FlatExtractor:
                 )
 
     def _iterate_records(self):
-        """Yield all text records in order"""
+        """
+        Yield all text records in order
+
+        Each block read is split at once on all the record boundaries it
+        contains, only the last (possibly incomplete) record is kept in the
+        buffer, so that records are neither searched nor copied repeatedly.
+        """
         while 1:
-            next_pos = self._get_next_pos()
-            if self.at_end:
-                if next_pos:
-                    yield self.buf[:next_pos]
+            newbuf = self.fileobj.read(self.blocksize)
+            if not newbuf:
                 break
-            yield self.buf[:next_pos]
-            self.buf = self.buf[next_pos:]
+            buf = self.buf + newbuf
+            start = 0
+            for match in self.record_boundary_regexp.finditer(buf, 1):
+                yield buf[start : match.start(1)]
+                start = match.start(1)
+            self.buf = buf[start:]
+        self.at_end = 1
+        if self.buf:
+            yield self.buf
         self.fileobj.close()
 
     def _iterate_starting_with(self, index):
@@ -138,8 +163,9 @@ class FlatExtractor:
 
     def _get_next_pos(self):
         """Return position of next record in buffer, or end pos if none"""
+        search_pos = 1
         while 1:
-            m = self.record_boundary_regexp.search(self.buf, 1)
+            m = self.record_boundary_regexp.search(self.buf, search_pos)
             if m:
                 return m.start(1)
             else:  # add next block to the buffer, loop again
@@ -148,9 +174,234 @@ class FlatExtractor:
                     self.at_end = 1
                     return len(self.buf)
                 else:
+                    # only the last line can start a boundary not found yet
+                    search_pos = max(self.buf.rfind(b"\n"), 1)
                     self.buf += newbuf
 
 
+class BinaryExtractor:
+    """
+    Iterate objects from binary metadata file
+
+    The file starts with BINARY_MAGIC followed by a byte of flags, then comes
+    a sequence of blocks, each made of its length on 4 bytes followed by
+    records (zlib compressed if the flag is set), and an empty block closes
+    the sequence.  Each record is prefixed by its length and starts with the
+    length prefixed path of the file, the rest of the record being decoded
+    by the record_to_object function given.
+
+    The blocks are followed by the block index, a block listing the offset and
+    the path of the first record of each block, and the file ends with a
+    trailer made of the offset of the block index and BINARY_END_MAGIC.
+    This allows to seek directly to the block relevant for a given index.
+    """
+
+    def __init__(self, fileobj, record_to_object):
+        self.fileobj = fileobj
+        self.record_to_object = record_to_object
+        self.compressed = False
+
+    def iterate(self):
+        """Return iterator that yields all objects"""
+        if self._read_header():
+            for index, record in self._iterate_records():
+                yield self._to_object(index, record)
+        self.fileobj.close()
+
+    def _iterate_starting_with(self, index):
+        """Iterate objects whose index starts with given index"""
+        if self._read_header():
+            self._skip_to_block(index)
+            for rec_index, record in self._iterate_records():
+                if rec_index < index:
+                    continue
+                if rec_index[: len(index)] != index:
+                    break
+                yield self._to_object(rec_index, record)
+        self.fileobj.close()
+
+    def _read_header(self):
+        """Validate the header and read the flags, return False if invalid"""
+        header = self.fileobj.read(len(BINARY_MAGIC) + 1)
+        if len(header) != len(BINARY_MAGIC) + 1 or not header.startswith(BINARY_MAGIC):
+            log.Log(
+                "Binary metadata file {mf} has an invalid header".format(
+                    mf=self.fileobj.name
+                ),
+                log.WARNING,
+            )
+            return False
+        self.compressed = bool(header[-1] & BINARY_FLAG_ZLIB)
+        return True
+
+    def _skip_to_block(self, index):
+        """
+        Seek to the beginning of the block potentially containing index
+
+        If the block index can't be read, the file is simply read from the
+        beginning.
+        """
+        blocks_start = self.fileobj.tell()
+        block_index = self._read_block_index()
+        if block_index:
+            offsets, first_indexes = block_index
+            position = max(bisect.bisect_right(first_indexes, index) - 1, 0)
+            self.fileobj.seek(offsets[position])
+        else:
+            self.fileobj.seek(blocks_start)
+
+    def _read_block_index(self):
+        """Return tuple of offsets and first indexes of blocks, or None"""
+        try:
+            self.fileobj.seek(-_TRAILER.size, os.SEEK_END)
+            index_offset, end_magic = _TRAILER.unpack(self.fileobj.read(_TRAILER.size))
+            if end_magic != BINARY_END_MAGIC:
+                raise ValueError("wrong end magic {em}".format(em=end_magic))
+            self.fileobj.seek(index_offset)
+            data = self._read_block()
+        except (OSError, ValueError, struct.error, zlib.error) as exc:
+            log.Log(
+                "Block index of binary metadata file {mf} can't be read "
+                "due to exception '{ex}', reading the whole file".format(
+                    mf=self.fileobj.name, ex=exc
+                ),
+                log.WARNING,
+            )
+            return None
+        offsets = []
+        first_indexes = []
+        pos = 0
+        while pos < len(data):
+            offsets.append(_OFFSET.unpack_from(data, pos)[0])
+            pos += _OFFSET.size
+            path_len = _LENGTH.unpack_from(data, pos)[0]
+            pos += _LENGTH.size
+            first_indexes.append(_path_to_index(data[pos : pos + path_len]))
+            pos += path_len
+        return (offsets, first_indexes)
+
+    def _read_block(self):
+        """Read one block and return its uncompressed content"""
+        length_data = self.fileobj.read(_LENGTH.size)
+        if len(length_data) != _LENGTH.size:
+            raise ValueError("truncated block length")
+        length = _LENGTH.unpack(length_data)[0]
+        data = self.fileobj.read(length)
+        if len(data) != length:
+            raise ValueError("truncated block")
+        if length and self.compressed:
+            data = zlib.decompress(data)
+        return data
+
+    def _iterate_records(self):
+        """Yield tuples of index and (undecoded) record from all blocks"""
+        while True:
+            try:
+                data = self._read_block()
+            except (ValueError, zlib.error) as exc:
+                log.Log(
+                    "Error reading binary metadata file {mf} due to "
+                    "exception '{ex}', further records ignored".format(
+                        mf=self.fileobj.name, ex=exc
+                    ),
+                    log.WARNING,
+                )
+                return
+            if not data:  # empty block at end of records
+                return
+            pos = 0
+            while pos < len(data):
+                rec_len = _LENGTH.unpack_from(data, pos)[0]
+                pos += _LENGTH.size
+                path_len = _LENGTH.unpack_from(data, pos)[0]
+                path_end = pos + _LENGTH.size + path_len
+                yield (
+                    _path_to_index(data[pos + _LENGTH.size : path_end]),
+                    data[path_end : pos + rec_len],
+                )
+                pos += rec_len
+
+    def _to_object(self, index, record):
+        """Convert record to object, raising ParsingError if necessary"""
+        try:
+            return self.record_to_object(index, record)
+        except (IndexError, KeyError, ValueError, struct.error) as exc:
+            raise ParsingError(
+                "Binary record of {ix} can't be parsed due to exception "
+                "'{ex}'".format(ix=index, ex=exc)
+            )
+
+
+class BinaryWriter:
+    """
+    Write records to a binary metadata file as described in BinaryExtractor
+    """
+
+    blocksize = 64 * 1024  # approximate size of uncompressed blocks
+
+    def __init__(self, fileobj, compress):
+        self.fileobj = fileobj
+        self.compress = compress
+        flags = BINARY_FLAG_ZLIB if compress else 0
+        header = BINARY_MAGIC + bytes((flags,))
+        self.fileobj.write(header)
+        self.offset = len(header)
+        self.block_index = []  # list of tuples (offset, first path)
+        self.records = []
+        self.records_size = 0
+
+    def write_record(self, index, record):
+        """Write the given record for the given index"""
+        path = b"/".join(index)
+        if not self.records:
+            self.block_index.append((self.offset, path))
+        data = _LENGTH.pack(len(path)) + path + record
+        self.records.append(_LENGTH.pack(len(data)) + data)
+        self.records_size += len(data) + _LENGTH.size
+        if self.records_size >= self.blocksize:
+            self._write_block(b"".join(self.records))
+            self.records = []
+            self.records_size = 0
+
+    def close(self):
+        """Write the last records, the block index and the trailer"""
+        if self.records:
+            self._write_block(b"".join(self.records))
+        self._write_block(b"")  # empty block closing the records
+        index_offset = self.offset
+        self._write_block(
+            b"".join(
+                _OFFSET.pack(offset) + _LENGTH.pack(len(path)) + path
+                for offset, path in self.block_index
+            )
+        )
+        self.fileobj.write(_TRAILER.pack(index_offset, BINARY_END_MAGIC))
+        return self.fileobj.close()
+
+    def _write_block(self, data):
+        """Write (and compress if necessary) one block of data"""
+        if data and self.compress:
+            data = zlib.compress(data)
+        self.fileobj.write(_LENGTH.pack(len(data)) + data)
+        self.offset += _LENGTH.size + len(data)
+
+
+def is_binary_file(fileobj):
+    """Return True if the buffered file object is a binary metadata file"""
+    return (
+        hasattr(fileobj, "peek")
+        and fileobj.peek(len(BINARY_MAGIC))[: len(BINARY_MAGIC)] == BINARY_MAGIC
+    )
+
+
+def _path_to_index(path):
+    """Convert (unquoted) path of binary record to index tuple"""
+    if path:
+        return tuple(path.split(b"/"))
+    else:
+        return ()
+
+
 class FlatFile:
     """
     Manage a flat file containing info on various files
@@ -170,6 +421,9 @@ class FlatFile:
     _record_buffer, _max_buffer_size = None, 100
     _extractor = FlatExtractor  # Override to class that iterates objects
     _object_to_record = None  # Set to function converting object to record
+    # Set to function converting object to binary record if the binary format
+    # is supported, the extractor needs then a _binary_to_object function
+    _object_to_binary = None
     _name = None  # simple name to be used as dictionary key
     _description = None  # human readable name of the metadata type
     _prefix = None  # Set to required prefix
@@ -216,16 +470,30 @@ class FlatFile:
         """
         return cls._is_main
 
-    def __init__(self, rp_base, mode, check_path=1, compress=None, callback=None):
+    @classmethod
+    def supports_binary(cls):
+        """
+        Returns True if the metadata class can be written in binary format
+        """
+        return cls._object_to_binary is not None
+
+    def __init__(
+        self, rp_base, mode, check_path=1, compress=None, callback=None, binary=False
+    ):
         """
-        Open rp (or rp+'.gz') for reading ('r') or writing ('w')
+        Open rp (or rp plus compression suffix) for reading ('r') or writing ('w')
 
         If callback is available, it will be called on the rp upon
         closing (because the rp may not be known in advance).
+        If binary is True and the class supports it, the file is written in
+        binary format (where compression is done internally), the format of
+        files being read is automatically detected.
         """
         self.mode = mode
         self.callback = callback
         self._record_buffer = []
+        self._binary_writer = None
+        self._is_binary = False
         if check_path:
             if not (rp_base.isincfile() and rp_base.getincbase_bname() == self._prefix):
                 log.Log.FatalError(
@@ -234,13 +502,18 @@ class FlatFile:
         if mode == "r" or mode == "rb":
             self.rp = rp_base
             if compress is None:
-                if self.rp.isinccompressed():
-                    compress = True
-                else:
-                    compress = False
+                compress = self.rp.isinccompressed()
             self.fileobj = self.rp.open("rb", compress)
+            self._is_binary = not compress and is_binary_file(self.fileobj)
         elif mode == "w" or mode == "wb":
-            if compress and check_path and not rp_base.isinccompressed():
+            if binary and self.supports_binary():
+                self.rp = rp_base
+                assert (
+                    not self.rp.lstat()
+                ), "Path '{rp}' can't exist before it's opened.".format(rp=self.rp)
+                self.fileobj = self.rp.open("wb")
+                self._binary_writer = BinaryWriter(self.fileobj, compress)
+            elif compress and check_path and not rp_base.isinccompressed():
 
                 def callback(rp):
                     self.rp = rp
@@ -260,20 +533,41 @@ class FlatFile:
                 "r, rb, w or wb".format(om=mode)
             )
 
+    def is_binary(self):
+        """Returns True if the file is in binary format"""
+        return self._is_binary or self._binary_writer is not None
+
     def write_object(self, object):
         """Convert one object to record and write to file"""
-        self._write_record(self._object_to_record(object))
+        if self._binary_writer:
+            self._binary_writer.write_record(
+                object.index, self._object_to_binary(object)
+            )
+        else:
+            self._write_record(self._object_to_record(object))
 
     def get_objects(self, restrict_index=None):
         """Return iterator of objects records from file rp"""
+        if self._is_binary:
+            extractor = BinaryExtractor(self.fileobj, self._extractor._binary_to_object)
+        else:
+            extractor = self._extractor(self.fileobj)
         if not restrict_index:
-            return self._extractor(self.fileobj).iterate()
-        extractor = self._extractor(self.fileobj)
+            return extractor.iterate()
         return extractor._iterate_starting_with(restrict_index)
 
     def close(self):
         """Close file, for when any writing is done"""
         assert self.fileobj, "Can't close file already closed."
+        if self._binary_writer:
+            result = self._binary_writer.close()
+            self._binary_writer = None
+            self.fileobj = None
+            self.rp.fsync_with_dir()
+            self.rp.setdata()
+            if self.callback:
+                self.callback(self.rp)
+            return result
         if self._buffering_on and self._record_buffer:
             self.fileobj.write(b"".join(self._record_buffer))
             self._record_buffer = []
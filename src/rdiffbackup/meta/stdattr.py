@@ -51,15 +51,67 @@ File <filename>
 
 Where the lines are separated by newlines.  See the code below for the
 field names and values.
+
+Alternatively, the metadata can be stored in the binary format described in
+rdiffbackup.meta.BinaryExtractor, where each record is a sequence of fields
+made of a one byte tag followed by a length prefixed value.
 """
 
-import re
 import binascii
+import re
+import struct
 from rdiff_backup import rpath
 from rdiffbackup import meta
 from rdiffbackup.singletons import generics, log
 from rdiffbackup.utils import quoting
 
+# layout of the text records written by the fast path of
+# AttrFile._object_to_record, parsed in one go by AttrExtractor
+_FAST_RECORD_REGEXP = re.compile(
+    b"File ([^\\n]+)\\n"
+    b"  Type (reg|dir|sym|fifo|sock)\\n"
+    b"(?:  Size (-?[0-9]+)\\n)?"
+    b"(?:  NumHardLinks (-?[0-9]+)\\n  Inode (-?[0-9]+)\\n  DeviceLoc (-?[0-9]+)\\n)?"
+    b"(?:  SHA1Digest ([^\\n]+)\\n)?"
+    b"(?:  SymData ([^\\n]+)\\n)?"
+    b"(?:  ModTime (-?[0-9]+)\\n)?"
+    b"  Uid (-?[0-9]+)\\n  Uname ([^\\n]+)\\n"
+    b"  Gid (-?[0-9]+)\\n  Gname ([^\\n]+)\\n"
+    b"  Permissions (-?[0-9]+)\\n"
+    b"(?:  AlternateMirrorName ([^\\n]+)\\n)?"
+    b"(?:  AlternateIncrementName ([^\\n]+)\\n)?"
+)
+# the file types written by the fast path of AttrFile._object_to_record
+_FAST_RECORD_TYPES = {"reg", "dir", "sym", "fifo", "sock"}
+
+# tags of the binary fields holding integers, strings and bytes
+_BINARY_INT_FIELDS = {
+    b"s": "size",
+    b"n": "nlink",
+    b"i": "inode",
+    b"l": "devloc",
+    b"m": "mtime",
+    b"u": "uid",
+    b"g": "gid",
+    b"p": "perms",
+}
+_BINARY_STR_FIELDS = {
+    b"t": {"key": "type", "enc": "ascii"},
+    b"h": {"key": "sha1", "enc": "ascii"},
+    b"U": {"key": "uname", "enc": "utf-8"},
+    b"G": {"key": "gname", "enc": "utf-8"},
+}
+_BINARY_BYTES_FIELDS = {
+    b"y": "linkname",
+    b"r": "resourcefork",
+    b"M": "mirrorname",
+    b"I": "incname",
+}
+_BINARY_DEVNUM_FIELD = b"d"
+_BINARY_CARBON_FIELD = b"c"
+_BINARY_NONE_LENGTH = 0xFFFFFFFF  # length marking a None value
+_LENGTH = struct.Struct(">I")
+
 
 class AttrExtractor(meta.FlatExtractor):
     """Iterate rorps from metadata file"""
@@ -100,6 +152,67 @@ class AttrExtractor(meta.FlatExtractor):
         """
         Given record_string, return RORPath
 
+        This is the fast path of _reference_record_to_object: records laid
+        out exactly as written by AttrFile._object_to_record are parsed with
+        one single regexp match instead of line by line.  Any other record
+        falls back to the reference implementation, which knows how to handle
+        and report unknown fields and malformed lines.
+        """
+        match = _FAST_RECORD_REGEXP.fullmatch(record_string)
+        if not match:
+            return cls._reference_record_to_object(record_string)
+        (
+            quoted_filename,
+            type,
+            size,
+            nlink,
+            inode,
+            devloc,
+            sha1,
+            linkname,
+            mtime,
+            uid,
+            uname,
+            gid,
+            gname,
+            perms,
+            mirrorname,
+            incname,
+        ) = match.groups()
+        data_dict = {
+            "type": type.decode("ascii"),
+            "uid": int(uid),
+            "uname": None if uname in (b":", b"None") else uname.decode("utf-8"),
+            "gid": int(gid),
+            "gname": None if gname in (b":", b"None") else gname.decode("utf-8"),
+            "perms": int(perms),
+        }
+        if size is not None:
+            data_dict["size"] = int(size)
+        if nlink is not None:
+            data_dict["nlink"] = int(nlink)
+            data_dict["inode"] = int(inode)
+            data_dict["devloc"] = int(devloc)
+        if sha1 is not None:
+            data_dict["sha1"] = (
+                None if sha1 in (b":", b"None") else sha1.decode("ascii")
+            )
+        if linkname is not None:
+            data_dict["linkname"] = quoting.unquote_path(linkname)
+        if mtime is not None:
+            data_dict["mtime"] = int(mtime)
+        if mirrorname is not None:
+            data_dict["mirrorname"] = mirrorname
+        if incname is not None:
+            data_dict["incname"] = incname
+        index = cls._filename_to_index(quoted_filename)
+        return rpath.RORPath(index, data_dict)
+
+    @classmethod
+    def _reference_record_to_object(cls, record_string):
+        """
+        Given record_string, return RORPath
+
         For speed reasons, write the RORPath data dictionary directly
         instead of calling rorpath functions.  Profiling has shown this to
         be a time critical function.
@@ -150,6 +263,48 @@ class AttrExtractor(meta.FlatExtractor):
                 )
         return rpath.RORPath(index, data_dict)
 
+    @staticmethod
+    def _binary_to_object(index, record):
+        """
+        Given index and binary record, return RORPath
+
+        Integers are stored as one byte length followed by the big endian
+        signed value, other values as 4 bytes length followed by the data.
+        """
+        data_dict = {}
+        pos = 0
+        while pos < len(record):
+            tag = record[pos : pos + 1]
+            pos += 1
+            if tag in _BINARY_INT_FIELDS:
+                value, pos = _unpack_binary_int(record, pos)
+                data_dict[_BINARY_INT_FIELDS[tag]] = value
+                continue
+            value, pos = _unpack_binary_bytes(record, pos)
+            if tag in _BINARY_STR_FIELDS:
+                if value is not None:
+                    value = value.decode(_BINARY_STR_FIELDS[tag]["enc"])
+                data_dict[_BINARY_STR_FIELDS[tag]["key"]] = value
+            elif tag in _BINARY_BYTES_FIELDS:
+                data_dict[_BINARY_BYTES_FIELDS[tag]] = value
+            elif tag == _BINARY_DEVNUM_FIELD:
+                major, dev_pos = _unpack_binary_int(value, 1)
+                minor, dev_pos = _unpack_binary_int(value, dev_pos)
+                data_dict["devnums"] = (value[0:1].decode("ascii"), major, minor)
+            elif tag == _BINARY_CARBON_FIELD:  # pragma: no cover
+                if value is None:
+                    data_dict["carbonfile"] = None
+                else:
+                    data_dict["carbonfile"] = _string2carbonfile(value.decode("ascii"))
+            else:
+                log.Log(
+                    "Unknown binary field '{uf}' for index '{ix}'".format(
+                        uf=tag, ix=index
+                    ),
+                    log.WARNING,
+                )
+        return rpath.RORPath(index, data_dict)
+
 
 class AttrFile(meta.FlatFile):
     """Store/retrieve metadata from mirror_metadata as rorps"""
@@ -162,6 +317,54 @@ class AttrFile(meta.FlatFile):
 
     @staticmethod
     def _object_to_record(rorpath):
+        """
+        From RORPath, return text record of file's metadata
+
+        This is the fast path of _reference_object_to_record for the most
+        common file types, reading the data dictionary directly and
+        formatting the record at once.  Other types and files with resource
+        forks or carbon data are left to the reference implementation.
+        """
+        data = rorpath.data
+        type = data["type"]
+        if (
+            type not in _FAST_RECORD_TYPES
+            or "resourcefork" in data
+            or "carbonfile" in data
+        ):
+            return AttrFile._reference_object_to_record(rorpath)
+        path = quoting.quote_path(b"/".join(rorpath.index) or b".")
+        if type == "reg":
+            record = b"File %b\n  Type reg\n  Size %i\n" % (path, data["size"])
+            if generics.preserve_hardlinks and data.get("nlink", 1) > 1:
+                record += b"  NumHardLinks %i\n  Inode %i\n  DeviceLoc %i\n" % (
+                    data["nlink"],
+                    data["inode"],
+                    data["devloc"],
+                )
+            if "sha1" in data:
+                record += b"  SHA1Digest %b\n" % data["sha1"].encode("ascii")
+        else:
+            record = b"File %b\n  Type %b\n" % (path, type.encode("ascii"))
+        if type == "sym":
+            record += b"  SymData %b\n" % quoting.quote_path(data["linkname"])
+        else:
+            record += b"  ModTime %i\n" % data["mtime"]
+        record += b"  Uid %i\n  Uname %b\n  Gid %i\n  Gname %b\n  Permissions %d\n" % (
+            data["uid"],
+            (data.get("uname") or ":").encode(),
+            data["gid"],
+            (data.get("gname") or ":").encode(),
+            data.get("perms", 0),
+        )
+        if "mirrorname" in data:
+            record += b"  AlternateMirrorName %b\n" % data["mirrorname"]
+        elif "incname" in data:
+            record += b"  AlternateIncrementName %b\n" % data["incname"]
+        return record
+
+    @staticmethod
+    def _reference_object_to_record(rorpath):
         """From RORPath, return text record of file's metadata"""
         str_list = [b"File %s\n" % quoting.quote_path(rorpath.get_indexpath())]
 
@@ -236,6 +439,101 @@ class AttrFile(meta.FlatFile):
 
         return b"".join(str_list)
 
+    @staticmethod
+    def _object_to_binary(rorpath):
+        """
+        From RORPath, return binary record of file's metadata
+
+        The same fields as in the text record are stored, see _object_to_record
+        """
+        type = rorpath.gettype()
+        bin_list = [_pack_binary_str(b"t", type)]
+        if type == "reg":
+            bin_list.append(_pack_binary_int(b"s", rorpath.getsize()))
+            if rorpath.has_resource_fork():  # pragma: no cover
+                bin_list.append(
+                    _pack_binary_bytes(b"r", rorpath.get_resource_fork() or b"")
+                )
+            if rorpath.has_carbonfile():  # pragma: no cover
+                cfile = rorpath.get_carbonfile()
+                bin_list.append(
+                    _pack_binary_str(b"c", cfile and _carbonfile2string(cfile))
+                )
+            if generics.preserve_hardlinks:
+                numlinks = rorpath.getnumlinks()
+                if numlinks > 1:
+                    bin_list.append(_pack_binary_int(b"n", numlinks))
+                    bin_list.append(_pack_binary_int(b"i", rorpath.getinode()))
+                    bin_list.append(_pack_binary_int(b"l", rorpath.getdevloc()))
+            if rorpath.has_sha1():
+                bin_list.append(_pack_binary_str(b"h", rorpath.get_sha1()))
+        elif type is None:
+            return b"".join(bin_list)
+        elif type == "sym":
+            bin_list.append(_pack_binary_bytes(b"y", rorpath.readlink()))
+        elif type == "dev":
+            devchar, major, minor = rorpath.getdevnums()
+            bin_list.append(
+                _pack_binary_bytes(
+                    _BINARY_DEVNUM_FIELD,
+                    devchar.encode("ascii")
+                    + _pack_binary_int(b"", major)
+                    + _pack_binary_int(b"", minor),
+                )
+            )
+
+        if type != "sym" and type != "dev":
+            bin_list.append(_pack_binary_int(b"m", rorpath.getmtime()))
+
+        uid, gid = rorpath.getuidgid()
+        bin_list.append(_pack_binary_int(b"u", uid))
+        bin_list.append(_pack_binary_str(b"U", rorpath.getuname()))
+        bin_list.append(_pack_binary_int(b"g", gid))
+        bin_list.append(_pack_binary_str(b"G", rorpath.getgname()))
+        bin_list.append(_pack_binary_int(b"p", rorpath.getperms()))
+
+        if rorpath.has_alt_mirror_name():
+            bin_list.append(_pack_binary_bytes(b"M", rorpath.get_alt_mirror_name()))
+        elif rorpath.has_alt_inc_name():
+            bin_list.append(_pack_binary_bytes(b"I", rorpath.get_alt_inc_name()))
+
+        return b"".join(bin_list)
+
+
+def _pack_binary_int(tag, value):
+    """Return tag followed by length and big endian bytes of signed integer"""
+    length = value.bit_length() // 8 + 1
+    return tag + bytes((length,)) + value.to_bytes(length, "big", signed=True)
+
+
+def _unpack_binary_int(data, pos):
+    """Return integer starting at position pos and the position after it"""
+    end = pos + 1 + data[pos]
+    return (int.from_bytes(data[pos + 1 : end], "big", signed=True), end)
+
+
+def _pack_binary_bytes(tag, value):
+    """Return tag followed by length and value, None has a special length"""
+    if value is None:
+        return tag + _LENGTH.pack(_BINARY_NONE_LENGTH)
+    return tag + _LENGTH.pack(len(value)) + value
+
+
+def _pack_binary_str(tag, value):
+    """Same as _pack_binary_bytes for strings, encoded as UTF-8"""
+    if value is None:
+        return _pack_binary_bytes(tag, None)
+    return _pack_binary_bytes(tag, value.encode())
+
+
+def _unpack_binary_bytes(data, pos):
+    """Return bytes (or None) starting at position pos and position after"""
+    length = _LENGTH.unpack_from(data, pos)[0]
+    pos += _LENGTH.size
+    if length == _BINARY_NONE_LENGTH:
+        return (None, pos)
+    return (data[pos : pos + length], pos + length)
+
 
 def _carbonfile2string(cfile):  # pragma: no cover
     """Convert CarbonFile data to a string suitable for storing."""
@@ -22,10 +22,13 @@ store and retrieve different types of metadata.
 """
 
 import os
-from rdiff_backup import rorpiter, rpath, Time
+from rdiff_backup import rorpiter, rpath, Security, Time
 import rdiffbackup.meta
 from rdiffbackup.singletons import generics, log
-from rdiffbackup.utils import plugins
+from rdiffbackup.utils import compressors, plugins
+
+# name of the directory in rdiff-backup-data holding the metadata cache
+CACHE_DIR = b"metadata_cache"
 
 
 class CombinedWriter:
@@ -53,13 +56,19 @@ class Manager:
     Read/Combine/Write metadata files by time
     """
 
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, cache_size=0):
         """
         Set listing of rdiff-backup-data dir
+
+        If cache_size (in bytes) isn't zero, the metadata snapshots replaced
+        by diffs, and the metadata patched together from diffs when read, are
+        kept in the cache of the rdiff-backup-data dir, so that they don't
+        need to be patched together from diffs again later on.
         """
         self.rplist = []
         self.timerpmap, self.prefixmap = {}, {}
         self.data_dir = data_dir
+        self.cache_size = cache_size
         for filename in self.data_dir.listdir():
             rp = self.data_dir.append(filename)
             if rp.isincfile():
@@ -132,13 +141,18 @@ class Manager:
             compress=generics.compression,
             check_path=0,
             callback=callback,
+            binary=(generics.metadata_format == "binary"),
         )
         for rorp in self._get_meta_main_at_time(regress_time, None):
             writer.write_object(rorp)
         writer.close()
 
+        if writer.is_binary():
+            suffix = b"snapshot"
+        else:
+            suffix = b"snapshot." + compressors.get_suffix(generics.compression_codec)
         finalrp = self.data_dir.append(
-            b"mirror_metadata.%b.snapshot.gz" % Time.timetobytes(regress_time)
+            b"mirror_metadata.%b.%b" % (Time.timetobytes(regress_time), suffix)
         )
         assert not finalrp.lstat(), "Metadata path '{mrp}' shouldn't exist.".format(
             mrp=finalrp
@@ -201,7 +215,11 @@ class Manager:
         if meta_class.is_active() or force:
             # Before API 201, metafiles couldn't be compressed
             return meta_class(
-                rp, "w", compress=generics.compression, callback=self._add_incrp
+                rp,
+                "w",
+                compress=generics.compression,
+                callback=self._add_incrp,
+                binary=(generics.metadata_format == "binary"),
             )
         else:
             return None
@@ -283,6 +301,10 @@ class PatchDiffMan(Manager):
         for diff_rorp in self._get_diffiter(new_iter, old_iter):
             diff_writer.write_object(diff_rorp)
         diff_writer.close()  # includes sync
+        if self.cache_size > 0:
+            self._write_cache_entry(
+                oldrp.getinctime(), self._meta_main_class(oldrp, "r").get_objects()
+            )
         oldrp.delete()
 
     def _get_diffiter(self, new_iter, old_iter):
@@ -326,9 +348,22 @@ class PatchDiffMan(Manager):
         """
         Get metadata rorp iter, possibly by patching with diffs
         """
+        meta_rps = self._relevant_meta_main_incs(time)
+        if len(meta_rps) > 1:
+            cache_iter = self._get_cached_meta_main(time, restrict_index)
+            if cache_iter is not None:
+                return cache_iter
+            if self._is_cache_writable():
+                meta_iters = [
+                    self._meta_main_class(rp, "r").get_objects() for rp in meta_rps
+                ]
+                self._write_cache_entry(time, self._iterate_patched_attr(meta_iters))
+                cache_iter = self._get_cached_meta_main(time, restrict_index)
+                if cache_iter is not None:
+                    return cache_iter
         meta_iters = [
             self._meta_main_class(rp, "r").get_objects(restrict_index)
-            for rp in self._relevant_meta_main_incs(time)
+            for rp in meta_rps
         ]
         if not meta_iters:
             return None
@@ -336,6 +371,112 @@ class PatchDiffMan(Manager):
             return meta_iters[0]
         return self._iterate_patched_attr(meta_iters)
 
+    def _get_cache_rp(self, time):
+        """
+        Return the path of the cache entry for the metadata at the given time
+        """
+        return self.data_dir.append(CACHE_DIR).append(
+            b"mirror_metadata.%b.snapshot" % Time.timetobytes(time)
+        )
+
+    def _is_cache_writable(self):
+        """
+        Return True if the cache is used and can be written
+
+        Without cache size, or if the repository is accessed read-only, the
+        cache entries found are read but nothing is written.
+        """
+        return self.cache_size > 0 and not Security.is_read_only()
+
+    def _get_cached_meta_main(self, time, restrict_index):
+        """
+        Get metadata rorp iter from the cache, or None if there is no entry
+
+        If the cache can be written, the modification time of the entry is
+        updated, so that the least recently used entries are evicted first.
+        """
+        cache_rp = self._get_cache_rp(time)
+        if not cache_rp.lstat():
+            return None
+        log.Log("Reading metadata from cache entry {ce}".format(ce=cache_rp), log.INFO)
+        if self._is_cache_writable():
+            try:
+                os.utime(cache_rp.path)
+            except OSError:
+                pass
+        return self._meta_main_class(cache_rp, "r").get_objects(restrict_index)
+
+    def _write_cache_entry(self, time, rorp_iter):
+        """
+        Write the metadata of the given time into the cache
+
+        The entry is written in the binary format, to a tempfile first, so
+        that concurrent readers never see a partial entry.  Failing to write
+        it is only a warning, the metadata being still available from the
+        snapshot and diffs.
+        """
+        try:
+            self._write_cache_rp(self._get_cache_rp(time), rorp_iter)
+        except OSError as exc:
+            log.Log(
+                "Metadata cache entry for time {ti} couldn't be written due to "
+                "exception '{ex}'".format(ti=Time.timetopretty(time), ex=exc),
+                log.WARNING,
+            )
+
+    def _write_cache_rp(self, cache_rp, rorp_iter):
+        """
+        Write the rorps into the cache entry and evict the least used entries
+        """
+        cache_dir = cache_rp.get_parent_rp()
+        if not cache_dir.lstat():
+            cache_dir.mkdir()
+        temprp = [cache_dir.get_temp_rpath()]
+
+        def callback(rp):
+            temprp[0] = rp
+
+        writer = self._meta_main_class(
+            temprp[0],
+            "wb",
+            compress=generics.compression,
+            check_path=0,
+            callback=callback,
+            binary=True,
+        )
+        log.Log("Writing metadata cache entry {ce}".format(ce=cache_rp), log.INFO)
+        try:
+            for rorp in rorp_iter:
+                writer.write_object(rorp)
+        finally:
+            writer.close()
+        rpath.rename(temprp[0], cache_rp)
+        if self._evict_cache_entries(cache_dir, cache_rp):
+            # the entry alone is bigger than the cache
+            cache_rp.delete()
+
+    def _evict_cache_entries(self, cache_dir, new_rp):
+        """
+        Remove the least recently used cache entries until the cache fits
+
+        Returns True if the new entry alone is bigger than the cache size.
+        """
+        entries = []
+        for filename in cache_dir.listdir():
+            rp = cache_dir.append(filename)
+            if rp.isreg() and rp.path != new_rp.path:
+                entries.append(rp)
+        new_rp.setdata()
+        cache_size = new_rp.getsize() + sum(rp.getsize() for rp in entries)
+        entries.sort(key=lambda rp: rp.getmtime())
+        for rp in entries:
+            if cache_size <= self.cache_size:
+                break
+            log.Log("Evicting metadata cache entry {ce}".format(ce=rp), log.INFO)
+            cache_size -= rp.getsize()
+            rp.delete()
+        return cache_size > self.cache_size
+
     def _relevant_meta_main_incs(self, time):
         """
         Return list [snapshotrp, diffrps ...] time sorted
@@ -419,18 +560,30 @@ def get_meta_list():
     return get_meta_list.plugins
 
 
-def get_meta_manager(data_dir=None, recreate=False):
+def get_meta_manager(data_dir=None, recreate=False, cache_size=0):
     """
     return current metadata manager or new one if doesn't exist yet
 
     The recreate variable forces the generation of a new metadata manager
     FIXME it's still rather unclear to me when a new instance is required and
     when not.
+    The cache size (in bytes) is only relevant for a new manager.
     """
     # we attach the manager to an element of the function to make it permanent
     if not hasattr(get_meta_manager, "manager") or recreate:
         assert (
             data_dir is not None
         ), "When created, the meta manager needs a data directory"
-        get_meta_manager.manager = PatchDiffMan(data_dir)
+        get_meta_manager.manager = PatchDiffMan(data_dir, cache_size)
     return get_meta_manager.manager
+
+
+def invalidate_cache(data_dir):
+    """
+    Remove the metadata cache, as soon as the history of the repository is
+    modified, e.g. by a regression or a removal of increments or files
+    """
+    cache_dir = data_dir.append(CACHE_DIR)
+    if cache_dir.lstat():
+        log.Log("Removing metadata cache {mc}".format(mc=cache_dir), log.INFO)
+        cache_dir.delete()
@@ -175,6 +175,7 @@ def _system_setup(arglist):
     generics.set("never_drop_acls", arglist.get("never_drop_acls"))
     # if action in ("backup", "regress", "restore"):
     generics.set("compression", arglist.get("compression"))
+    generics.set("compression_threads", arglist.get("compression_threads"))
     # if action in ("regress"):
     generics.set(
         "allow_duplicate_timestamps", arglist.get("allow_duplicate_timestamps")
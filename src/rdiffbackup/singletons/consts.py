@@ -46,6 +46,23 @@ CONN_BUFSIZE: typing.Final[int] = 393216
 # stuck in buffers when moving over a remote connection.
 PIPELINE_MAX_LENGTH: int = 500
 
+# Maximum number of calls gathered in a single batch before it is sent over
+# the connection, and number of blocks read ahead in one batch by
+# virtual files read sequentially over a remote connection.
+BATCH_MAX_CALLS: int = 256
+VIRTUAL_FILE_READAHEAD: int = 4
+
+# The threaded scanner of a source directory keeps at most this number of
+# directory listings per thread prefetched ahead of the selection.
+SCAN_PREFETCH_PER_THREAD: int = 4
+
+# Data sent over a connection with wire compression is only compressed if
+# it is at least as long as the minimum size, with the given zlib level,
+# and only sent compressed if it shrank below the given ratio.
+WIRE_COMPRESSION_LEVEL: typing.Final[int] = 1
+WIRE_COMPRESSION_MIN_SIZE: typing.Final[int] = 256
+WIRE_COMPRESSION_MAX_RATIO: typing.Final[float] = 0.9
+
 # This represents the pickle protocol used by rdiff-backup over the connection
 # https://docs.python.org/3/library/pickle.html#pickle-protocols
 # Note that the receiving end will automatically recognize the protocol used so
@@ -21,6 +21,7 @@ A variety of variables which need to have the same value across connections.
 They are generic to all instances of rdiff-backup involved.
 """
 
+import contextlib
 import sys
 import typing
 
@@ -100,6 +101,19 @@ preserve_hardlinks: bool = True
 # increments.  Default is to compress based on regexp below.
 compression: bool = True
 
+# Number of threads compressing the blocks of the files written compressed,
+# 0 means that files are compressed in the main thread.
+compression_threads: int = 0
+
+# Name of the codec compressing increments and metadata files, its suffix
+# is part of the file names so that files of any codec can be read.
+compression_codec: str = "gzip"
+
+# Format of the mirror_metadata files written, either "text" or "binary",
+# the latter allowing to quickly find the metadata of a given path.
+# Files of both formats can always be read.
+metadata_format: str = "text"
+
 # If true, filelists and directory statistics will be split on
 # nulls instead of newlines.
 null_separator: bool = False
@@ -151,6 +165,10 @@ def get(setting_name: str) -> typing.Any:
 # listed here will be dispatched to the connection's generics.
 changed_settings: list[str] = []
 
+# While settings are gathered, the batch of calls to each remote connection
+# with the futures of their results, see gathered_settings below.
+_gathered_batches: typing.Optional[dict[int, tuple]] = None
+
 
 def set(setting_name: str, value: typing.Any) -> None:
     """
@@ -162,18 +180,63 @@ def set(setting_name: str, value: typing.Any) -> None:
     # if there are no connections yet, only set locally
     if specifics.connection_dict:
         for conn in specifics.connection_dict.values():
-            conn.generics.set_local(setting_name, value)
+            call_gathered(conn, "generics.set_local", setting_name, value)
     else:
         globals()[setting_name] = value
 
 
+def call_gathered(
+    conn: "connection.Connection", function_string: str, *args: typing.Any
+) -> None:
+    """
+    Call the function on the connection, delayed to the end of the
+    gathered_settings with-block if the connection is remote
+    """
+    if _gathered_batches is None or conn is specifics.local_connection:
+        conn.reval(function_string, *args)
+        return
+    if conn.conn_number not in _gathered_batches:
+        _gathered_batches[conn.conn_number] = (conn.batch(), [])
+    batch, futures = _gathered_batches[conn.conn_number]
+    futures.append(batch.call(function_string, *args))
+
+
+@contextlib.contextmanager
+def gathered_settings() -> typing.Iterator[None]:
+    """
+    Gather the settings set within the with-block, and send them to each
+    remote connection in a single batch when leaving it
+
+    The settings are available locally right away, but not remotely before
+    the end of the block.  Other calls setting values remotely can be
+    gathered as well with call_gathered.
+    """
+    global _gathered_batches
+    assert _gathered_batches is None, "Settings are already being gathered"
+    _gathered_batches = {}
+    try:
+        yield
+    finally:
+        batches, _gathered_batches = _gathered_batches, None
+        for batch, futures in batches.values():
+            batch.flush()
+    for batch, futures in batches.values():
+        for future in futures:
+            future.result()  # raise any error which happened remotely
+
+
 def dispatch_settings(conn: "connection.Connection") -> None:
     """
     A function to dispatch all generic settings remembered but not yet dispatched
     to the (assumed new) given connection.
     """
-    for setting_name in changed_settings:
-        conn.generics.set_local(setting_name, get(setting_name))
+    with conn.batch() as batch:
+        futures = [
+            batch.call("generics.set_local", setting_name, get(setting_name))
+            for setting_name in changed_settings
+        ]
+    for future in futures:
+        future.result()  # raise any error which happened remotely
 
 
 # @API(set_local, 200)
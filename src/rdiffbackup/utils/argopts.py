@@ -18,7 +18,7 @@
 # 02110-1301, USA
 
 """
-Definition of custom argparse options actions.
+Definition of custom argparse options actions and types.
 """
 
 import argparse
@@ -139,3 +139,20 @@ class SelectAction(argparse.Action):
         setattr(
             namespace, self.dest, old_list + [(option_string.replace("--", ""), values)]
         )
+
+
+def non_negative_int(value: str) -> int:
+    """
+    argparse type function converting value to an integer of zero or more
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid integer value: '{va}'".format(va=value)
+        )
+    if number < 0:
+        raise argparse.ArgumentTypeError(
+            "value must be zero or more, not {nr}".format(nr=number)
+        )
+    return number
@@ -0,0 +1,166 @@
+# Copyright 2026 the rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA
+"""
+Registry of the codecs able to compress and decompress files
+
+Each codec is known by its name and by the suffix of the files it writes.
+The codecs of the standard library are always available, the others only
+if the Python module they rely on can be imported.  Codecs are known even
+if they aren't available, so that their files can at least be recognized.
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import typing
+
+from rdiffbackup.utils import parallel
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+DEFAULT = "gzip"
+
+Path = typing.Union[str, bytes, os.PathLike]
+Mode = typing.Literal["rb", "wb"]
+
+
+class CompressedFile(typing.Protocol):
+    """The file objects opened by the codecs, for reading or for writing"""
+
+    def read(self, size: int = -1, /) -> bytes:
+        """Return up to size bytes of uncompressed data, all if negative"""
+
+    def write(self, data: bytes, /) -> int:
+        """Compress and write the data, return its length"""
+
+    def close(self) -> None:
+        """Flush and close the file"""
+
+
+def _open_gzip(path: Path, mode: Mode, threads: int = 0) -> CompressedFile:
+    """Open a gzip file, written in parallel threads if requested"""
+    if threads and mode == "wb":
+        return parallel.GzipWriter(path, threads)
+    return gzip.GzipFile(path, mode)
+
+
+def _open_bzip2(path: Path, mode: Mode, threads: int = 0) -> CompressedFile:
+    return bz2.BZ2File(path, mode)
+
+
+def _open_xz(path: Path, mode: Mode, threads: int = 0) -> CompressedFile:
+    return lzma.LZMAFile(path, mode)
+
+
+def _open_zstd(path: Path, mode: Mode, threads: int = 0) -> CompressedFile:
+    if mode == "wb":
+        return zstandard.open(
+            path, mode, cctx=zstandard.ZstdCompressor(threads=threads)
+        )
+    return zstandard.open(path, mode)
+
+
+def _open_lz4(path: Path, mode: Mode, threads: int = 0) -> CompressedFile:
+    return lz4_frame.open(path, mode)
+
+
+# the codecs by name, the classes being the types of the file objects opened,
+# the optional codecs have no open function if their module is missing
+_CODECS: dict[str, dict] = {
+    "gzip": {
+        "suffix": b"gz",
+        "open": _open_gzip,
+        "classes": (gzip.GzipFile, parallel.GzipWriter),
+    },
+    "bzip2": {"suffix": b"bz2", "open": _open_bzip2, "classes": (bz2.BZ2File,)},
+    "xz": {"suffix": b"xz", "open": _open_xz, "classes": (lzma.LZMAFile,)},
+    "zstd": {
+        "suffix": b"zst",
+        "open": zstandard and _open_zstd,
+        "classes": zstandard
+        and (zstandard.ZstdCompressionWriter, zstandard.ZstdDecompressionReader)
+        or (),
+    },
+    "lz4": {
+        "suffix": b"lz4",
+        "open": lz4_frame and _open_lz4,
+        "classes": lz4_frame and (lz4_frame.LZ4FrameFile,) or (),
+    },
+}
+
+_NAMES_BY_SUFFIX = {codec["suffix"]: name for name, codec in _CODECS.items()}
+_FILE_CLASSES = tuple(cls for codec in _CODECS.values() for cls in codec["classes"])
+
+
+def get_names() -> list[str]:
+    """Return the names of all known codecs"""
+    return list(_CODECS)
+
+
+def get_available_names() -> list[str]:
+    """Return the names of the codecs which can be used"""
+    return [name for name, codec in _CODECS.items() if codec["open"]]
+
+
+def is_available(name: str) -> bool:
+    """Return True if the codec of the given name can be used"""
+    return name in _CODECS and _CODECS[name]["open"] is not None
+
+
+def get_suffix(name: str) -> bytes:
+    """Return the file suffix (without dot) of the codec of the given name"""
+    return _CODECS[name]["suffix"]
+
+
+def get_name(suffix: bytes) -> typing.Optional[str]:
+    """Return the name of the codec writing the given suffix, or None"""
+    return _NAMES_BY_SUFFIX.get(suffix)
+
+
+def open_file(
+    path: Path, mode: str, name: str = DEFAULT, threads: int = 0
+) -> CompressedFile:
+    """
+    Open the file at path for binary reading ("r") or writing ("w")
+
+    The data is compressed or decompressed on the fly using the codec of
+    the given name, with threads compressing in parallel if the codec
+    supports it.  OSError is raised if the codec isn't available.
+    """
+    if not is_available(name):
+        raise OSError(
+            "Compression codec '{cn}' of file '{fi}' isn't available, the "
+            "Python module it needs can't be imported".format(
+                cn=name, fi=os.fsdecode(path)
+            )
+        )
+    return _CODECS[name]["open"](path, mode[0] + "b", threads)
+
+
+def is_compressed_file(fileobj: typing.Any) -> bool:
+    """Return True if the file object was opened by one of the codecs"""
+    return isinstance(fileobj, _FILE_CLASSES)
@@ -0,0 +1,260 @@
+# Copyright 2026 the rdiff-backup project
+#
+# This file is part of rdiff-backup.
+#
+# rdiff-backup is free software; you can redistribute it and/or modify
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# rdiff-backup is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rdiff-backup; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA
+"""
+Helpers to offload work to a pool of workers while keeping the order of items
+"""
+
+import collections
+import concurrent.futures
+import io
+import os
+import typing
+import zlib
+
+Item = typing.TypeVar("Item")
+
+# a task is a tuple made of a function followed by its arguments
+Task = typing.Optional[tuple]
+
+# exceptions of futures due to the pool of workers and not to the task itself
+WORKER_ERRORS = (concurrent.futures.BrokenExecutor,)
+
+
+def imap_ordered(
+    items: typing.Iterable[Item],
+    get_task: typing.Callable[[Item], Task],
+    jobs: int,
+    window: typing.Optional[int] = None,
+    threads: bool = False,
+) -> typing.Iterator[tuple[Item, typing.Optional[concurrent.futures.Future]]]:
+    """
+    Yield tuples of (item, future) in the same order as the input items
+
+    get_task is called in the current process for each item and returns
+    either None, if the item doesn't need any work, or a tuple made of a
+    function and its arguments, which is then called by one of the workers.
+    The future is None for items without task, else the caller can get the
+    result (or the exception raised) through the future's result method.
+
+    At most window items (default twice the number of jobs) are read ahead of
+    the item being yielded, so that callers relying on caches of limited size
+    (like the rorp caches of the backup pipeline) keep working.
+    The functions and arguments must be picklable unless threads are used.
+    If the pool of workers breaks, e.g. because a worker process was killed,
+    the futures of the tasks submitted until then hold one of the
+    WORKER_ERRORS and the following items are yielded without future.
+    """
+    if window is None:
+        window = 2 * jobs
+    window = max(window, 1)
+    executor_class: type[concurrent.futures.Executor]
+    if threads:
+        executor_class = concurrent.futures.ThreadPoolExecutor
+    else:
+        executor_class = concurrent.futures.ProcessPoolExecutor
+    pending: collections.deque = collections.deque()
+    broken = False
+    with executor_class(max_workers=jobs) as executor:
+        for item in items:
+            task = get_task(item)
+            future = None
+            if task and not broken:
+                try:
+                    future = executor.submit(*task)
+                except WORKER_ERRORS:
+                    broken = True
+            pending.append((item, future))
+            while len(pending) > window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+class ThreadTasks:
+    """
+    Run tasks in a pool of threads, with a limited number of pending tasks
+
+    The tasks' results are ignored but exceptions raised by the tasks are
+    re-raised in the current thread, at the latest when waiting for all
+    pending tasks.  At most twice as many tasks as threads are pending at
+    the same time, submitting more blocks until the oldest one is done.
+    """
+
+    def __init__(self, threads: int):
+        self._window = 2 * threads
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="rdb-task"
+        )
+        self._pending: collections.deque = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, func: typing.Callable, *args) -> None:
+        """Run func with the given arguments in one of the threads"""
+        self._pending.append(self._executor.submit(func, *args))
+        while self._pending and (
+            len(self._pending) > self._window or self._pending[0].done()
+        ):
+            self._pending.popleft().result()
+
+    def wait(self) -> None:
+        """Wait until all pending tasks are done"""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def close(self) -> None:
+        """Wait for the pending tasks and stop the threads"""
+        try:
+            self.wait()
+        finally:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown()
+
+
+class GzipWriter:
+    """
+    Write-only file object compressing data in parallel threads
+
+    The data written is cut into blocks, which are compressed independently
+    from each other as separate gzip members by a pool of threads, zlib
+    releasing the GIL while compressing.  A file made of several members is
+    a standard gzip file, read by gzip.GzipFile (or gunzip) as if it was made
+    of one single member.
+
+    At most twice as many blocks as threads are waiting to be compressed or
+    written at the same time, which limits the memory used.  The thread pool
+    is shared by all writers using the same number of threads.
+    """
+
+    blocksize = 1024 * 1024  # size of uncompressed blocks
+
+    def __init__(
+        self, path: typing.Union[str, bytes, os.PathLike], threads: int, level: int = 9
+    ):
+        self.fileobj = open(path, "wb")
+        self.name = self.fileobj.name
+        self.closed = False
+        self._level = level
+        self._window = 2 * threads
+        self._executor = _get_thread_pool(threads)
+        self._buffer = bytearray()
+        self._pending: collections.deque = collections.deque()
+        self._members = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data) -> int:
+        """Write the given bytes-like data, return its length"""
+        self._buffer += data
+        while len(self._buffer) >= self.blocksize:
+            self._submit(bytes(self._buffer[: self.blocksize]))
+            del self._buffer[: self.blocksize]
+        return len(data)
+
+    def flush(self) -> None:
+        """Compress and write all the data written so far"""
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        self._write_members(0)
+        self.fileobj.flush()
+
+    def close(self) -> None:
+        """Write the remaining data and close the file"""
+        if self.closed:
+            return
+        try:
+            if self._buffer or not self._members:
+                # without pending block, it's faster to compress directly
+                if self._pending:
+                    self._submit(bytes(self._buffer))
+                else:
+                    self._members += 1
+                    self.fileobj.write(_compress_member(self._buffer, self._level))
+                self._buffer.clear()
+            self._write_members(0)
+        finally:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self.closed = True
+            self.fileobj.close()
+
+    def fileno(self) -> int:
+        return self.fileobj.fileno()
+
+    def read(self, size: int = -1) -> bytes:
+        raise io.UnsupportedOperation("read")
+
+    def readable(self) -> bool:
+        return False
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def _submit(self, block: bytes) -> None:
+        """Offload the compression of a block, write the finished ones"""
+        self._members += 1
+        self._pending.append(
+            self._executor.submit(_compress_member, block, self._level)
+        )
+        self._write_members(self._window)
+
+    def _write_members(self, max_pending: int) -> None:
+        """
+        Write compressed members in order
+
+        Members already compressed are always written, and the writer waits
+        for the next ones until no more than max_pending blocks are pending.
+        """
+        while self._pending and (
+            len(self._pending) > max_pending or self._pending[0].done()
+        ):
+            self.fileobj.write(self._pending.popleft().result())
+
+
+_thread_pools: dict[int, concurrent.futures.ThreadPoolExecutor] = {}
+
+
+def _get_thread_pool(threads: int) -> concurrent.futures.ThreadPoolExecutor:
+    """Return the thread pool shared by all users of the given size"""
+    if threads not in _thread_pools:
+        _thread_pools[threads] = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="rdb-gzip"
+        )
+    return _thread_pools[threads]
+
+
+def _compress_member(data: typing.Union[bytes, bytearray], level: int) -> bytes:
+    """Return the data compressed as complete gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
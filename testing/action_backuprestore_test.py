@@ -147,6 +147,65 @@ class ActionBackupRestoreTest(unittest.TestCase):
         # all tests were successful
         self.success = True
 
+    def test_action_restore_jobs(self):
+        """test the "restore" action with parallel jobs"""
+        for from_path, current_time in (
+            (self.from1_path, "10000"),
+            (self.from2_path, "20000"),
+        ):
+            self.assertEqual(
+                comtst.rdiff_backup_action(
+                    True,
+                    True,
+                    from_path,
+                    self.bak_path,
+                    ("--current-time", current_time),
+                    b"backup",
+                    (),
+                ),
+                0,
+            )
+        # locally, files are restored in processes and written in threads
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True,
+                True,
+                self.bak_path,
+                self.to1_path,
+                (),
+                b"restore",
+                ("--at", "1B", "--jobs", "3"),
+            ),
+            0,
+        )
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                False,
+                True,
+                self.bak_path,
+                self.to2_path,
+                (),
+                b"restore",
+                ("--at", "1B", "--jobs", "2"),
+            ),
+            0,
+        )
+        self.assertNotEqual(
+            comtst.rdiff_backup_action(
+                True,
+                True,
+                self.bak_path,
+                self.to3_path,
+                (),
+                b"restore",
+                ("--jobs", "0"),
+            ),
+            0,
+        )
+        self.assertFalse(fileset.compare_paths(self.from1_path, self.to1_path))
+        self.assertFalse(fileset.compare_paths(self.from1_path, self.to2_path))
+        self.success = True
+
     def test_action_backup_errorcases(self):
         """test the "backup" actions in error cases"""
         # we backup twice to the same backup repository at different times
@@ -198,6 +257,18 @@ class ActionBackupRestoreTest(unittest.TestCase):
             ),
             0,
         )  # redundant inclusion
+        self.assertNotEqual(
+            comtst.rdiff_backup_action(
+                False,
+                True,
+                self.from2_path,
+                self.bak_path,
+                ("--current-time", "20002"),
+                b"backup",
+                ("--jobs", "2", "--scan-threads", "2"),
+            ),
+            0,
+        )  # forked jobs and threads
 
     def test_action_restore_errorcases(self):
         """test the "restore" actions in error cases"""
@@ -499,6 +570,163 @@ class PreQuotingTest(unittest.TestCase):
             fileset.remove_fileset(self.base_dir, {"to2": {"type": "dir"}})
 
 
+class DetectMovesTest(unittest.TestCase):
+    """
+    Test that moved, copied and similar files are backed-up and restored
+    correctly
+    """
+
+    def setUp(self):
+        self.base_dir = os.path.join(TEST_BASE_DIR, b"action_detect_moves")
+        big_a = {"content": "some big content\n" * 5000, "mtime": 10_000}
+        big_b = {"content": "other big content\n" * 5000, "mtime": 10_000}
+        big_c = {"content": "third big content\n" * 5000, "mtime": 10_000}
+        big_d = {"content": "fourth big content\n" * 5000, "mtime": 10_000}
+        self.from1_struct = {
+            "from1": {
+                "contents": {
+                    "app.log.1": {"content": "log line\n" * 10000},
+                    "bfile": big_d,
+                    "mdir": {"contents": {"fileA": big_a, "fileB": big_b}},
+                    "zfile": big_c,
+                }
+            }
+        }
+        # the directory and zfile are renamed before their old name, bfile
+        # after it, and fileB is copied and changed in place, the log is
+        # rotated and extended
+        self.from2_struct = {
+            "from2": {
+                "contents": {
+                    "app.log.2": {"content": "log line\n" * 12000},
+                    "adir": {"contents": {"fileA": big_a, "fileB": big_b}},
+                    "mfile": big_c,
+                    "mdir": {"contents": {"fileB": {"content": "changed"}}},
+                    "yfile": big_d,
+                }
+            }
+        }
+        self.from1_path = os.path.join(self.base_dir, b"from1")
+        self.from2_path = os.path.join(self.base_dir, b"from2")
+        fileset.create_fileset(self.base_dir, self.from1_struct)
+        fileset.create_fileset(self.base_dir, self.from2_struct)
+        fileset.remove_fileset(self.base_dir, {"bak": {"type": "dir"}})
+        fileset.remove_fileset(self.base_dir, {"to1": {"type": "dir"}})
+        fileset.remove_fileset(self.base_dir, {"to2": {"type": "dir"}})
+        self.bak_path = os.path.join(self.base_dir, b"bak")
+        self.to1_path = os.path.join(self.base_dir, b"to1")
+        self.to2_path = os.path.join(self.base_dir, b"to2")
+        self.success = False
+
+    def test_detect_moves(self):
+        """test a backup detecting moved files"""
+        self._backup_restore(
+            {
+                (b"adir", b"fileA"): (b"mdir", b"fileA"),
+                (b"adir", b"fileB"): (b"mdir", b"fileB"),
+                (b"mfile",): (b"zfile",),
+                (b"yfile",): (b"bfile",),
+            },
+            "--detect-moves",
+        )
+        self.success = True
+
+    def test_similar_basis(self):
+        """test a backup searching for similar files"""
+        self._backup_restore(
+            {
+                (b"adir", b"fileA"): (b"mdir", b"fileA"),
+                (b"adir", b"fileB"): (b"mdir", b"fileB"),
+                (b"app.log.2",): (b"app.log.1",),
+            },
+            "--similar-basis",
+        )
+        self.success = True
+
+    def test_detect_moves_similar_basis(self):
+        """test a backup detecting moved files and similar files"""
+        self._backup_restore(
+            {
+                (b"adir", b"fileA"): (b"mdir", b"fileA"),
+                (b"adir", b"fileB"): (b"mdir", b"fileB"),
+                (b"app.log.2",): (b"app.log.1",),
+                (b"mfile",): (b"zfile",),
+                (b"yfile",): (b"bfile",),
+            },
+            "--detect-moves",
+            "--similar-basis",
+        )
+        self.success = True
+
+    def _backup_restore(self, bases, *options):
+        """
+        backup both directories with options, restore and compare them
+
+        bases maps the indexes of new files to the ones of the files they must
+        have been sent as diff against, as told by the log of the 2nd backup.
+        """
+        fileset.remove_fileset(self.base_dir, {"bak": {"type": "dir"}})
+        fileset.remove_fileset(self.base_dir, {"to1": {"type": "dir"}})
+        fileset.remove_fileset(self.base_dir, {"to2": {"type": "dir"}})
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True,
+                True,
+                self.from1_path,
+                self.bak_path,
+                ("--current-time", "10000"),
+                b"backup",
+                options,
+            ),
+            0,
+        )
+        output = comtst.rdiff_backup_action(
+            True,
+            True,
+            self.from2_path,
+            self.bak_path,
+            ("--current-time", "20000", "-v5"),
+            b"backup",
+            options,
+            return_stderr=True,
+        )
+        output = b" ".join(output.split())  # log messages are wrapped
+        for new_index, basis_index in bases.items():
+            self.assertIn(
+                b"New file %s is sent as diff against %s"
+                % (
+                    os.path.join(self.from2_path, *new_index),
+                    os.path.join(self.bak_path, *basis_index),
+                ),
+                output,
+            )
+        self.assertNotIn(b"ERROR:", output)
+        for to_path, at_time in ((self.to1_path, "10000"), (self.to2_path, "now")):
+            self.assertEqual(
+                comtst.rdiff_backup_action(
+                    True,
+                    True,
+                    self.bak_path,
+                    to_path,
+                    (),
+                    b"restore",
+                    ("--at", at_time),
+                ),
+                0,
+            )
+        self.assertFalse(fileset.compare_paths(self.from1_path, self.to1_path))
+        self.assertFalse(fileset.compare_paths(self.from2_path, self.to2_path))
+
+    def tearDown(self):
+        # we clean-up only if the test was successful
+        if self.success:
+            fileset.remove_fileset(self.base_dir, self.from1_struct)
+            fileset.remove_fileset(self.base_dir, self.from2_struct)
+            fileset.remove_fileset(self.base_dir, {"bak": {"type": "dir"}})
+            fileset.remove_fileset(self.base_dir, {"to1": {"type": "dir"}})
+            fileset.remove_fileset(self.base_dir, {"to2": {"type": "dir"}})
+
+
 class ConnectionHandlingTest(unittest.TestCase):
     """
     Test handling of wrong connection
@@ -8,6 +8,7 @@ import unittest
 import commontest as comtst
 import fileset
 
+from rdiffbackup.locations import stat_cache
 from rdiffbackup.singletons import consts
 
 TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
@@ -225,6 +226,71 @@ class ActionCompareTest(unittest.TestCase):
         # all tests were successful
         self.success = True
 
+    def test_action_compare_hash_cache(self):
+        """test that the source hash cache is filled and used"""
+        cache_path = os.path.join(self.base_dir, b"hash_cache.gz")
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+        def get_cached_names():
+            cache = stat_cache.HashCache(cache_path, self.from1_path)
+            names = set()
+            while cache._old_record is not None:
+                names.add(cache._old_record[0][-1])
+                cache._old_record = cache._read_old_record()
+            cache.close()
+            return names
+
+        # the backup only reads, hence caches, the changed and new files
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True,
+                True,
+                self.from1_path,
+                self.bak_path,
+                ("--current-time", "30000"),
+                b"backup",
+                ("--source-hash-cache", cache_path),
+            ),
+            0,
+        )
+        self.assertEqual(get_cached_names(), {b"fileChanged", b"fileOld"})
+        for remote in (False, True):
+            self.assertEqual(
+                comtst.rdiff_backup_action(
+                    remote,
+                    True,
+                    self.from1_path,
+                    self.bak_path,
+                    (),
+                    b"compare",
+                    ("--method", "hash", "--source-hash-cache", cache_path),
+                ),
+                0,
+            )
+        self.assertEqual(
+            get_cached_names(), {b"fileChanged", b"fileOld", b"fileUnchanged"}
+        )
+        # a changed file isn't taken from the cache
+        changed_path = os.path.join(self.from1_path, b"fileChanged")
+        with open(changed_path, "w") as changed_fd:
+            changed_fd.write("INITIAL")
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True,
+                True,
+                self.from1_path,
+                self.bak_path,
+                (),
+                b"compare",
+                ("--method", "hash", "--source-hash-cache", cache_path),
+            ),
+            consts.RET_CODE_FILE_WARN,
+        )
+
+        # all tests were successful
+        self.success = True
+
     def tearDown(self):
         # we clean-up only if the test was successful
         if self.success:
@@ -133,7 +133,8 @@ class ActionCompleteTest(unittest.TestCase):
             return_stdout=True,
         )
         self.assertTrue(full_output.startswith(b"-V"))  # fragile!
-        self.assertTrue(full_output.endswith(b"--version\n"))
+        self.assertTrue(full_output.endswith(b"--wire-compression\n"))
+        self.assertIn(b"--version\n", full_output)
         self.assertIn(b"complete\n", full_output)
         self.assertIn(b"backup\n", full_output)
 
@@ -149,7 +150,8 @@ class ActionCompleteTest(unittest.TestCase):
             return_stdout=True,
         )
         self.assertTrue(full_output.startswith(b"-V"))  # fragile!
-        self.assertTrue(full_output.endswith(b"--version\n"))
+        self.assertTrue(full_output.endswith(b"--wire-compression\n"))
+        self.assertIn(b"--version\n", full_output)
         self.assertNotIn(b"complete\n", full_output)
         self.assertNotIn(b"backup\n", full_output)
 
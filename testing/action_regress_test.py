@@ -4,6 +4,7 @@ Test the regress action
 
 import os
 import unittest
+from unittest import mock
 
 import commontest as comtst
 import fileset
@@ -193,6 +194,205 @@ class ActionRegressTest(unittest.TestCase):
         # all tests were successful
         self.success = True
 
+    def test_action_regress_journal(self):
+        """test regressing only the paths recorded by the failed backup"""
+        bak_rp = rpath.RPath(specifics.local_connection, self.bak_path)
+        journal_rp = bak_rp.append(
+            b"rdiff-backup-data", _repo_shadow._RegressJournal.NAME
+        )
+        self.assertFalse(journal_rp.lstat())  # removed by successful backups
+        # we simulate a crash of the last backup with its journal
+        _repo_shadow.RepoShadow.init(bak_rp, {}, True, True)
+        _repo_shadow.RepoShadow.touch_current_mirror(20000)
+        journal = _repo_shadow._RegressJournal(journal_rp, bak_rp)
+        journal.open(30000)
+        for index in ((), (b"fileChanged",), (b"itemX",), (b"itemY",)):
+            journal.add_index(index)
+        temp_rp = bak_rp.append(b"fileChanged").get_temp_rpath(sibling=True)
+        journal.add_temp(temp_rp)
+        temp_rp.write_string("partial")
+        journal._fp.close()
+        self.assertIn(
+            b"Regressing only the paths recorded in journal",
+            comtst.rdiff_backup_action(
+                True,
+                None,
+                self.bak_path,
+                None,
+                ("--force",),
+                b"regress",
+                (),
+                return_stdout=True,
+            ),
+        )
+        temp_rp.setdata()
+        self.assertFalse(temp_rp.lstat())
+        journal_rp.setdata()
+        self.assertFalse(journal_rp.lstat())
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True, True, self.bak_path, self.to2_path, (), b"restore", ()
+            ),
+            consts.RET_CODE_OK,
+        )
+        self.assertFalse(fileset.compare_paths(self.from2_path, self.to2_path))
+
+        # a journal of another backup session is ignored
+        _repo_shadow.RepoShadow.touch_current_mirror(10000)
+        journal.open(30000)
+        journal.add_index(())
+        journal._fp.close()
+        self.assertNotIn(
+            b"Regressing only the paths recorded in journal",
+            comtst.rdiff_backup_action(
+                True,
+                None,
+                self.bak_path,
+                None,
+                ("--force",),
+                b"regress",
+                (),
+                return_stdout=True,
+            ),
+        )
+        journal_rp.setdata()
+        self.assertFalse(journal_rp.lstat())
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True, True, self.bak_path, self.to1_path, (), b"restore", ()
+            ),
+            consts.RET_CODE_OK,
+        )
+        self.assertFalse(fileset.compare_paths(self.from1_path, self.to1_path))
+
+        # all tests were successful
+        self.success = True
+
+    def test_action_regress_resume(self):
+        """test resuming from the files transferred by a failed backup"""
+        bak_rp = rpath.RPath(specifics.local_connection, self.bak_path)
+        journal_rp = bak_rp.append(
+            b"rdiff-backup-data", _repo_shadow._RegressJournal.NAME
+        )
+        stash_rp = bak_rp.append(b"rdiff-backup-data", _repo_shadow._ResumeStash.NAME)
+        with open(os.path.join(self.from4_path, b"fileChanged"), "w") as fd:
+            fd.write("modified again and transferred")
+        with open(os.path.join(self.from4_path, b"fileEvenNewer"), "w") as fd:
+            fd.write("partially transferred and more")
+        # we simulate a crash of the backup after one file was completely
+        # transferred and another one partially
+        _repo_shadow.RepoShadow.init(bak_rp, {}, True, True)
+        _repo_shadow.RepoShadow.touch_current_mirror(40000)
+        journal = _repo_shadow._RegressJournal(journal_rp, bak_rp)
+        journal.open(40000)
+        for index in ((), (b"fileChanged",), (b"fileEvenNewer",)):
+            journal.add_index(index)
+        temp_rp = bak_rp.append(b"fileEvenNewer").get_temp_rpath(sibling=True)
+        journal.add_temp(temp_rp)
+        temp_rp.write_string("partially transferred")
+        journal._fp.close()
+        with open(os.path.join(self.bak_path, b"fileChanged"), "w") as fd:
+            fd.write("modified again and transferred")
+        output = comtst.rdiff_backup_action(
+            True,
+            True,
+            self.from4_path,
+            self.bak_path,
+            ("--current-time", "40000", "--force"),
+            b"backup",
+            ("--resume",),
+            return_stdout=True,
+        )
+        self.assertIn(b"2 files transferred by the failed backup are kept", output)
+        self.assertIn(
+            b"2 files were sent as diff against the data kept from the failed",
+            output,
+        )
+        stash_rp.setdata()
+        self.assertFalse(stash_rp.lstat())
+        temp_rp.setdata()
+        self.assertFalse(temp_rp.lstat())
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True, True, self.bak_path, self.to4_path, (), b"restore", ()
+            ),
+            consts.RET_CODE_OK,
+        )
+        self.assertFalse(fileset.compare_paths(self.from4_path, self.to4_path))
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True,
+                True,
+                self.bak_path,
+                self.to2_path,
+                (),
+                b"restore",
+                ("--at", "20000"),
+            ),
+            consts.RET_CODE_OK,
+        )
+        self.assertFalse(fileset.compare_paths(self.from2_path, self.to2_path))
+
+        # all tests were successful
+        self.success = True
+
+    def test_resume_stash(self):
+        """test keeping the temporary files of a valid journal only"""
+        bak_rp = rpath.RPath(specifics.local_connection, self.bak_path)
+        journal_rp = bak_rp.append(
+            b"rdiff-backup-data", _repo_shadow._RegressJournal.NAME
+        )
+        stash = _repo_shadow._ResumeStash(
+            bak_rp.append(b"rdiff-backup-data", _repo_shadow._ResumeStash.NAME),
+            bak_rp,
+        )
+        journal = _repo_shadow._RegressJournal(journal_rp, bak_rp)
+        temp_rp = bak_rp.append(b"fileChanged").get_temp_rpath(sibling=True)
+        # the journal of another backup session is left alone
+        journal.open(30000)
+        journal.add_index((b"fileChanged",))
+        journal.add_temp(temp_rp)
+        journal._fp.close()
+        temp_rp.write_string("partial")
+        journal.stash_temps(stash, 40000)
+        self.assertNotIn((b"fileChanged",), stash)
+        temp_rp.setdata()
+        self.assertTrue(temp_rp.lstat())
+
+        # the partial file is completed with the mirror file, holes included
+        block = consts.BLOCKSIZE
+        mirror_data = b"mirror" + b"\0" * (2 * block) + b"end" + b"\0" * block
+        with open(os.path.join(self.bak_path, b"fileChanged"), "wb") as fd:
+            fd.write(mirror_data)
+        journal.stash_temps(stash, 30000)
+        self.assertIn((b"fileChanged",), stash)
+        temp_rp.setdata()
+        self.assertFalse(temp_rp.lstat())
+        basis_rp = stash._get_basis_rp((b"fileChanged",))
+        self.assertEqual(basis_rp.get_bytes(), b"partial" + mirror_data)
+        stash.close()
+
+        # a journal with a temporary path outside of the mirror is rejected
+        outside_path = os.path.join(self.base_dir, b"outside")
+        for temp_path in (
+            outside_path,
+            os.path.join(b"itemY", b"..", b"..", b"outside"),
+        ):
+            with open(outside_path, "w") as fd:
+                fd.write("not to be removed")
+            journal.open(30000)
+            journal.add_index((b"fileChanged",))
+            journal._write_fields(journal._TEMP + temp_path)
+            journal._fp.close()
+            journal.stash_temps(stash, 30000)
+            self.assertIsNone(journal.prepare(30000))
+            self.assertTrue(os.path.exists(outside_path))
+        os.remove(outside_path)
+        journal.remove()
+
+        # all tests were successful
+        self.success = True
+
     def test_forced_regress(self):
         """test different ways of regressing even if not necessary"""
         # regressing a successful backup with force simply removes it
@@ -241,5 +441,140 @@ class ActionRegressTest(unittest.TestCase):
             fileset.remove_fileset(self.base_dir, {"to4": {"type": "dir"}})
 
 
+class GroupCommitTest(unittest.TestCase):
+    """
+    Test that backups with grouped commits can be restored and regressed
+    """
+
+    def setUp(self):
+        self.base_dir = os.path.join(TEST_BASE_DIR, b"action_group_commit")
+        self.from1_struct = {
+            "from1": {
+                "contents": {
+                    "dirA": {
+                        "contents": {
+                            "fileA1": {"content": "initial"},
+                            "fileA2": {"content": "initial"},
+                            "fileA3": {"content": "initial"},
+                        }
+                    },
+                    "fileB": {"content": "initial"},
+                    "fileC": {"content": "initial"},
+                    "fileD": {"content": "initial"},
+                }
+            }
+        }
+        self.from2_struct = {
+            "from2": {
+                "contents": {
+                    "dirA": {
+                        "contents": {
+                            "fileA1": {"content": "modified"},
+                            "fileA3": {"content": "modified"},
+                        }
+                    },
+                    "fileB": {"content": "modified"},
+                    "fileC": {"content": "initial"},
+                    "fileD": {"type": "dir"},  # replaces a file
+                }
+            }
+        }
+        fileset.create_fileset(self.base_dir, self.from1_struct)
+        fileset.create_fileset(self.base_dir, self.from2_struct)
+        fileset.remove_fileset(self.base_dir, {"bak": {"type": "dir"}})
+        fileset.remove_fileset(self.base_dir, {"to1": {"type": "dir"}})
+        self.from1_path = os.path.join(self.base_dir, b"from1")
+        self.from2_path = os.path.join(self.base_dir, b"from2")
+        self.bak_path = os.path.join(self.base_dir, b"bak")
+        self.to1_path = os.path.join(self.base_dir, b"to1")
+        self.success = False
+
+    def test_group_commit_backup(self):
+        """test that a backup with grouped commits is complete"""
+        for from_path, current_time in (
+            (self.from1_path, "10000"),
+            (self.from2_path, "20000"),
+        ):
+            self.assertEqual(
+                comtst.rdiff_backup_action(
+                    True,
+                    True,
+                    from_path,
+                    self.bak_path,
+                    ("--current-time", current_time),
+                    b"backup",
+                    ("--group-commit", "2"),
+                ),
+                consts.RET_CODE_OK,
+            )
+        journal_path = os.path.join(
+            self.bak_path, b"rdiff-backup-data", _repo_shadow._GroupCommit.JOURNAL_NAME
+        )
+        self.assertFalse(os.path.exists(journal_path))
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True,
+                True,
+                self.bak_path,
+                self.to1_path,
+                (),
+                b"restore",
+                ("--at", "10000"),
+            ),
+            consts.RET_CODE_OK,
+        )
+        self.assertFalse(fileset.compare_paths(self.from1_path, self.to1_path))
+        self.success = True
+
+    def test_group_commit_journal(self):
+        """test that changes are only applied once committed"""
+        dir_rp = rpath.RPath(specifics.local_connection, self.from1_path)
+        journal_rp = dir_rp.append(_repo_shadow._GroupCommit.JOURNAL_NAME)
+        ccpp = mock.Mock()
+        group = _repo_shadow._GroupCommit(ccpp, journal_rp, 3)
+        for name in (b"fileB", b"fileC"):
+            mirror_rp = dir_rp.append(name)
+            temp_rp = mirror_rp.get_temp_rpath(sibling=True)
+            temp_rp.write_string("changed")
+            group.add((name,), temp_rp, mirror_rp)
+        self.assertIn((b"fileB",), group)
+        self.assertEqual(dir_rp.append(b"fileB").get_string(), "initial")
+        self.assertFalse(journal_rp.lstat())
+
+        group.commit_dir((b"dirA",))  # nothing pending in this directory
+        ccpp.flag_success.assert_not_called()
+        group.commit_dir(())
+        self.assertEqual(dir_rp.append(b"fileB").get_string(), "changed")
+        self.assertEqual(ccpp.flag_success.call_count, 2)
+        self.assertNotIn((b"fileB",), group)
+
+        # an interrupted group leaves its temporary files behind
+        mirror_rp = dir_rp.append(b"dirA", b"fileA2")
+        group.add((b"dirA", b"fileA2"), None, mirror_rp)
+        temp_rp = mirror_rp.get_temp_rpath(sibling=True)
+        temp_rp.write_string("changed")
+        group.add((b"dirA", b"fileA1"), temp_rp, dir_rp.append(b"dirA", b"fileA1"))
+        with mock.patch.object(_repo_shadow.rpath, "rename", side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                group.commit()
+        self.assertFalse(mirror_rp.lstat())
+        ccpp.flag_deleted.assert_called_once_with((b"dirA", b"fileA2"))
+        temp_rp.setdata()
+        self.assertTrue(temp_rp.lstat())
+        _repo_shadow._GroupCommit.regress(journal_rp)
+        temp_rp.setdata()
+        self.assertFalse(temp_rp.lstat())
+        self.assertFalse(journal_rp.lstat())
+        self.success = True
+
+    def tearDown(self):
+        # we clean-up only if the test was successful
+        if self.success:
+            fileset.remove_fileset(self.base_dir, self.from1_struct)
+            fileset.remove_fileset(self.base_dir, self.from2_struct)
+            fileset.remove_fileset(self.base_dir, {"bak": {"type": "dir"}})
+            fileset.remove_fileset(self.base_dir, {"to1": {"type": "dir"}})
+
+
 if __name__ == "__main__":
     unittest.main()
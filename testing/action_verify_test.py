@@ -98,6 +98,196 @@ class ActionVerifyTest(unittest.TestCase):
         # all tests were successful
         self.success = True
 
+    def test_action_verify_jobs_resume(self):
+        """test verifying in parallel and resuming a verification"""
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True, None, self.bak_path, None, (), b"verify", ("--jobs", "3")
+            ),
+            0,
+        )
+        # corrupt the backup repository
+        with open(os.path.join(self.bak_path, b"fileChanged"), "w") as fd:
+            fd.write("corrupt data")
+        self.assertNotEqual(
+            comtst.rdiff_backup_action(
+                True, None, self.bak_path, None, (), b"verify", ("--jobs", "3")
+            ),
+            0,
+        )
+        # pretend that a verification was interrupted after the corrupt file
+        checkpoint_path = os.path.join(
+            self.bak_path, b"rdiff-backup-data", b"verify_checkpoint"
+        )
+        with open(checkpoint_path, "wb") as fd:
+            fd.write(b"20000\0\0000\0000\0fileChanged")
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True, None, self.bak_path, None, (), b"verify", ()
+            ),
+            0,
+        )
+        self.assertFalse(os.path.exists(checkpoint_path))
+        # the checkpoint of another time is ignored, and so with --no-resume
+        with open(checkpoint_path, "wb") as fd:
+            fd.write(b"10000\0\0000\0000\0fileChanged")
+        self.assertNotEqual(
+            comtst.rdiff_backup_action(
+                True, None, self.bak_path, None, (), b"verify", ()
+            ),
+            0,
+        )
+        with open(checkpoint_path, "wb") as fd:
+            fd.write(b"20000\0\0000\0000\0fileChanged")
+        self.assertNotEqual(
+            comtst.rdiff_backup_action(
+                True, None, self.bak_path, None, (), b"verify", ("--no-resume",)
+            ),
+            0,
+        )
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+        # all tests were successful
+        self.success = True
+
+    def test_action_verify_read_only(self):
+        """test that a read-only repository is verified without writing"""
+        read_only_location = b"%s server --restrict-mode read-only::%s" % (
+            comtst.RBBin,
+            self.bak_path,
+        )
+        with open(os.path.join(self.bak_path, b"fileChanged"), "w") as fd:
+            fd.write("corrupt data")
+        checkpoint_path = os.path.join(
+            self.bak_path, b"rdiff-backup-data", b"verify_checkpoint"
+        )
+        with open(checkpoint_path, "wb") as fd:
+            fd.write(b"20000\0\0000\0000\0fileChanged")
+        # the checkpoint is neither resumed from nor removed
+        for verify_opts in ((), ("--no-resume",)):
+            self.assertNotEqual(
+                comtst.rdiff_backup_action(
+                    True,
+                    None,
+                    read_only_location,
+                    None,
+                    ("--remote-schema", "{h}"),
+                    b"verify",
+                    verify_opts,
+                ),
+                0,
+            )
+            self.assertTrue(os.path.exists(checkpoint_path))
+
+        # the ledger is used to skip files but not updated
+        os.remove(checkpoint_path)
+        ledger_path = os.path.join(
+            self.bak_path, b"rdiff-backup-data", b"verify_ledger"
+        )
+        comtst.rdiff_backup_action(
+            True, None, self.bak_path, None, (), b"verify", ("--incremental",)
+        )
+        with open(ledger_path, "rb") as ledger_fd:
+            ledger_data = ledger_fd.read()
+        ledger_mtime = os.stat(ledger_path).st_mtime_ns
+        data_files = sorted(os.listdir(os.path.dirname(ledger_path)))
+        output = comtst.rdiff_backup_action(
+            True,
+            None,
+            read_only_location,
+            None,
+            ("--remote-schema", "{h}"),
+            b"verify",
+            ("--incremental",),
+            return_stderr=True,
+        )
+        self.assertIn(b"Verification skipped 2 files", output)
+        with open(ledger_path, "rb") as ledger_fd:
+            self.assertEqual(ledger_fd.read(), ledger_data)
+        self.assertEqual(os.stat(ledger_path).st_mtime_ns, ledger_mtime)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(ledger_path))), data_files)
+
+        # all tests were successful
+        self.success = True
+
+    def test_action_verify_incremental(self):
+        """test skipping files verified since they last changed"""
+        ledger_path = os.path.join(
+            self.bak_path, b"rdiff-backup-data", b"verify_ledger"
+        )
+        self.assertEqual(
+            comtst.rdiff_backup_action(
+                True, None, self.bak_path, None, (), b"verify", ("--incremental",)
+            ),
+            0,
+        )
+        self.assertTrue(os.path.exists(ledger_path))
+        self.assertIn(
+            b"Verification skipped 3 files",
+            comtst.rdiff_backup_action(
+                True,
+                None,
+                self.bak_path,
+                None,
+                (),
+                b"verify",
+                ("--incremental", "--jobs", "2"),
+                return_stdout=True,
+            ),
+        )
+        # another time has other increments, hence keys, for changed files
+        self.assertIn(
+            b"Verification skipped 1 files",
+            comtst.rdiff_backup_action(
+                True,
+                None,
+                self.bak_path,
+                None,
+                (),
+                b"verify",
+                ("--incremental", "--at", "10000"),
+                return_stdout=True,
+            ),
+        )
+        # a corrupted file changed and is verified again
+        with open(os.path.join(self.bak_path, b"fileChanged"), "w") as fd:
+            fd.write("corrupt data")
+        self.assertNotEqual(
+            comtst.rdiff_backup_action(
+                True, None, self.bak_path, None, (), b"verify", ("--incremental",)
+            ),
+            0,
+        )
+        # a full verification is done if the last one is too old
+        self.assertNotIn(
+            b"Verification skipped",
+            comtst.rdiff_backup_action(
+                True,
+                None,
+                self.bak_path,
+                None,
+                (),
+                b"verify",
+                ("--incremental", "--full-older-than", "now"),
+                return_stdout=True,
+            ),
+        )
+        self.assertNotEqual(
+            comtst.rdiff_backup_action(
+                True,
+                None,
+                self.bak_path,
+                None,
+                (),
+                b"verify",
+                ("--incremental", "--full-older-than", "wrong"),
+            ),
+            0,
+        )
+
+        # all tests were successful
+        self.success = True
+
     def tearDown(self):
         # we clean-up only if the test was successful
         if self.success:
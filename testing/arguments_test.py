@@ -144,6 +144,17 @@ class SelectActionTest(unittest.TestCase):
                 args = parser.parse_args(["--include-something-filelist", list_file])
         self.success = True
 
+    def test_argopts_non_negative_int(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--count", type=argopts.non_negative_int)
+        self.assertEqual(parser.parse_args(["--count", "0"]).count, 0)
+        self.assertEqual(parser.parse_args(["--count", "3"]).count, 3)
+        with self.assertRaises(SystemExit):
+            parser.parse_args(["--count", "-1"])
+        with self.assertRaises(SystemExit):
+            parser.parse_args(["--count", "x"])
+        self.success = True
+
     def tearDown(self):
         # we clean-up only if the test was successful
         if self.success:
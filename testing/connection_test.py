@@ -2,17 +2,19 @@
 Test the connection functionality of rdiff-backup
 """
 
+import io
 import os
 import subprocess
 import sys
 import unittest
+from unittest import mock
 import errno
 
 import commontest as comtst
 
 from rdiff_backup import connection, rpath, Security, SetConnections
 from rdiffbackup.locations.map import filenames as map_filenames
-from rdiffbackup.singletons import specifics
+from rdiffbackup.singletons import generics, specifics
 
 TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
 
@@ -57,6 +59,14 @@ class LocalConnectionTest(unittest.TestCase):
         """Test string evaluation"""
         self.assertEqual(self.lc.reval("pow", 2, 3), 8)
 
+    def testBatch(self):
+        """Test batched calls, executed locally"""
+        with self.lc.batch() as batch:
+            pow_future = batch.call("pow", 2, 3)
+            name_future = batch.call("aoetnsu.aoehtnsu")
+        self.assertEqual(pow_future.result(), 8)
+        self.assertRaises(NameError, name_future.result)
+
 
 class LowLevelPipeConnectionTest(unittest.TestCase):
     """Test LLPC class"""
@@ -90,6 +100,41 @@ class LowLevelPipeConnectionTest(unittest.TestCase):
             self.assertEqual((234, inbuf), LLPC._get())
         os.unlink(self.filename)
 
+    def testCompression(self):
+        """Compressible data is sent compressed, other data as it is"""
+        compressible = b"abcdefgh" * 10000
+        incompressible = os.urandom(10000)
+        with open(self.filename, "wb") as outpipe:
+            LLPC = connection.LowLevelPipeConnection(None, outpipe)
+            LLPC.set_compression(1)
+            LLPC._putbuf(compressible, 1)
+            LLPC._putbuf(incompressible, 2)
+            LLPC._putobj(self.objs, 3)
+        self.assertLess(
+            os.path.getsize(self.filename), len(compressible) + len(incompressible)
+        )
+        with open(self.filename, "rb") as inpipe:
+            LLPC = connection.LowLevelPipeConnection(inpipe, None)
+            self.assertEqual(LLPC._get(), (1, compressible))
+            self.assertEqual(LLPC._get(), (2, incompressible))
+            self.assertEqual(LLPC._get(), (3, self.objs))
+        os.unlink(self.filename)
+
+    def testWriteBuffers(self):
+        """Buffers are written in order, with or without file descriptor"""
+        bufs = [b"header", b"", memoryview(b"0123456789")[2:], os.urandom(300000)]
+        with open(self.filename, "wb") as outpipe:
+            LLPC = connection.LowLevelPipeConnection(None, outpipe)
+            outpipe.write(b"buffered")
+            LLPC._write_buffers(bufs)
+        with open(self.filename, "rb") as inpipe:
+            self.assertEqual(inpipe.read(), b"buffered" + b"".join(bufs))
+        os.unlink(self.filename)
+        outpipe = io.BytesIO()
+        LLPC = connection.LowLevelPipeConnection(None, outpipe)
+        LLPC._write_buffers(bufs)
+        self.assertEqual(outpipe.getvalue(), b"".join(bufs))
+
     def testSendingExceptions(self):
         """Exceptions should also be sent down pipe well"""
         with open(self.filename, "wb") as outpipe:
@@ -156,6 +201,69 @@ class PipeConnectionTest(unittest.TestCase):
                 rpath._cmp_file_obj(self.conn.open(regfilename, "rb"), localfh)
             )
 
+    def testVirtualFileReadAhead(self):
+        """Test reading a remote file sequentially with read-ahead"""
+        temp_file = os.path.join(TEST_BASE_DIR, b"readahead")
+        content = bytes(range(256)) * 4
+        with open(temp_file, "wb") as localfh:
+            localfh.write(content)
+        remotefh = self.conn.open(temp_file, "rb")
+        chunks = [remotefh.read(3), remotefh.read(3), remotefh.read(3)]
+        self.assertTrue(remotefh._pending or remotefh._buffer)
+        chunks.append(remotefh.read(5))  # different length still works
+        chunks.append(remotefh.read())
+        self.assertEqual(b"".join(chunks), content)
+        self.assertEqual(remotefh.read(3), b"")
+        remotefh.close()
+        os.unlink(temp_file)
+
+    def testBatch(self):
+        """Test batched calls and their futures"""
+        with self.conn.batch() as batch:
+            pow_future = batch.call("pow", 2, 3)
+            error_future = batch.call("os.lstat", "asoeut haosetnuhaoseu tn")
+            name_future = batch.call("aoetnsu.aoehtnsu")
+            ord_future = batch.call("ord", "a")
+            self.assertFalse(pow_future.done())
+        self.assertEqual(pow_future.result(), 8)
+        with self.assertRaises(os.error) as ctx:
+            error_future.result()
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+        self.assertRaises(NameError, name_future.result)
+        self.assertEqual(ord_future.result(), 97)
+        # batches are flushed automatically when full
+        batch = self.conn.batch(max_calls=2)
+        futures = [batch.call("str", i) for i in range(5)]
+        self.assertTrue(futures[3].done())
+        self.assertFalse(futures[4].done())
+        batch.flush()
+        self.assertEqual([f.result() for f in futures], ["0", "1", "2", "3", "4"])
+
+    def testGatheredSettings(self):
+        """Test settings sent to remote connections in a single batch"""
+        self.conn.conn_number = 1
+        conns = {0: specifics.local_connection, 1: self.conn}
+        with mock.patch.dict(specifics.connection_dict, conns, clear=True):
+            with generics.gathered_settings():
+                generics.set("null_separator", True)
+                generics.call_gathered(self.conn, "specifics.set", "eas_conn", True)
+                self.assertTrue(generics.null_separator)
+                self.assertFalse(self.conn.generics.get("null_separator"))
+            self.assertTrue(self.conn.generics.get("null_separator"))
+            self.assertTrue(self.conn.specifics.get("eas_conn"))
+            generics.set("null_separator", False)
+        self.assertFalse(generics.null_separator)
+
+    def testWireCompression(self):
+        """Test a connection compressed in both directions"""
+        self.conn.SetConnections.set_wire_compression_remote(1)
+        self.conn.set_compression(1)
+        data = b"compress me " * 10000
+        self.assertEqual(self.conn.bytes(data), data)
+        self.assertEqual(self.conn.reval("len", data), len(data))
+        self.assertRaises(NameError, self.conn.reval, "aoetnsu aoehtnsu")
+        self.assertEqual(self.conn.pow(2, 3), 8)
+
     def testString(self):
         """Test transmitting strings"""
         self.assertEqual("32", self.conn.str(32))
@@ -181,7 +181,7 @@ class IncrementTest(unittest.TestCase):
             b"a.b.missing.gz": None,  # wrong time string
             b"a.b.data": None,
             b"a.1970-01-01T03:46:40+01:00.missing.gz": (  # happy path
-                True,
+                b"gz",
                 b"1970-01-01T03:46:40+01:00",
                 10_000,
                 b"missing",
@@ -195,12 +195,27 @@ class IncrementTest(unittest.TestCase):
                 b"a",
             ),
             b"a.b.c.1970-01-01T03:46:40+00:00.dir.gz": (  # with superfluous dots
-                True,
+                b"gz",
                 b"1970-01-01T03:46:40+00:00",
                 13_600,
                 b"dir",
                 b"a.b.c",
             ),
+            b"a.1970-01-01T03:46:40+00:00.diff.xz": (  # other codecs
+                b"xz",
+                b"1970-01-01T03:46:40+00:00",
+                13_600,
+                b"diff",
+                b"a",
+            ),
+            b"a.1970-01-01T03:46:40+00:00.snapshot.zst": (
+                b"zst",
+                b"1970-01-01T03:46:40+00:00",
+                13_600,
+                b"snapshot",
+                b"a",
+            ),
+            b"a.1970-01-01T03:46:40+00:00.snapshot.bz": None,  # unknown codec
             b"a.b.c.1970-01-01T03:46:40-05:30.snapshot": (
                 False,
                 b"1970-01-01T03:46:40-05:30",
@@ -157,6 +157,39 @@ class testMiscIters(unittest.TestCase):
 
         self.assertRaises(StopIteration, i_out.__next__)
 
+    def testReadLength(self):
+        """Test reading MiscIterToFile in pieces, with a large file"""
+        big_file = self.outputrp.append("big")
+        content = bytes(range(256)) * 3000  # several blocks
+        big_file.write_bytes(content)
+
+        def get_iter():
+            big_rp = self.outputrp.append("big")
+            big_rp.setfile(big_rp.open("rb"))
+            return iter([5, big_rp, self.regfile3, "hello"])
+
+        whole = iterfile.MiscIterToFile(get_iter(), max_buffer_bytes=2**24).read()
+        self.regfile3.file = None
+        self.regfile3.setfile(self.regfile3.open("rb"))
+        filelike = iterfile.MiscIterToFile(get_iter())
+        pieces = []
+        while sum(map(len, pieces)) < len(whole):
+            pieces.append(filelike.read(1000))
+            self.assertLessEqual(len(pieces[-1]), 1000)
+        self.assertEqual(b"".join(pieces), whole)
+
+        i_out = iterfile.FileToMiscIter(io.BytesIO(whole))
+        self.assertEqual(next(i_out), 5)
+        out = next(i_out)
+        self.assertEqual(out, big_file)
+        fp = out.open("rb")
+        self.assertEqual(fp.read(), content)
+        self.assertFalse(fp.close())
+        out = next(i_out)
+        self.assertEqual(out.open("rb").read(3), b"goo")
+        self.assertEqual(next(i_out), "hello")
+        self.assertRaises(StopIteration, i_out.__next__)
+
     def testFlush(self):
         """Test flushing property of MiscIterToFile"""
         rplist = [self.outputrp, iterfile.MiscIterFlush, self.outputrp]
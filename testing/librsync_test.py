@@ -2,6 +2,7 @@
 Test the librsync functionality
 """
 
+import io
 import os
 import random
 import subprocess
@@ -132,9 +133,13 @@ class LibrsyncTest(unittest.TestCase):
             sf.close()
 
             sig_gen = librsync.SigGenerator()
+            basis_size = os.path.getsize(self.basis.path)
             with self.basis.open("rb") as infile:
                 while 1:
-                    buf = infile.read(1000)
+                    # small and uneven reads, like those of a patched file
+                    buf = infile.read(random.choice((0, 1, 7, 1000, 70000)))
+                    if not buf and infile.tell() < basis_size:
+                        continue
                     if not buf:
                         break
                     sig_gen.update(buf)
@@ -242,6 +247,55 @@ class LibrsyncTest(unittest.TestCase):
 
             self.assertEqual(real_new, librsync_new)
 
+    def testLazyPatchedFile(self):
+        """Test lazy patching with handcrafted deltas, also stacked"""
+        basis = b"0123456789"
+        delta1 = (
+            b"rs\x026"
+            + b"\x03abc"  # literal of 3 bytes
+            + b"\x45\x02\x04"  # copy 4 bytes from offset 2
+            + b"\x41\x05fghij"  # literal of 5 bytes with 1 byte length
+            + b"\x49\x00\x08\x02"  # copy 2 bytes from 2 bytes offset 8
+            + b"\x00"
+        )
+        pf = librsync.LazyPatchedFile(io.BytesIO(basis), io.BytesIO(delta1))
+        self.assertEqual(pf.read(), b"abc2345fghij89")
+        pf.seek(5)
+        self.assertEqual(pf.read(4), b"45fg")
+        self.assertEqual(pf.tell(), 9)
+        pf.seek(-2, io.SEEK_END)
+        self.assertEqual(pf.read(), b"89")
+        delta2 = b"rs\x026" + b"\x45\x07\x05" + b"\x01!" + b"\x45\x00\x03\x00"
+        pf2 = librsync.LazyPatchedFile(pf, io.BytesIO(delta2))
+        self.assertEqual(pf2.read(), b"fghij!abc")
+        pf2.close()
+        self.assertTrue(pf.closed)
+
+        with self.assertRaises(librsync.librsyncError):
+            librsync.LazyPatchedFile(io.BytesIO(basis), io.BytesIO(b"rs\x026\x05ab"))
+        with self.assertRaises(librsync.librsyncError):
+            librsync.LazyPatchedFile(io.BytesIO(basis), io.BytesIO(b"bad magic"))
+
+    def testLazyPatchedFileChain(self):
+        """Test lazy patching of a chain of deltas against real files"""
+        versions = [os.urandom(50000)]
+        for i in range(4):
+            data = bytearray(versions[-1])
+            data[i * 10000 : i * 10000 + 500] = os.urandom(1000)
+            versions.append(bytes(data[3000:] + data[:3000]))
+        # deltas from each version to the previous one, like increments
+        deltas = []
+        for newer, older in zip(versions[1:], versions[:-1]):
+            sig = librsync.SigFile(io.BytesIO(newer)).read()
+            df = librsync.DeltaFile(io.BytesIO(sig), io.BytesIO(older))
+            deltas.append(df.read())
+            df.close()
+        fp = io.BytesIO(versions[-1])
+        for delta in reversed(deltas):
+            fp = librsync.LazyPatchedFile(fp, io.BytesIO(delta))
+        self.assertEqual(fp.read(), versions[0])
+        fp.close()
+
 
 if __name__ == "__main__":
     unittest.main()
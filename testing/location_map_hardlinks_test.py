@@ -3,11 +3,15 @@ Test the handling of hardlinks
 """
 
 import os
+import tempfile
 import unittest
 
 import commontest as comtst
 import fileset
 
+from rdiff_backup import rpath
+from rdiffbackup.locations.map import hardlinks as map_hardlinks
+
 TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
 
 
@@ -70,7 +74,7 @@ class LocationMapHardlinksTest(unittest.TestCase):
                 self.bak_path,
                 ("--current-time", "20000"),
                 b"backup",
-                (),
+                ("--hard-links-memory-limit", "1"),
             ),
             0,
         )
@@ -114,5 +118,111 @@ class LocationMapHardlinksTest(unittest.TestCase):
             fileset.remove_fileset(self.base_dir, {"to1": {"type": "dir"}})
 
 
+class LocationMapHardlinksIndexTest(unittest.TestCase):
+    """
+    Test the hard link dictionaries, also when spilled to disk
+    """
+
+    def _get_rorp(self, index, inode, nlink=2, sha1=None):
+        data = {"type": "reg", "nlink": nlink, "inode": inode, "devloc": 42}
+        if sha1:
+            data["sha1"] = sha1
+        return rpath.RORPath(index, data)
+
+    def test_inode_index_spill(self):
+        """test that a bounded inode index behaves like a dictionary"""
+        inode_index = map_hardlinks._InodeIndex(4)
+        store_paths = []
+        old_mkstemp = tempfile.mkstemp
+
+        def mkstemp(*args, **kwargs):
+            temp_fd, temp_path = old_mkstemp(*args, **kwargs)
+            store_paths.append(temp_path)
+            return temp_fd, temp_path
+
+        tempfile.mkstemp = mkstemp
+        try:
+            for key in range(20):
+                inode_index[key] = ("value", key)
+        finally:
+            tempfile.mkstemp = old_mkstemp
+        self.assertEqual(len(inode_index._entries), 4)
+        self.assertGreater(inode_index.spilled, 0)
+        self.assertEqual(len(store_paths), 1)
+        # the database is removed as soon as it's open, where possible
+        if os.name != "nt":
+            self.assertFalse(os.path.exists(store_paths[0]))
+        self.assertIn(0, inode_index)
+        self.assertNotIn(20, inode_index)
+        self.assertEqual(inode_index[1], ("value", 1))
+        inode_index[2] = ("changed", 2)
+        self.assertEqual(inode_index.get(2), ("changed", 2))
+        self.assertEqual(inode_index.pop(3), ("value", 3))
+        self.assertIsNone(inode_index.pop(3))
+        del inode_index[4]
+        with self.assertRaises(KeyError):
+            inode_index[4]
+        self.assertEqual(
+            {key: inode_index.get(key) for key in range(20)},
+            {
+                key: ("changed" if key == 2 else "value", key)
+                for key in range(20)
+                if key not in (3, 4)
+            }
+            | {3: None, 4: None},
+        )
+        inode_index.close()
+        self.assertFalse(os.path.exists(store_paths[0]))
+
+    def test_compact_keys(self):
+        """test the packed inode keys and indexes"""
+        self.assertEqual(
+            map_hardlinks._get_inode_key(self._get_rorp((b"a",), 7)), 42 << 64 | 7
+        )
+        self.assertEqual(
+            map_hardlinks._get_inode_key(self._get_rorp((b"a",), 1 << 100)),
+            (1 << 100, 42),
+        )
+        for index in ((), (b"a",), (b"a", b"b", b"c")):
+            self.assertEqual(
+                map_hardlinks._unpack_index(*map_hardlinks._pack_index(index)),
+                index,
+            )
+        # files in the same directory share the same directory path
+        dir_path1, name1 = map_hardlinks._pack_index((b"dir", b"sub", b"x"))
+        dir_path2, name2 = map_hardlinks._pack_index((b"dir", b"sub", b"y"))
+        self.assertIs(dir_path1, dir_path2)
+
+    def test_hardlinks_spilled(self):
+        """test hard link detection with most information on disk"""
+        map_hardlinks.initialize(1)  # one entry per dictionary
+        try:
+            firsts = [
+                self._get_rorp((b"dir", b"first%d" % i), i, sha1="%040x" % i)
+                for i in range(10)
+            ]
+            for rorp in firsts:
+                map_hardlinks.add_rorp(rorp, rorp)
+                self.assertFalse(map_hardlinks.is_linked(rorp))
+            self.assertGreater(map_hardlinks._inode_index.spilled, 0)
+            for i in range(10):
+                rorp = self._get_rorp((b"other", b"second%d" % i), i)
+                map_hardlinks.add_rorp(rorp, rorp)
+                self.assertTrue(map_hardlinks.is_linked(rorp))
+                self.assertTrue(map_hardlinks.rorp_eq(rorp, rorp))
+                self.assertEqual(
+                    map_hardlinks.get_link_index(rorp), (b"dir", b"first%d" % i)
+                )
+                self.assertEqual(map_hardlinks.get_sha1(rorp), "%040x" % i)
+                self.assertEqual(map_hardlinks.del_rorp(firsts[i]), 0)
+                self.assertEqual(map_hardlinks.del_rorp(rorp), 1)
+            for rorp in firsts:
+                self.assertNotIn(
+                    map_hardlinks._get_inode_key(rorp), map_hardlinks._inode_index
+                )
+        finally:
+            map_hardlinks.initialize()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,218 @@
+"""
+Test the source stat cache
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+import commontest as comtst
+import fileset
+
+from rdiff_backup import rpath, selection, Security
+from rdiffbackup.locations import stat_cache
+from rdiffbackup.singletons import specifics
+
+TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "Stat cache not supported")
+class LocationStatCacheTest(unittest.TestCase):
+    """
+    Test that the stat cache avoids reading metadata of unchanged files
+    """
+
+    def setUp(self):
+        self.base_dir = os.path.join(TEST_BASE_DIR, b"location_stat_cache")
+        self.from_struct = {
+            "from": {
+                "contents": {
+                    "dir1": {
+                        "contents": {
+                            "fileA": {"content": "initial"},
+                            "fileB": {"content": "initial"},
+                        }
+                    },
+                    "dir2": {"contents": {"fileC": {"content": "initial"}}},
+                    "fileD": {"content": "initial"},
+                }
+            }
+        }
+        fileset.create_fileset(self.base_dir, self.from_struct)
+        self.from_path = os.path.join(self.base_dir, b"from")
+        self.cache_path = os.path.join(self.base_dir, b"stat_cache.gz")
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+    def _select_all(self):
+        """Iterate through the source with a new stat cache, return it"""
+        cache = stat_cache.StatCache(self.cache_path, self.from_path)
+        sel = selection.Select(
+            rpath.RPath(specifics.local_connection, self.from_path), cache
+        )
+        sel.parse_selection_args()
+        rps = list(sel.get_select_iter())
+        return cache, rps
+
+    def test_stat_cache_hits(self):
+        """verify that unchanged files are taken from the cache"""
+        cache, first_rps = self._select_all()
+        self.assertEqual((cache.hits, cache.misses), (0, 6))
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        with mock.patch.object(
+            rpath, "_add_rpath_metadata", wraps=rpath._add_rpath_metadata
+        ) as add_metadata:
+            cache, second_rps = self._select_all()
+        self.assertEqual((cache.hits, cache.misses), (6, 0))
+        # only the root directory isn't cached
+        self.assertEqual({call.args[1] for call in add_metadata.call_args_list}, {()})
+        self.assertEqual(first_rps, second_rps)
+        for first_rp, second_rp in zip(first_rps, second_rps):
+            self.assertEqual(first_rp.data, second_rp.data)
+
+        # a change of permissions changes the ctime and forces a new read
+        os.chmod(os.path.join(self.from_path, b"dir1", b"fileB"), 0o600)
+        os.remove(os.path.join(self.from_path, b"fileD"))
+        with mock.patch.object(
+            rpath, "_add_rpath_metadata", wraps=rpath._add_rpath_metadata
+        ) as add_metadata:
+            cache, third_rps = self._select_all()
+        self.assertEqual(add_metadata.call_count - 2, cache.misses)
+        self.assertIn(b"fileB", add_metadata.call_args_list[-1].args[1])
+        self.assertEqual(cache.hits + cache.misses, 5)
+        self.assertEqual(len(third_rps), 6)
+
+    def test_cache_restricted(self):
+        """verify that a server only uses a cache within the restrict path"""
+        with (
+            mock.patch.object(specifics, "server", True),
+            mock.patch.object(Security, "_security_level", "read-write"),
+            mock.patch.object(Security, "_restrict_path", self.from_path),
+            mock.patch.object(
+                Security, "_restrict_path_list", self.from_path.split(b"/")
+            ),
+        ):
+            for get_cache in (stat_cache.get_stat_cache, stat_cache.get_hash_cache):
+                for cache_path in (
+                    self.cache_path,
+                    os.path.join(self.from_path, b"..", b"cache.gz"),
+                ):
+                    self.assertRaises(
+                        Security.Violation, get_cache, cache_path, self.from_path
+                    )
+                inside_path = os.path.join(self.from_path, b"cache.gz")
+                get_cache(inside_path, self.from_path).close()
+                os.remove(inside_path)
+                with mock.patch.object(Security, "_security_level", "read-only"):
+                    self.assertRaises(
+                        Security.Violation, get_cache, inside_path, self.from_path
+                    )
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_stat_cache_mismatch(self):
+        """verify that a cache of another source directory isn't used"""
+        self._select_all()
+        cache = stat_cache.StatCache(self.cache_path, self.base_dir)
+        self.assertIsNone(cache._old_fp)
+        cache.close()
+
+    def test_stat_cache_corrupted(self):
+        """verify that a corrupted cache is simply re-created"""
+        with open(self.cache_path, "wb") as cache_fp:
+            cache_fp.write(b"not a cache")
+        cache, rps = self._select_all()
+        self.assertEqual((cache.hits, cache.misses), (0, 6))
+        cache, rps = self._select_all()
+        self.assertEqual((cache.hits, cache.misses), (6, 0))
+
+
+class LocationHashCacheTest(unittest.TestCase):
+    """
+    Test that the hash cache remembers the hashes of unchanged files
+    """
+
+    def setUp(self):
+        self.base_dir = os.path.join(TEST_BASE_DIR, b"location_hash_cache")
+        self.from_struct = {
+            "from": {
+                "contents": {
+                    "fileA": {"content": "initial"},
+                    "fileB": {"content": "initial"},
+                    "fileC": {"content": "initial"},
+                }
+            }
+        }
+        fileset.create_fileset(self.base_dir, self.from_struct)
+        self.from_path = os.path.join(self.base_dir, b"from")
+        self.cache_path = os.path.join(self.base_dir, b"hash_cache.gz")
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+    def _lstat(self, name):
+        return os.lstat(os.path.join(self.from_path, name))
+
+    def test_hash_cache_hits(self):
+        """verify that only the hashes of unchanged files are returned"""
+        cache = stat_cache.HashCache(self.cache_path, self.from_path)
+        for name in (b"fileA", b"fileB", b"fileC"):
+            self.assertIsNone(cache.get((name,), self._lstat(name)))
+            cache.set((name,), self._lstat(name), name.decode())
+        cache.close()
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+        # fileA isn't set again but is kept, fileB is changed, fileC removed
+        # but kept without being checked, as its record can't match anymore
+        os.chmod(os.path.join(self.from_path, b"fileB"), 0o600)
+        os.remove(os.path.join(self.from_path, b"fileC"))
+        cache = stat_cache.HashCache(self.cache_path, self.from_path)
+        self.assertIsNone(cache.get((b"fileB",), self._lstat(b"fileB")))
+        cache.set((b"fileB",), self._lstat(b"fileB"), "newB")
+        cache.close()
+
+        cache = stat_cache.HashCache(self.cache_path, self.from_path)
+        self.assertEqual(cache.get((b"fileA",), self._lstat(b"fileA")), "fileA")
+        self.assertEqual(cache.get((b"fileB",), self._lstat(b"fileB")), "newB")
+        cache.close()
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        cache = stat_cache.HashCache(self.cache_path, self.from_path)
+        self.assertEqual(
+            cache._old_record[:2],
+            ((b"fileA",), stat_cache._get_stat_key(self._lstat(b"fileA"))),
+        )
+        cache._old_record = cache._read_old_record()
+        self.assertEqual(cache._old_record[0], (b"fileB",))
+        self.assertEqual(cache._read_old_record()[0], (b"fileC",))
+        cache.close()
+        with mock.patch.object(stat_cache.os, "lstat") as lstat:
+            cache = stat_cache.HashCache(self.cache_path, self.from_path)
+            cache.close()
+        lstat.assert_not_called()
+
+    def test_hash_cache_untrusted(self):
+        """verify that a cache writable by others isn't unpickled"""
+        cache = stat_cache.HashCache(self.cache_path, self.from_path)
+        cache.set((b"fileA",), self._lstat(b"fileA"), "fileA")
+        cache.close()
+        self.assertEqual(os.stat(self.cache_path).st_mode & 0o777, 0o600)
+        os.chmod(self.cache_path, 0o666)
+        with mock.patch.object(stat_cache.pickle, "load") as load:
+            cache = stat_cache.HashCache(self.cache_path, self.from_path)
+        load.assert_not_called()
+        self.assertIsNone(cache._old_fp)
+        cache.close()
+        self.assertEqual(os.stat(self.cache_path).st_mode & 0o777, 0o600)
+
+    def test_hash_cache_mismatch(self):
+        """verify that a cache of another source directory isn't used"""
+        cache = stat_cache.HashCache(self.cache_path, self.from_path)
+        cache.set((b"fileA",), self._lstat(b"fileA"), "fileA")
+        cache.close()
+        cache = stat_cache.HashCache(self.cache_path, self.base_dir)
+        self.assertIsNone(cache._old_fp)
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,7 +10,7 @@ import unittest
 import commontest as comtst
 import fileset
 
-from rdiff_backup import rpath, selection
+from rdiff_backup import rpath, Security, selection
 from rdiffbackup import meta_mgr
 from rdiffbackup.locations import increment
 from rdiffbackup.meta import stdattr
@@ -61,6 +61,78 @@ class MetadataTest(unittest.TestCase):
             new_rorp = stdattr.AttrExtractor._record_to_object(record)
             self.assertEqual(new_rorp, rp)
 
+    def testRORP2Binary(self):
+        """Test turning RORPs into binary records and back again"""
+        for rp in self.get_rpaths():
+            record = stdattr.AttrFile._object_to_binary(rp)
+            new_rorp = stdattr.AttrExtractor._binary_to_object(rp.index, record)
+            self.assertEqual(new_rorp, rp)
+
+    def testRecordFastPath(self):
+        """Test that fast and reference text records are the same"""
+        common = {"uid": 1000, "gid": 100, "perms": 0o644, "mtime": 1234567}
+        rorps = [
+            rpath.RORPath((), dict(common, type="dir", uname="user", gname=None)),
+            rpath.RORPath(
+                (b"dir", b"file\nwith\\newline"),
+                dict(common, type="reg", size=10, uname="üser", gname="group"),
+            ),
+            rpath.RORPath(
+                (b"hardlink",),
+                dict(
+                    common,
+                    type="reg",
+                    size=0,
+                    nlink=3,
+                    inode=42,
+                    devloc=7,
+                    sha1="da39a3ee5e6b4b0d3255bfef95601890afd80709",
+                ),
+            ),
+            rpath.RORPath(
+                (b"sym",),
+                dict(common, type="sym", linkname=b"../target\n", mirrorname=b"x"),
+            ),
+            rpath.RORPath((b"fifo",), dict(common, type="fifo", incname=b"inc")),
+            rpath.RORPath((b"dev",), dict(common, type="dev", devnums=("c", 4, 64))),
+            rpath.RORPath((b"deleted",), {"type": None}),
+        ]
+        for rorp in rorps:
+            record = stdattr.AttrFile._object_to_record(rorp)
+            self.assertEqual(record, stdattr.AttrFile._reference_object_to_record(rorp))
+            fast_rorp = stdattr.AttrExtractor._record_to_object(record)
+            ref_rorp = stdattr.AttrExtractor._reference_record_to_object(record)
+            self.assertEqual(fast_rorp.index, rorp.index)
+            self.assertEqual(fast_rorp.data, ref_rorp.data)
+            self.assertEqual(fast_rorp, rorp)
+
+        # unknown fields and malformed lines are left to the reference code
+        record = b"File foo\n  Type fifo\n  Unknown 1\n  Uid \ngarbage\n"
+        self.assertEqual(
+            stdattr.AttrExtractor._record_to_object(record).data,
+            {"type": "fifo"},
+        )
+
+    def testRecordSplitting(self):
+        """Test that records are split right even across blocks"""
+        rorps = [
+            rpath.RORPath(
+                (b"file%d" % i,),
+                {"type": "fifo", "mtime": i, "uid": i, "gid": 0, "perms": 0o600},
+            )
+            for i in range(100, 200)
+        ]
+        text = b"".join(map(stdattr.AttrFile._object_to_record, rorps))
+        for blocksize in (1, 7, 64, len(text)):
+            extractor = stdattr.AttrExtractor(io.BytesIO(text))
+            extractor.blocksize = blocksize
+            self.assertEqual(list(extractor.iterate()), rorps)
+            extractor = stdattr.AttrExtractor(io.BytesIO(text))
+            extractor.blocksize = blocksize
+            self.assertEqual(
+                list(extractor._iterate_starting_with((b"file142",))), [rorps[42]]
+            )
+
     def testIterator(self):
         """Test writing RORPs to file and iterating them back"""
 
@@ -80,10 +152,13 @@ class MetadataTest(unittest.TestCase):
             self.assertTrue(rplist[i]._equal_verbose(outlist[i]))
         fp.close()
 
-    def write_metadata_to_temp(self, compress):
+    def write_metadata_to_temp(self, compress, binary=False):
         """If necessary, write metadata of bigdir to file metadata.gz"""
-        meta_file_name = "mirror_metadata.2005-11-03T14:51:06-06:00.snapshot"
-        if compress:
+        if binary:
+            meta_file_name = "mirror_metadata.2005-11-03T15:51:06-06:00.snapshot"
+        else:
+            meta_file_name = "mirror_metadata.2005-11-03T14:51:06-06:00.snapshot"
+        if compress and not binary:
             meta_file_name += ".gz"
         temprp = self.out_rp.append(meta_file_name)
         if temprp.lstat():
@@ -109,7 +184,7 @@ class MetadataTest(unittest.TestCase):
         rpath_iter = selection.Select(rootrp).get_select_iter()
 
         start_time = time.time()
-        mf = stdattr.AttrFile(temprp, "w", compress=compress)
+        mf = stdattr.AttrFile(temprp, "w", compress=compress, binary=binary)
         for rp in rpath_iter:
             mf.write_object(rp)
         mf.close()
@@ -155,14 +230,14 @@ class MetadataTest(unittest.TestCase):
         """
         return self.helper_speed(compress=False)
 
-    def helper_iterate_restricted(self, compress):
+    def helper_iterate_restricted(self, compress, binary=False):
         """
         Test getting rorps restricted to certain index
 
         In this case, get assume subdir (subdir3, subdir10) has 50
         files in it.
         """
-        temprp = self.write_metadata_to_temp(compress=compress)
+        temprp = self.write_metadata_to_temp(compress=compress, binary=binary)
         mf = stdattr.AttrFile(temprp, "rb")
         start_time = time.time()
         i = 0
@@ -186,9 +261,21 @@ class MetadataTest(unittest.TestCase):
         """
         return self.helper_iterate_restricted(compress=False)
 
-    def helper_write(self, compress):
+    def test_iterate_restricted_binary(self):
+        """
+        Test getting rorps restricted to certain index from binary file
+        """
+        self.helper_iterate_restricted(compress=True, binary=True)
+        temprp = self.write_metadata_to_temp(compress=True, binary=True)
+        mf = stdattr.AttrFile(temprp, "r")
+        self.assertTrue(mf.is_binary())
+        self.assertEqual(len(list(mf.get_objects((b"subdir9",)))), 0)
+        mf = stdattr.AttrFile(temprp, "r")
+        self.assertEqual(len(list(mf.get_objects((b"subdir0",)))), 2551)
+
+    def helper_write(self, compress, binary=False):
         meta_file_name = "mirror_metadata.2005-11-03T12:51:06-06:00.snapshot"
-        if compress:
+        if compress and not binary:
             meta_file_name += ".gz"
         temprp = self.out_rp.append(meta_file_name)
         if temprp.lstat():
@@ -205,7 +292,7 @@ class MetadataTest(unittest.TestCase):
         rps = list(sel.get_select_iter())
 
         self.assertFalse(temprp.lstat())
-        write_mf = stdattr.AttrFile(temprp, "w", compress=compress)
+        write_mf = stdattr.AttrFile(temprp, "w", compress=compress, binary=binary)
         for rp in rps:
             write_mf.write_object(rp)
         write_mf.close()
@@ -228,6 +315,13 @@ class MetadataTest(unittest.TestCase):
         """
         return self.helper_write(compress=False)
 
+    def test_write_binary(self):
+        """
+        Test writing to binary metadata file, then reading back
+        """
+        self.helper_write(compress=True, binary=True)
+        self.helper_write(compress=False, binary=True)
+
     def test_patch(self):
         """Test combining 3 iters of metadata rorps"""
         comtst.re_init_rpath_dir(self.out_rp)
@@ -329,6 +423,102 @@ class MetadataTest(unittest.TestCase):
         compare(man, inc3, 30000)
         compare(man, inc4, 40000)
 
+    def test_meta_cache(self):
+        """Test caching of metadata replaced by diffs"""
+
+        def get_rorps(time):
+            return [
+                rpath.RORPath(
+                    (b"file%d" % i,),
+                    {
+                        "type": "reg",
+                        "size": time + i,
+                        "mtime": time,
+                        "uid": 0,
+                        "uname": None,
+                        "gid": 0,
+                        "gname": None,
+                        "perms": 0o644,
+                    },
+                )
+                for i in range(50)
+            ]
+
+        comtst.re_init_rpath_dir(self.out_rp)
+        cache_dir = self.out_rp.append(meta_mgr.CACHE_DIR)
+
+        def write_meta(meta_time, cache_size):
+            man = meta_mgr.PatchDiffMan(self.out_rp, cache_size)
+            writer = man._writer_helper(
+                b"snapshot", meta_time, stdattr.get_plugin_class()
+            )
+            for rorp in get_rorps(meta_time):
+                writer.write_object(rorp)
+            writer.close()
+            man.convert_meta_main_to_diff()
+            cache_dir.setdata()
+
+        write_meta(10000, 1024 * 1024)
+        self.assertFalse(cache_dir.lstat())
+        # the snapshot replaced by a diff is kept in the cache
+        write_meta(20000, 1024 * 1024)
+        self.assertEqual(len(cache_dir.listdir()), 1)
+
+        # the older metadata comes from the cache, without patching
+        man = meta_mgr.PatchDiffMan(self.out_rp)
+        man._iterate_patched_attr = None
+        self.assertEqual(
+            list(man._get_meta_main_at_time(10000, None)), get_rorps(10000)
+        )
+        self.assertEqual(
+            list(man._get_meta_main_at_time(10000, (b"file7",))),
+            [get_rorps(10000)[7]],
+        )
+        self.assertEqual(
+            list(man._get_meta_main_at_time(20000, None)), get_rorps(20000)
+        )
+        self.assertEqual(len(cache_dir.listdir()), 1)
+
+        # the oldest entries are evicted, as well as an entry bigger than
+        # the cache itself
+        write_meta(30000, 1)
+        self.assertEqual(cache_dir.listdir(), [])
+        man = meta_mgr.PatchDiffMan(self.out_rp)
+        self.assertEqual(
+            list(man._get_meta_main_at_time(10000, None)), get_rorps(10000)
+        )
+
+        write_meta(40000, 1024 * 1024)
+        self.assertEqual(len(cache_dir.listdir()), 1)
+        meta_mgr.invalidate_cache(self.out_rp)
+        cache_dir.setdata()
+        self.assertFalse(cache_dir.lstat())
+
+        # metadata patched from diffs when read is cached as well, unless
+        # the repository is accessed read-only
+        old_level = Security._security_level
+        Security._security_level = "read-only"
+        try:
+            man = meta_mgr.PatchDiffMan(self.out_rp, 1024 * 1024)
+            self.assertEqual(
+                list(man._get_meta_main_at_time(20000, None)), get_rorps(20000)
+            )
+        finally:
+            Security._security_level = old_level
+        cache_dir.setdata()
+        self.assertFalse(cache_dir.lstat())
+        man = meta_mgr.PatchDiffMan(self.out_rp, 1024 * 1024)
+        self.assertEqual(
+            list(man._get_meta_main_at_time(20000, (b"file3",))),
+            [get_rorps(20000)[3]],
+        )
+        cache_dir.setdata()
+        self.assertEqual(len(cache_dir.listdir()), 1)
+        man._iterate_patched_attr = None
+        self.assertEqual(
+            list(man._get_meta_main_at_time(20000, None)), get_rorps(20000)
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,6 +2,7 @@
 Compare results with call to rdiff utility
 """
 
+import gzip
 import os
 import random
 import sys
@@ -9,7 +10,7 @@ import unittest
 
 import commontest as comtst
 
-from rdiff_backup import Rdiff, rpath
+from rdiff_backup import hash, Rdiff, rpath
 from rdiffbackup.singletons import specifics
 
 TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
@@ -121,6 +122,93 @@ class RdiffTest(unittest.TestCase):
         self.assertTrue(rpath.cmp(self.new, self.output))
         list(map(rpath.RPath.delete, rplist))
 
+    def testRdiffDeltaPatchData(self):
+        """Test making signatures and deltas as bytes, like workers do"""
+        rplist = [self.basis, self.new, self.delta, self.output]
+        for rp in rplist:
+            if rp.lstat():
+                rp.delete()
+
+        MakeRandomFile(self.basis.path)
+        MakeRandomFile(self.new.path)
+        list(map(rpath.RPath.setdata, [self.basis, self.new]))
+        sig_data = Rdiff.get_signature_data(self.basis.path)
+        sigfp = Rdiff.get_signature(self.basis)
+        self.assertEqual(sig_data, sigfp.read())
+        sigfp.close()
+        temp_path, sha1_digest = Rdiff.get_delta_path_hash(
+            sig_data, self.new.path, os.fsdecode(TEST_BASE_DIR)
+        )
+        self.assertEqual(sha1_digest, hash.compute_sha1(self.new))
+        self.delta.write_from_fileobj(Rdiff.DeltaTempFile(temp_path, sha1_digest))
+        self.assertFalse(os.path.exists(temp_path))
+        Rdiff.patch_local(self.basis, self.delta, self.output)
+        self.assertTrue(rpath.cmp(self.new, self.output))
+        list(map(rpath.RPath.delete, rplist))
+
+    def testPatchDataToTempGzip(self):
+        """Test applying a chain of gzipped deltas, like workers do"""
+        rplist = [self.basis, self.new, self.output]
+        for rp in rplist:
+            if rp.lstat():
+                rp.delete()
+
+        MakeRandomFile(self.basis.path)
+        MakeRandomFile(self.new.path)
+        MakeRandomFile(self.output.path)
+        list(map(rpath.RPath.setdata, rplist))
+        paths = [(self.basis.path, None)]
+        for basis, new in ((self.basis, self.new), (self.new, self.output)):
+            delta_path = new.path + b".delta.gz"
+            delta_fp = Rdiff.DeltaTempFile(
+                *Rdiff.get_delta_path_hash(
+                    Rdiff.get_signature_data(basis.path),
+                    new.path,
+                    os.fsdecode(TEST_BASE_DIR),
+                )
+            )
+            with gzip.open(delta_path, "wb") as gzip_fp:
+                gzip_fp.write(delta_fp.read())
+            delta_fp.close()
+            paths.append((delta_path, b"gz"))
+        temp_path = Rdiff.patch_data_to_temp(paths, os.fsdecode(TEST_BASE_DIR))
+        with open(temp_path, "rb") as temp_fp:
+            self.assertEqual(temp_fp.read(), self.output.get_bytes())
+        os.unlink(temp_path)
+        for delta_path, suffix in paths[1:]:
+            os.unlink(delta_path)
+        list(map(rpath.RPath.delete, rplist))
+
+    def testPatchWithSignature(self):
+        """Test patching a file while getting its signature"""
+        rplist = [self.basis, self.new, self.delta, self.signature, self.output]
+        for rp in rplist:
+            if rp.lstat():
+                rp.delete()
+
+        MakeRandomFile(self.basis.path)
+        MakeRandomFile(self.new.path)
+        list(map(rpath.RPath.setdata, [self.basis, self.new]))
+        self.signature.write_from_fileobj(Rdiff.get_signature(self.basis))
+        self.delta.write_from_fileobj(
+            Rdiff.get_delta_sigrp_hash(self.signature, self.new)
+        )
+        out_sig = Rdiff.patch_local_with_signature(
+            self.basis, self.delta, self.output, self.new.getsize()
+        )[1]
+        self.assertTrue(rpath.cmp(self.new, self.output))
+        sigfp = Rdiff.get_signature(self.output)
+        self.assertEqual(out_sig, sigfp.read())
+        sigfp.close()
+
+        # the signature can be used to write the reverse delta
+        self.delta.delete()
+        Rdiff.write_delta(self.output, self.basis, self.delta, None, out_sig)
+        self.signature.delete()
+        Rdiff.patch_local(self.output, self.delta, self.signature)
+        self.assertTrue(rpath.cmp(self.basis, self.signature))
+        list(map(rpath.RPath.delete, rplist))
+
     def testWriteDelta(self):
         """Test write delta feature of rdiff"""
         if self.delta.lstat():
@@ -8,13 +8,15 @@ import sys
 import time
 import unittest
 import errno
+import hashlib
 
 import unittest.mock
 import commontest as comtst
 import fileset
 
-from rdiff_backup import rpath
-from rdiffbackup.singletons import specifics
+from rdiff_backup import hash, rpath
+from rdiffbackup.singletons import consts, generics, specifics
+from rdiffbackup.utils import parallel
 
 TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
 
@@ -41,6 +43,61 @@ class RORPStateTest(RPathTest):
         self.assertEqual(rorp2.index, rorp.index)
 
 
+class RORPCompareTest(unittest.TestCase):
+    """Test comparison and compactness of RORPaths"""
+
+    def _get_rorp(self, **kwargs):
+        data = {
+            "type": "reg",
+            "size": 10,
+            "perms": 0o644,
+            "uid": 1000,
+            "gid": 1000,
+            "uname": "user",
+            "gname": "group",
+            "inode": 12,
+            "devloc": 34,
+            "nlink": 1,
+            "mtime": 10000,
+            "ctime": 10000,
+        }
+        data.update(kwargs)
+        return rpath.RORPath(("dir", "file"), data)
+
+    def testCompare(self):
+        """Test which differences are ignored when comparing"""
+        rorp = self._get_rorp()
+        self.assertEqual(rorp, self._get_rorp())
+        self.assertEqual(rorp, self._get_rorp(atime=5, ctime=20000, inode=13))
+        self.assertNotEqual(rorp, self._get_rorp(mtime=20000))
+        self.assertNotEqual(rorp, rpath.RORPath(("dir", "other"), rorp.data))
+        # the inode is only compared for hard linked files
+        self.assertNotEqual(self._get_rorp(nlink=2), self._get_rorp(nlink=2, inode=13))
+        # missing user and group names are ignored for legacy reasons
+        other = self._get_rorp()
+        del other.data["uname"]
+        self.assertEqual(rorp, other)
+        self.assertNotEqual(rorp, self._get_rorp(uname="other"))
+        # the owner of symlinks isn't compared
+        self.assertEqual(
+            self._get_rorp(type="sym", uid=0, linkname=b"target"),
+            self._get_rorp(type="sym", uid=1, size=5, linkname=b"target"),
+        )
+        # special files may be replaced with empty regular files
+        self.assertEqual(self._get_rorp(type="fifo"), self._get_rorp(size=0))
+        self.assertTrue(rorp.equal_loose(self._get_rorp(uid=0, sha1="abc")))
+        self.assertFalse(rorp.equal_loose(self._get_rorp(perms=0o600)))
+
+    def testSlots(self):
+        """Test that RORPaths are compact but still picklable"""
+        rorp = self._get_rorp()
+        self.assertFalse(hasattr(rorp, "__dict__"))
+        for protocol in (1, consts.PICKLE_PROTOCOL):
+            rorp2 = pickle.loads(pickle.dumps(rorp, protocol))
+            self.assertEqual(rorp2.index, rorp.index)
+            self.assertEqual(rorp2.data, rorp.data)
+
+
 class CheckTypes(RPathTest):
     """Check to see if file types are identified correctly"""
 
@@ -423,6 +480,101 @@ class FileIO(RPathTest):
             self.assertEqual(read_s, s)
 
 
+class SparseCopying(unittest.TestCase):
+    """Test copying of (sparse) local files"""
+
+    lc = specifics.local_connection
+    write_dir = comtst.re_init_subdir(TEST_BASE_DIR, b"sparsecopy")
+
+    def setUp(self):
+        self.src = rpath.RPath(self.lc, self.write_dir, ("sparse_source",))
+        self.dest = rpath.RPath(self.lc, self.write_dir, ("sparse_dest",))
+        for rp in (self.src, self.dest):
+            if rp.lstat():
+                rp.delete()
+        with self.src.open("wb") as fp:
+            fp.truncate(64 << 20)
+            for offset in (0, 5 << 20, 40 << 20, (64 << 20) - 100):
+                fp.seek(offset)
+                fp.write(os.urandom(100000))
+        self.src.setdata()
+        with self.src.open("rb") as fp:
+            self.content = fp.read()
+
+    def _check_dest(self):
+        """Check that the destination has the same content, holes included"""
+        self.dest.setdata()
+        with self.dest.open("rb") as fp:
+            self.assertEqual(fp.read(), self.content)
+        if hasattr(os, "SEEK_DATA"):
+            self.assertLessEqual(
+                os.lstat(self.dest.path).st_blocks,
+                os.lstat(self.src.path).st_blocks + 16,
+            )
+
+    def testCopyLocal(self):
+        """Test kernel-assisted copy of a local sparse file"""
+        rpath.copy(self.src, self.dest)
+        self._check_dest()
+
+    def testCopyHashed(self):
+        """Test copy of a local sparse file while hashing it"""
+        self.assertIsInstance(
+            self.dest.write_from_fileobj(hash.FileWrapper(self.src.open("rb"))),
+            hash.Report,
+        )
+        self._check_dest()
+        self.dest.delete()
+        fp = hash.FileWrapper(self.src.open("rb"))
+        with self.dest.open("wb") as fp_out:
+            rpath.copyfileobj(fp, fp_out)
+        self.assertEqual(fp.close().sha1_digest, hashlib.sha1(self.content).hexdigest())
+        self._check_dest()
+
+    def testCopyGrowing(self):
+        """Test copy of a local file growing while being copied"""
+        copy_fd_range = rpath._copy_fd_range
+        appended = os.urandom(100000)
+
+        def copy_and_append(in_fd, out_fd, offset, count):
+            if offset == 0:
+                with open(self.src.path, "ab") as fp:
+                    fp.write(appended)
+            return copy_fd_range(in_fd, out_fd, offset, count)
+
+        with unittest.mock.patch.object(
+            rpath, "_copy_fd_range", side_effect=copy_and_append
+        ):
+            rpath.copy(self.src, self.dest)
+        self.content += appended
+        self._check_dest()
+
+    def testCopyFallback(self):
+        """Test copy of a local file without kernel support"""
+        with (
+            unittest.mock.patch.object(
+                rpath.os,
+                "copy_file_range",
+                side_effect=OSError(errno.EXDEV, "Cross-device link"),
+                create=True,
+            ),
+            unittest.mock.patch.object(
+                rpath.os,
+                "sendfile",
+                side_effect=OSError(errno.ENOTSOCK, "Not a socket"),
+                create=True,
+            ),
+        ):
+            rpath.copy(self.src, self.dest)
+        self._check_dest()
+
+    def tearDown(self):
+        for rp in (self.src, self.dest):
+            rp.setdata()
+            if rp.lstat():
+                rp.delete()
+
+
 class FileBasis(RPathTest):
 
     def setUp(self):
@@ -678,6 +830,40 @@ class Gzip(RPathTest):
         data = base_gz.get_bytes(compressed=1)
         self.assertEqual(data, b"lala")
 
+    def test_parallel_gzip(self):
+        """Test that compressed files are written in threads if requested"""
+        dirrp = rpath.RPath(self.lc, self.out_dir)
+        comtst.re_init_rpath_dir(dirrp)
+        data = os.urandom(100000) * 30
+        with unittest.mock.patch.object(generics, "compression_threads", 2):
+            src_rp = dirrp.append("source")
+            src_rp.write_bytes(data)
+            dest_rp = dirrp.append("dest.gz")
+            with dest_rp.open("wb", compress=1) as fp:
+                self.assertIsInstance(fp, parallel.GzipWriter)
+            dest_rp.delete()
+            rpath.copy(src_rp, dest_rp, compress=1)
+            dest_rp.setdata()
+            self.assertEqual(dest_rp.get_bytes(compressed=1), data)
+
+    def test_compression_codec(self):
+        """Test that files are written with the codec set and read by suffix"""
+        dirrp = rpath.RPath(self.lc, self.out_dir)
+        comtst.re_init_rpath_dir(dirrp)
+        base_rp = dirrp.append("foo")
+        with unittest.mock.patch.object(generics, "compression_codec", "xz"):
+            fileobj = rpath.MaybeGzip(base_rp)
+            fileobj.write(b"lala")
+            fileobj.close()
+        base_xz = dirrp.append("foo.xz")
+        self.assertTrue(base_xz.isreg())
+        with open(base_xz, "rb") as fp:
+            self.assertEqual(fp.read(6), b"\xfd7zXZ\x00")
+        # the suffix decides on the codec whatever the current setting
+        self.assertEqual(base_xz.get_bytes(compressed=b"xz"), b"lala")
+        with self.assertRaises(OSError):
+            base_xz.get_bytes(compressed=1)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1178,5 +1178,101 @@ class CommandTest(unittest.TestCase):
             fileset.remove_fileset(self.base_dir, {"bak": {"type": "dir"}})
 
 
+class ThreadedScannerTest(unittest.TestCase):
+    """
+    Test that the threaded scanner yields the same paths as the default one
+    """
+
+    def setUp(self):
+        self.base_dir = os.path.join(TEST_BASE_DIR, b"select_threaded_scanner")
+        contents = {"fileTop": {"content": "initial"}}
+        for dir_num in range(6):
+            contents["dir{}".format(dir_num)] = {
+                "contents": {
+                    "fileA": {"content": "initial"},
+                    "subdir": {"contents": {"fileB": {"content": "initial"}}},
+                    "emptyDir": {"type": "dir"},
+                }
+            }
+        self.from_struct = {"from": {"contents": contents}}
+        fileset.create_fileset(self.base_dir, self.from_struct)
+        self.from_rp = rpath.RPath(
+            specifics.local_connection, os.path.join(self.base_dir, b"from")
+        )
+
+    def _select(self, scan_threads, select_opts=()):
+        """Return the list of selected paths and their data"""
+        sel = selection.Select(self.from_rp, scan_threads=scan_threads)
+        sel.parse_selection_args(select_opts)
+        return [(rp.index, rp.data) for rp in sel.get_select_iter()]
+
+    def test_same_order(self):
+        """verify that the threaded scanner keeps the order and data"""
+        self.assertEqual(self._select(0), self._select(3))
+        self.assertEqual(len(self._select(3)), 32)
+
+    def test_stat_cache_order(self):
+        """verify that the stat cache is accessed in increasing index order"""
+
+        class OrderCache:
+            def __init__(self):
+                self.indexes = []
+
+            def get(self, index, statblock):
+                self.indexes.append(index)
+                return None
+
+            def set(self, index, statblock, data):
+                pass
+
+            def close(self):
+                pass
+
+        cache = OrderCache()
+        sel = selection.Select(self.from_rp, stat_cache=cache, scan_threads=3)
+        sel.parse_selection_args(())
+        self.assertEqual(len(list(sel.get_select_iter())), 32)
+        self.assertEqual(cache.indexes, sorted(cache.indexes))
+        self.assertEqual(len(cache.indexes), 31)
+
+    def test_excluded_prefetch(self):
+        """verify that listings of excluded directories are discarded"""
+        select_opts = (
+            ("exclude", os.path.join(self.from_rp.path, b"dir1")),
+            ("exclude", os.path.join(self.from_rp.path, b"dir3", b"subdir")),
+        )
+        old_prefetch = consts.SCAN_PREFETCH_PER_THREAD
+        consts.SCAN_PREFETCH_PER_THREAD = 1
+        try:
+            self.assertEqual(self._select(0, select_opts), self._select(2, select_opts))
+        finally:
+            consts.SCAN_PREFETCH_PER_THREAD = old_prefetch
+
+    def test_excluded_not_scanned(self):
+        """verify that excluded directories aren't even listed"""
+        select_opts = (
+            ("exclude", os.path.join(self.from_rp.path, b"dir1")),
+            ("exclude", os.path.join(self.from_rp.path, b"dir3", b"subdir")),
+        )
+        scanned = []
+        old_scan_directory = selection._scan_directory
+
+        def scan_directory(dir_path):
+            scanned.append(dir_path)
+            return old_scan_directory(dir_path)
+
+        selection._scan_directory = scan_directory
+        try:
+            self.assertEqual(self._select(0, select_opts), self._select(2, select_opts))
+        finally:
+            selection._scan_directory = old_scan_directory
+        self.assertEqual(len(scanned), 15)
+        self.assertFalse([path for path in scanned if b"dir1" in path])
+        self.assertNotIn(os.path.join(self.from_rp.path, b"dir3", b"subdir"), scanned)
+
+    def tearDown(self):
+        fileset.remove_fileset(self.base_dir, self.from_struct)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,73 @@
+"""
+Test the registry of compression codecs
+"""
+
+import os
+import unittest
+
+import commontest as comtst
+
+from rdiffbackup.utils import compressors
+
+TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
+
+
+class UtilsCompressorsTest(unittest.TestCase):
+    """
+    Test the compressors module
+    """
+
+    def setUp(self):
+        self.base_dir = os.path.join(TEST_BASE_DIR, b"utils_compressors")
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def test_registry(self):
+        """check names and suffixes of the codecs"""
+        self.assertIn(compressors.DEFAULT, compressors.get_names())
+        for name in ("gzip", "bzip2", "xz"):
+            self.assertTrue(compressors.is_available(name))
+            self.assertIn(name, compressors.get_available_names())
+        self.assertFalse(compressors.is_available("unknown"))
+        for name in compressors.get_names():
+            suffix = compressors.get_suffix(name)
+            self.assertEqual(compressors.get_name(suffix), name)
+        self.assertIsNone(compressors.get_name(b"snapshot"))
+
+    def test_round_trip(self):
+        """write and read back a file with each available codec"""
+        data = os.urandom(1000) * 100
+        for name in compressors.get_available_names():
+            with self.subTest(codec=name):
+                path = os.path.join(
+                    self.base_dir, b"file." + compressors.get_suffix(name)
+                )
+                with compressors.open_file(path, "w", name) as fp:
+                    self.assertTrue(compressors.is_compressed_file(fp))
+                    fp.write(data)
+                self.assertLess(os.path.getsize(path), len(data))
+                with compressors.open_file(path, "rb", name) as fp:
+                    self.assertTrue(compressors.is_compressed_file(fp))
+                    self.assertEqual(fp.read(), data)
+                os.remove(path)
+
+    def test_parallel_gzip(self):
+        """threads only change how gzip files are written"""
+        path = os.path.join(self.base_dir, b"file.gz")
+        with compressors.open_file(path, "wb", "gzip", threads=2) as fp:
+            fp.write(b"some data")
+        with compressors.open_file(path, "rb", "gzip") as fp:
+            self.assertEqual(fp.read(), b"some data")
+        os.remove(path)
+
+    def test_unavailable(self):
+        """an unavailable codec raises an OSError"""
+        with open(__file__, "rb") as fp:
+            self.assertFalse(compressors.is_compressed_file(fp))
+        with self.assertRaises(OSError):
+            compressors.open_file(
+                os.path.join(self.base_dir, b"file.unknown"), "wb", "unknown"
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Test the ordered pool of workers
+"""
+
+import gzip
+import math
+import os
+import unittest
+
+import commontest as comtst
+
+from rdiffbackup.utils import parallel
+
+TEST_BASE_DIR = comtst.get_test_base_dir(__file__)
+
+
+def _get_task(value):
+    """Offload only even values, and fail on values multiple of 7"""
+    if value % 2:
+        return None
+    return (math.sqrt, -value if value % 7 == 0 else value)
+
+
+def _get_killing_task(value):
+    """Kill the worker process on value 5"""
+    if value == 5:
+        return (os._exit, 1)
+    return (math.sqrt, value)
+
+
+class UtilsParallelTest(unittest.TestCase):
+    """
+    Test the parallel module
+    """
+
+    def _check_results(self, results):
+        """Validate order and results of the items"""
+        self.assertEqual([item for item, future in results], list(range(1, 100)))
+        for item, future in results:
+            if item % 2:
+                self.assertIsNone(future)
+            elif item % 7 == 0:
+                with self.assertRaises(ValueError):
+                    future.result()
+            else:
+                self.assertEqual(future.result(), math.sqrt(item))
+
+    def test_imap_ordered_processes(self):
+        """Test that processes return results in the order of the items"""
+        results = list(parallel.imap_ordered(range(1, 100), _get_task, 4))
+        self._check_results(results)
+
+    def test_imap_ordered_threads(self):
+        """Test that threads return results in the order of the items"""
+        results = list(
+            parallel.imap_ordered(range(1, 100), _get_task, 3, window=1, threads=True)
+        )
+        self._check_results(results)
+
+    def test_imap_ordered_broken(self):
+        """Test that a broken pool of processes doesn't stop the items"""
+        results = list(
+            parallel.imap_ordered(range(1, 100), _get_killing_task, 2, window=2)
+        )
+        self.assertEqual([item for item, future in results], list(range(1, 100)))
+        self.assertIsInstance(
+            results[4][1].exception(), parallel.WORKER_ERRORS
+        )  # value 5
+        # the remaining items are either broken or not offloaded anymore
+        for item, future in results[5:]:
+            if future is not None and future.exception() is not None:
+                self.assertIsInstance(future.exception(), parallel.WORKER_ERRORS)
+            elif future is not None:
+                self.assertEqual(future.result(), math.sqrt(item))
+
+    def test_imap_ordered_window(self):
+        """Test that no more than window items are read ahead"""
+        read_items = []
+
+        def items():
+            for item in range(1, 100):
+                read_items.append(item)
+                yield item
+
+        for item, future in parallel.imap_ordered(
+            items(), _get_task, 2, window=5, threads=True
+        ):
+            self.assertLessEqual(len(read_items), item + 5)
+
+
+class UtilsThreadTasksTest(unittest.TestCase):
+    """
+    Test the pool of threads running tasks
+    """
+
+    def test_thread_tasks(self):
+        """Test that all tasks are done once waited for"""
+        results = []
+        with parallel.ThreadTasks(3) as tasks:
+            for value in range(100):
+                tasks.submit(results.append, value)
+            tasks.wait()
+            self.assertEqual(sorted(results), list(range(100)))
+            tasks.submit(results.append, 100)
+        self.assertEqual(sorted(results), list(range(101)))
+
+    def test_thread_tasks_error(self):
+        """Test that exceptions of tasks are raised again"""
+        tasks = parallel.ThreadTasks(2)
+        tasks.submit(math.sqrt, 4)
+        tasks.submit(math.sqrt, -1)
+        with self.assertRaises(ValueError):
+            tasks.wait()
+        tasks.close()
+
+
+class UtilsGzipWriterTest(unittest.TestCase):
+    """
+    Test the parallel gzip writer
+    """
+
+    def setUp(self):
+        self.path = os.path.join(TEST_BASE_DIR, b"parallel.gz")
+
+    def _write_and_check(self, chunks):
+        """Write the chunks with the parallel writer, read back with gzip"""
+        with parallel.GzipWriter(self.path, 3) as writer:
+            writer.blocksize = 1000
+            for chunk in chunks:
+                self.assertEqual(writer.write(chunk), len(chunk))
+        self.assertTrue(writer.closed)
+        with gzip.GzipFile(self.path, "rb") as reader:
+            self.assertEqual(reader.read(), b"".join(chunks))
+
+    def test_gzip_writer(self):
+        """Test that the written data can be read back by GzipFile"""
+        chunks = [os.urandom(n) + bytes(n) for n in range(0, 2000, 37)]
+        self._write_and_check(chunks)
+        self._write_and_check([b"only one small block"])
+
+    def test_gzip_writer_empty(self):
+        """Test that an empty file is still a valid gzip file"""
+        self._write_and_check([])
+        self.assertGreater(os.path.getsize(self.path), 0)
+
+    def test_gzip_writer_flush(self):
+        """Test that flushed data can be read before closing"""
+        writer = parallel.GzipWriter(self.path, 2)
+        writer.write(b"first part")
+        writer.flush()
+        with gzip.GzipFile(self.path, "rb") as reader:
+            self.assertEqual(reader.read(), b"first part")
+        writer.write(b", second part")
+        writer.close()
+        writer.close()  # closing twice doesn't harm
+        with gzip.GzipFile(self.path, "rb") as reader:
+            self.assertEqual(reader.read(), b"first part, second part")
+
+
+if __name__ == "__main__":
+    unittest.main()